@@ -2,13 +2,16 @@ import sys
 
 from PySide6.QtWidgets import QApplication
 
-from core.widgets.main_window import MainWindow
+from core.widgets.main_window import (
+    MainWindow, sessionPath, tablePath, weightsPath
+)
 
 
 if __name__ == '__main__':
     app = QApplication(sys.argv)
+    app.setApplicationName('Py2048')
 
-    window = MainWindow()
+    window = MainWindow(sessionPath(), tablePath(), weightsPath())
     window.show()
 
     sys.exit(app.exec())
@@ -0,0 +1,117 @@
+'''
+TileGrid and GameController move/spawn paths.
+'''
+from benchmarks.fixtures import Game, boardExponents
+from benchmarks.harness import benchmark
+from core.game.direction import Direction
+from core.game.engine import (
+    chooseSpawns, clearLineCache, legacyTurnRandom, legalMoves, planMove,
+    turnRandom
+)
+
+
+SIZES = (4, 8, 64)
+DENSITIES = ('dense', 'sparse')
+
+
+def _checkMoveBench(size: int, density: str):
+    def setup():
+        game = Game(size, size, boardExponents(size, size, density))
+        grid = game.controller.grid()
+        pairs = [(i, j, i, j - 1)
+                 for i in range(size) for j in range(1, size)]
+
+        def run():
+            grid.beginTurn()
+            for pair in pairs:
+                grid.checkMove(*pair)
+            grid.endTurn()
+        run.game = game
+        return run
+    return setup
+
+
+def _moveBench(size: int, density: str, method: str):
+    def setup():
+        game = Game(size, size, boardExponents(size, size, density))
+        controller = game.controller
+        move = getattr(controller, method)
+
+        def run():
+            controller.beginTurn()
+            move()
+            controller.endTurn(False)
+        run.game = game
+        return run
+    return setup
+
+
+def _planBench(size: int, density: str, cached: bool):
+    def setup():
+        cells = boardExponents(size, size, density)
+
+        def run():
+            if not cached:
+                clearLineCache()
+            for direction in Direction:
+                planMove(cells, size, size, direction)
+        return run
+    return setup
+
+
+def _legalBench(size: int, density: str):
+    def setup():
+        cells = boardExponents(size, size, density)
+
+        def run():
+            legalMoves(cells, size, size)
+        return run
+    return setup
+
+
+def _spawnBench(size: int, density: str):
+    def setup():
+        game = Game(size, size, boardExponents(size, size, density))
+        controller = game.controller
+
+        def run():
+            controller.beginTurn()
+            controller.spawnRandom()
+            controller.endTurn(False)
+        run.game = game
+        return run
+    return setup
+
+
+def _turnSpawnBench(make):
+    'One seeded spawn on a half-empty 4x4 board, generator included'
+    def setup():
+        empty = 0x5A5A
+        turns = iter(range(1 << 62))
+
+        def run():
+            chooseSpawns(empty, 1, make(12345, next(turns)))
+        return run
+    return setup
+
+
+benchmark('engine.turnSpawn')(_turnSpawnBench(turnRandom))
+benchmark('engine.turnSpawn.legacy')(_turnSpawnBench(legacyTurnRandom))
+
+for _size in SIZES:
+    for _density in DENSITIES:
+        _suffix = f'[{_size}x{_size},{_density}]'
+        benchmark(f'grid.checkMove{_suffix}')(
+            _checkMoveBench(_size, _density))
+        benchmark(f'engine.legalMoves{_suffix}')(
+            _legalBench(_size, _density))
+        benchmark(f'engine.planMove{_suffix}')(
+            _planBench(_size, _density, True))
+        benchmark(f'engine.planMove.uncached{_suffix}')(
+            _planBench(_size, _density, False))
+        for _method in ('_moveUp', '_moveDown', '_moveLeft', '_moveRight'):
+            benchmark(f'controller.{_method}{_suffix}')(
+                _moveBench(_size, _density, _method))
+    benchmark(f'controller.spawnRandom[{_size}x{_size},sparse]')(
+        _spawnBench(_size, 'sparse'))
+
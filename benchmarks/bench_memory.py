@@ -0,0 +1,73 @@
+'''
+Memory growth over a long session.
+'''
+import random
+import resource
+import sys
+import tracemalloc
+
+from PySide6.QtCore import Qt, QEventLoop, QTimer
+
+from benchmarks.fixtures import Game, application
+from benchmarks.harness import metric
+from core.game.direction import Direction
+from core.game.engine import planMove
+
+
+TURNS = 400
+KEYS = {
+    Direction.Up: Qt.Key.Key_Up,
+    Direction.Down: Qt.Key.Key_Down,
+    Direction.Left: Qt.Key.Key_Left,
+    Direction.Right: Qt.Key.Key_Right,
+}
+
+
+def _maxRss() -> int:
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def _wait(ms: int):
+    loop = QEventLoop()
+    QTimer.singleShot(ms, loop.quit)
+    loop.exec()
+
+
+@metric('memory.long_session')
+def longSession():
+    app = application()
+    rng = random.Random(0)
+    game = Game(4, 4)
+    controller = game.controller
+    controller.start()
+    grid = controller.grid()
+
+    def play(turns: int):
+        for _ in range(turns):
+            keys = [key for direction, key in KEYS.items()
+                    if planMove(grid.exponents(), 4, 4, direction).changed]
+            if keys:
+                controller._processMove(rng.choice(keys))
+            else:
+                for _ in range(10):
+                    game.history.undo()
+            app.processEvents()
+
+    play(TURNS // 4)
+    _wait(300)
+    tracemalloc.start()
+    start_python = tracemalloc.get_traced_memory()[0]
+    start_rss = _maxRss()
+
+    play(TURNS)
+    _wait(300)
+    python_growth = tracemalloc.get_traced_memory()[0] - start_python
+    tracemalloc.stop()
+
+    return {
+        'python_bytes_per_turn': max(python_growth, 0) / TURNS,
+        'max_rss_growth_bytes': _maxRss() - start_rss,
+        'history_bytes': game.history.memoryUsage(),
+    }
@@ -0,0 +1,72 @@
+'''
+GameScene lookups with animation proxies on the scene.
+'''
+from PySide6.QtCore import QPoint
+
+from benchmarks.fixtures import Game, boardExponents
+from benchmarks.harness import benchmark
+from core.widgets.game_widget import AnimatedTile2D
+
+
+PROXY_COUNTS = (0, 256, 2048)
+
+
+def _scene(proxies: int):
+    exponents = boardExponents(4, 4, 'dense')
+    exponents[0] = 0
+    game = Game(4, 4, exponents)
+    for i in range(proxies):
+        game.scene.addItem(AnimatedTile2D(QPoint(i % 4, i // 4 % 4), 2))
+    return game
+
+
+def _findBench(proxies: int):
+    def setup():
+        game = _scene(proxies)
+        cell = QPoint(3, 3)
+
+        def run():
+            game.scene.findTiles2D(cell)
+        run.game = game
+        return run
+    return setup
+
+
+def _moveBench(proxies: int):
+    def setup():
+        game = _scene(proxies)
+        empty = QPoint(0, 0)
+        occupied = QPoint(1, 0)
+
+        def run():
+            game.scene.moveTile(empty, occupied)
+            game.scene.moveTile(occupied, empty)
+        run.game = game
+        return run
+    return setup
+
+
+for _proxies in PROXY_COUNTS:
+    benchmark(f'scene.findTiles2D[proxies={_proxies}]')(
+        _findBench(_proxies))
+    benchmark(f'scene.moveTile[proxies={_proxies}]')(_moveBench(_proxies))
+
+
+def _renderBench(proxies: int):
+    def setup():
+        from PySide6.QtGui import QImage, QPainter
+
+        game = _scene(proxies)
+        image = QImage(400, 400, QImage.Format.Format_ARGB32_Premultiplied)
+
+        def run():
+            painter = QPainter(image)
+            game.scene.render(painter)
+            painter.end()
+        run.game = game
+        return run
+    return setup
+
+
+for _proxies in (0, 256):
+    benchmark(f'scene.render[proxies={_proxies}]')(_renderBench(_proxies))
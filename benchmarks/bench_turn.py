@@ -0,0 +1,40 @@
+'''
+A whole turn going through the undo stack.
+'''
+from PySide6.QtCore import Qt
+
+from benchmarks.fixtures import Game
+from benchmarks.harness import benchmark
+from core.commands.turn_commands import TurnCommand
+from core.game.diff import TurnDiff, MOVE, SPAWN
+
+
+@benchmark('turn.do_undo_redo[4x4]')
+def turnCycle():
+    # Left always changes this board and undo brings it back,
+    # so every iteration starts from the same position
+    game = Game(4, 4, [1, 0, 1, 0,
+                       2, 2, 0, 0,
+                       0, 0, 0, 3,
+                       1, 2, 3, 4])
+
+    def run():
+        game.controller._processMove(Qt.Key.Key_Left)
+        game.history.undo()
+        game.history.redo()
+        game.history.undo()
+    run.game = game
+    return run
+
+
+@benchmark('turn.build[8x8]')
+def turnBuild():
+    # A turn moving every tile of a full row, built but never played
+    game = Game(8, 8)
+    diff = TurnDiff([(MOVE, i, i + 1) for i in range(0, 64, 2)]
+                    + [(SPAWN, 1, 1)], 0)
+
+    def run():
+        TurnCommand(diff, game.scene, game.controller.grid())
+    run.game = game
+    return run
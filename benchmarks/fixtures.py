@@ -0,0 +1,57 @@
+'''
+Qt objects for benchmarks, created on the offscreen platform.
+'''
+import os
+import random
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PySide6.QtCore import QPoint  # noqa: E402
+from PySide6.QtWidgets import QApplication, QWidget  # noqa: E402
+
+from core.commands.history import TurnHistory  # noqa: E402
+from core.game.game_controller import GameController  # noqa: E402
+from core.widgets.game_widget import GameScene  # noqa: E402
+
+
+def application() -> QApplication:
+    return QApplication.instance() or QApplication([])
+
+
+def boardExponents(rows: int, columns: int, density: str,
+                   seed=0) -> list[int]:
+    'Row-major exponents, every cell filled if dense, a quarter if sparse'
+    rng = random.Random(seed)
+    cells = rows * columns
+    if density == 'dense':
+        return [rng.randint(1, 4) for _ in range(cells)]
+    exponents = [0] * cells
+    for i in rng.sample(range(cells), cells // 4):
+        exponents[i] = rng.randint(1, 4)
+    return exponents
+
+
+class Game:
+    'Controller with its parent widget, scene and history'
+
+    def __init__(self, rows=4, columns=4,
+                 exponents: list[int] | None = None) -> None:
+        application()
+        self.widget = QWidget()
+        self.controller = GameController(rows, columns, self.widget)
+        self.scene = GameScene(self.widget)
+        self.controller.setScene(self.scene)
+        self.history = TurnHistory(self.controller.grid(), self.scene,
+                                   self.widget)
+        self.controller.setHistory(self.history)
+
+        if exponents is not None:
+            self.fill(exponents)
+
+    def fill(self, exponents: list[int]):
+        grid = self.controller.grid()
+        for i, exponent in enumerate(exponents):
+            if exponent:
+                row, col = divmod(i, grid.column_count)
+                grid.addTile(row, col, 1 << exponent)
+                self.scene.addTile(1 << exponent, QPoint(col, row))
@@ -0,0 +1,112 @@
+'''
+Minimal benchmark registry, timer and result comparison.
+
+A benchmark is a function registered with ``@benchmark`` that does its
+setup and returns a callable running one iteration. Memory benchmarks are
+registered with ``@metric`` and return their measurements directly.
+'''
+import json
+import os
+import platform
+import subprocess
+import time
+from typing import Callable
+
+
+BENCHMARKS: dict[str, Callable[[], Callable[[], object]]] = {}
+METRICS: dict[str, Callable[[], dict[str, float]]] = {}
+
+
+def benchmark(name: str):
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+
+def metric(name: str):
+    def register(func):
+        METRICS[name] = func
+        return func
+    return register
+
+
+def measure(run: Callable[[], object], repeat=5, min_time=.1) -> float:
+    'Best time per iteration over `repeat` rounds of at least `min_time`'
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            run()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 2 if elapsed * 10 > min_time else 10
+
+    best = elapsed / number
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(number):
+            run()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+def _commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def meta() -> dict:
+    return {
+        'commit': _commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def save(path: str, results: dict):
+    with open(path, 'w') as file:
+        json.dump(results, file, indent=2, sort_keys=True)
+
+
+def load(path: str) -> dict:
+    with open(path) as file:
+        return json.load(file)
+
+
+def compare(baseline: dict, current: dict,
+            threshold: float) -> list[tuple[str, float, float, float]]:
+    '''
+    Returns (name, old, new, ratio) for every shared measurement that got
+    worse by more than `threshold` (0.25 means 25% slower or bigger).
+    '''
+    regressions = []
+    for section in ('timings', 'memory'):
+        old_values = _flatten(baseline.get(section, {}))
+        new_values = _flatten(current.get(section, {}))
+        for name, new in new_values.items():
+            old = old_values.get(name)
+            if not old or old <= 0:
+                continue
+            ratio = new / old
+            if ratio > 1 + threshold:
+                regressions.append((name, old, new, ratio))
+    return regressions
+
+
+def _flatten(values: dict, prefix='') -> dict[str, float]:
+    flat = {}
+    for key, value in values.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f'{prefix}{key}.'))
+        elif isinstance(value, (int, float)):
+            flat[prefix + key] = float(value)
+    return flat
@@ -0,0 +1,81 @@
+'''
+Runs the benchmark suite.
+
+    python -m benchmarks.run --output after.json --baseline before.json
+
+Timings are the best time per iteration in seconds, memory figures are in
+bytes. With ``--baseline`` the run fails if any shared measurement got
+worse by more than ``--threshold``.
+'''
+import argparse
+import sys
+
+from benchmarks import harness
+from benchmarks import (  # noqa: F401 registers the benchmarks
+    bench_grid, bench_scene, bench_turn, bench_memory
+)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.run')
+    parser.add_argument('--output', help='JSON file to write results to')
+    parser.add_argument('--baseline', help='JSON results to compare with')
+    parser.add_argument('--threshold', type=float, default=.25,
+                        help='allowed slowdown, 0.25 means 25%%')
+    parser.add_argument('--filter', default='',
+                        help='only run benchmarks containing this text')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min-time', type=float, default=.1,
+                        help='minimum seconds per timing round')
+    parser.add_argument('--no-memory', action='store_true',
+                        help='skip the long-session memory measurements')
+    args = parser.parse_args(argv)
+
+    results = {'meta': harness.meta(), 'timings': {}, 'memory': {}}
+
+    # Animations outlive an iteration, so fixtures have to stay alive
+    # until the end and exceptions raised from their slots are counted
+    # rather than printed
+    fixtures = []
+    callback_errors = []
+    sys.excepthook = lambda *exc_info: callback_errors.append(exc_info)
+    for name, setup in harness.BENCHMARKS.items():
+        if args.filter not in name:
+            continue
+        run = setup()
+        fixtures.append(run)
+        seconds = harness.measure(run, args.repeat, args.min_time)
+        results['timings'][name] = seconds
+        print(f'{name:<52} {seconds * 1e6:12.2f} us', flush=True)
+
+    if not args.no_memory:
+        for name, func in harness.METRICS.items():
+            if args.filter not in name:
+                continue
+            values = func()
+            results['memory'][name] = values
+            for key, value in values.items():
+                print(f'{name + "." + key:<52} {value:12.0f} B', flush=True)
+
+    sys.excepthook = sys.__excepthook__
+    results['meta']['callback_errors'] = len(callback_errors)
+    if callback_errors:
+        print(f'{len(callback_errors)} exceptions raised in Qt callbacks, '
+              f'first: {callback_errors[0][1]!r}', file=sys.stderr)
+
+    if args.output:
+        harness.save(args.output, results)
+
+    if args.baseline:
+        regressions = harness.compare(harness.load(args.baseline), results,
+                                      args.threshold)
+        for name, old, new, ratio in regressions:
+            print(f'REGRESSION {name}: {old:.6g} -> {new:.6g} '
+                  f'({ratio - 1:+.0%})', file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
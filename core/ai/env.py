@@ -0,0 +1,258 @@
+'''
+Vectorized 2048 environment for reinforcement learning.
+
+``VectorEnv`` steps K boards with the rules of ``core.game.batch``:
+actions are ``Direction`` values, the reward is the score a move gained
+(minus `invalid_penalty` when it did not change the board) and a board is
+done once no move is left. A done board is started again by the next
+step, which ignores its action and gives it no reward, so the final board
+stays readable for one step.
+
+The boards are split between worker processes. Observations, rewards,
+done flags and actions live in one ``multiprocessing.shared_memory``
+block that the workers write into directly; a step only sends each worker
+a one-byte command and waits for a one-byte answer.
+
+    env = VectorEnv(256, workers=4, seed=1)
+    obs = env.reset()
+    obs, rewards, dones, info = env.step(actions)
+    env.close()
+
+The arrays returned are views of the shared buffers: they are overwritten
+by the next step, copy them to keep them.
+'''
+import multiprocessing
+import os
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from core.game.batch import BatchGame, moveBoards
+
+
+_RESET = b'r'
+_STEP = b's'
+_CLOSE = b'c'
+_DONE = b'd'
+
+
+def _layout(count: int, rows: int, columns: int
+            ) -> tuple[dict[str, tuple[int, tuple, np.dtype]], int]:
+    'Offsets, shapes and types of the shared arrays, and the block size'
+    arrays = [
+        ('scores', (count,), np.int64),
+        ('rewards', (count,), np.float32),
+        ('observations', (count, rows, columns), np.uint8),
+        ('actions', (count,), np.uint8),
+        ('dones', (count,), np.bool_),
+        ('changed', (count,), np.bool_),
+    ]
+    layout = {}
+    offset = 0
+    for name, shape, dtype in arrays:
+        dtype = np.dtype(dtype)
+        offset += -offset % dtype.alignment
+        layout[name] = (offset, shape, dtype)
+        offset += int(np.prod(shape)) * dtype.itemsize
+    return layout, offset
+
+
+def _views(buffer, layout) -> dict[str, np.ndarray]:
+    return {name: np.ndarray(shape, dtype, buffer, offset)
+            for name, (offset, shape, dtype) in layout.items()}
+
+
+class _Shard:
+    'Boards `start` to `stop` of the shared buffers'
+
+    def __init__(self, views: dict[str, np.ndarray], start: int, stop: int,
+                 rows: int, columns: int, seed, invalid_penalty: float):
+        self.views = {name: view[start:stop] for name, view in views.items()}
+        self.invalid_penalty = invalid_penalty
+        self.game = BatchGame(stop - start, rows, columns, seed)
+        # The game plays right in the shared memory
+        self.game.boards = self.views['observations']
+        self.game.scores = self.views['scores']
+
+    def reset(self):
+        self.game.start()
+        self.views['rewards'][:] = 0
+        self.views['dones'][:] = False
+        self.views['changed'][:] = False
+
+    def step(self):
+        game = self.game
+        dones = self.views['dones']
+        changed = self.views['changed']
+        rewards = self.views['rewards']
+
+        restart = dones.copy()
+        if restart.any():
+            game.start(restart)
+        active = ~restart
+
+        boards, result = moveBoards(game.boards[active],
+                                    self.views['actions'][active])
+        game.boards[active] = boards
+        changed[:] = False
+        changed[active] = result.changed
+        rewards[:] = 0
+        rewards[active] = result.score
+        if self.invalid_penalty:
+            rewards[active & ~changed] -= self.invalid_penalty
+        game.scores[active] += result.score
+        game.spawnRandom(mask=changed)
+        dones[:] = game.isGameOver()
+
+
+def _work(connection, name: str, layout, start: int, stop: int,
+          rows: int, columns: int, seed, invalid_penalty: float):
+    memory = shared_memory.SharedMemory(name)
+    try:
+        shard = _Shard(_views(memory.buf, layout), start, stop,
+                       rows, columns, seed, invalid_penalty)
+        while True:
+            command = connection.recv_bytes()
+            if command == _STEP:
+                shard.step()
+            elif command == _RESET:
+                shard.reset()
+            else:
+                break
+            connection.send_bytes(_DONE)
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        # Views must go before the memory can be closed
+        shard = None
+        memory.close()
+
+
+class VectorEnv:
+    '''
+    `count` boards of `rows` x `columns` stepped together by `workers`
+    processes, by default one per core. With `workers` set to 0 the boards
+    are stepped in the calling process, through the same buffers.
+
+    `seed` makes the spawns of every board reproducible for a given
+    number of workers.
+    '''
+
+    action_count = 4
+
+    def __init__(self, count: int, rows=4, columns=4,
+                 workers: int | None = None, seed: int | None = None,
+                 invalid_penalty=0.) -> None:
+        if workers is None:
+            workers = os.cpu_count() or 1
+        self.count = count
+        self.row_count = rows
+        self.column_count = columns
+
+        layout, size = _layout(count, rows, columns)
+        self._memory = shared_memory.SharedMemory(create=True, size=size)
+        self._views = _views(self._memory.buf, layout)
+        self._closed = False
+
+        shards = max(1, min(workers, count))
+        bounds = [count * i // shards for i in range(shards + 1)]
+        seeds = np.random.SeedSequence(seed).spawn(shards)
+        self._shards: list[_Shard] = []
+        self._connections = []
+        self._processes = []
+        if not workers:
+            self._shards = [_Shard(self._views, 0, count, rows, columns,
+                                   seeds[0], invalid_penalty)]
+            return
+
+        for i in range(shards):
+            parent, child = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=_work, daemon=True,
+                args=(child, self._memory.name, layout, bounds[i],
+                      bounds[i + 1], rows, columns, seeds[i],
+                      invalid_penalty))
+            process.start()
+            child.close()
+            self._connections.append(parent)
+            self._processes.append(process)
+
+    def __len__(self):
+        return self.count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def observations(self) -> np.ndarray:
+        'uint8 (count, rows, columns) tile exponents'
+        return self._views['observations']
+
+    def scores(self) -> np.ndarray:
+        'int64 (count,) score of the game each board is in'
+        return self._views['scores']
+
+    def reset(self) -> np.ndarray:
+        'Starts a new game on every board, returns the observations'
+        self._command(_RESET)
+        return self._views['observations']
+
+    def step(self, actions) -> tuple[np.ndarray, np.ndarray, np.ndarray,
+                                     dict[str, np.ndarray]]:
+        '''
+        Plays one ``Direction`` per board. Returns observations, float32
+        rewards, bool done flags and an info dict with the scores and
+        whether each move changed its board.
+        '''
+        self._views['actions'][:] = actions
+        self._command(_STEP)
+        views = self._views
+        return (views['observations'], views['rewards'], views['dones'],
+                {'scores': views['scores'], 'changed': views['changed']})
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        for connection in self._connections:
+            try:
+                connection.send_bytes(_CLOSE)
+            except OSError:
+                pass
+        for process in self._processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        for connection in self._connections:
+            connection.close()
+        self._shards.clear()
+        self._views.clear()
+        try:
+            self._memory.close()
+        except BufferError:
+            # Arrays returned by step are still alive, the mapping goes
+            # with them
+            pass
+        self._memory.unlink()
+
+    def _command(self, command: bytes):
+        if self._closed:
+            raise RuntimeError('Environment is closed')
+        for shard in self._shards:
+            if command == _STEP:
+                shard.step()
+            else:
+                shard.reset()
+        # Every worker runs its shard before any answer is awaited
+        for connection in self._connections:
+            connection.send_bytes(command)
+        for connection in self._connections:
+            try:
+                answer = connection.recv_bytes()
+            except EOFError:
+                answer = None
+            if answer != _DONE:
+                raise RuntimeError('Environment worker failed')
@@ -0,0 +1,281 @@
+'''
+Expectimax search over 4x4 bitboards.
+
+Max nodes try the four moves, chance nodes average over every empty cell
+getting a 2 (3 in 4) or a 4 (1 in 4), like ``GameController.spawnRandom``.
+Chance branches whose probability falls under ``prob_cutoff`` are
+evaluated instead of expanded.
+
+Chance node values are kept in a bounded LRU transposition table keyed by
+the dihedral-canonical board. The evaluation is symmetric, so the 8
+rotations and reflections of a board share one entry. A persistent
+``TranspositionTable`` can back it, to share results between processes
+and runs.
+'''
+import zlib
+from collections import OrderedDict
+from typing import Callable, Iterator, NamedTuple
+
+from core.ai import ttable
+from core.ai.ttable import TranspositionTable
+from core.game import bitboard
+from core.game.direction import Direction
+
+
+SCORE_LOST_PENALTY = 200000.
+SCORE_MONOTONICITY_POWER = 4.
+SCORE_MONOTONICITY_WEIGHT = 47.
+SCORE_SUM_POWER = 3.5
+SCORE_SUM_WEIGHT = 11.
+SCORE_MERGES_WEIGHT = 700.
+SCORE_EMPTY_WEIGHT = 270.
+
+PROB_CUTOFF = 1e-4
+
+
+def _rowHeuristic(row: int) -> float:
+    line = [(row >> (4 * i)) & 0xF for i in range(bitboard.COLUMNS)]
+
+    total = sum(pow(exponent, SCORE_SUM_POWER) for exponent in line)
+    empty = line.count(0)
+
+    merges = 0
+    prev = 0
+    counter = 0
+    for exponent in line:
+        if not exponent:
+            continue
+        if prev == exponent:
+            counter += 1
+        elif counter > 0:
+            merges += 1 + counter
+            counter = 0
+        prev = exponent
+    if counter > 0:
+        merges += 1 + counter
+
+    monotonicity_left = 0.
+    monotonicity_right = 0.
+    for a, b in zip(line, line[1:]):
+        if a > b:
+            monotonicity_left += (pow(a, SCORE_MONOTONICITY_POWER)
+                                  - pow(b, SCORE_MONOTONICITY_POWER))
+        else:
+            monotonicity_right += (pow(b, SCORE_MONOTONICITY_POWER)
+                                   - pow(a, SCORE_MONOTONICITY_POWER))
+
+    return (SCORE_LOST_PENALTY
+            + SCORE_EMPTY_WEIGHT * empty
+            + SCORE_MERGES_WEIGHT * merges
+            - SCORE_MONOTONICITY_WEIGHT * min(monotonicity_left,
+                                              monotonicity_right)
+            - SCORE_SUM_WEIGHT * total)
+
+
+_HEURISTIC = [_rowHeuristic(row) for row in range(bitboard.ROW_MASK + 1)]
+
+
+def heuristic(board: int) -> float:
+    'Rewards empty cells, merges and monotonic rows and columns'
+    t = bitboard.transpose(board)
+    mask = bitboard.ROW_MASK
+    return (_HEURISTIC[board & mask] + _HEURISTIC[(board >> 16) & mask]
+            + _HEURISTIC[(board >> 32) & mask] + _HEURISTIC[board >> 48]
+            + _HEURISTIC[t & mask] + _HEURISTIC[(t >> 16) & mask]
+            + _HEURISTIC[(t >> 32) & mask] + _HEURISTIC[t >> 48])
+
+
+def tableTag(prob_cutoff=PROB_CUTOFF,
+             evaluate: Callable[[int], float] = heuristic) -> int:
+    '''
+    Tags a transposition table with what its values depend on. A bound
+    `evaluate` adds the ``tag`` of its object, if it has one, e.g. the
+    weights of an ``NTupleNetwork``.
+    '''
+    weights = (SCORE_LOST_PENALTY, SCORE_MONOTONICITY_POWER,
+               SCORE_MONOTONICITY_WEIGHT, SCORE_SUM_POWER, SCORE_SUM_WEIGHT,
+               SCORE_MERGES_WEIGHT, SCORE_EMPTY_WEIGHT)
+    owner = getattr(evaluate, '__self__', None)
+    return zlib.crc32(repr((evaluate.__module__, evaluate.__qualname__,
+                            prob_cutoff, weights,
+                            getattr(owner, 'tag', None),
+                            getattr(owner, 'afterstate', False))).encode())
+
+
+class SearchCancelled(Exception):
+    'Raised inside a search once its ``stop`` callback returned True'
+
+
+class SearchStats(NamedTuple):
+    nodes: int
+    hits: int
+    misses: int
+    cache_size: int
+    table_hits: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.
+
+
+class ExpectimaxSolver:
+    '''
+    Fixed-depth expectimax with a symmetry-aware transposition table.
+
+    `depth` counts the moves searched ahead, `cache_size` bounds the
+    number of table entries and `prob_cutoff` is the branch probability
+    below which chance nodes are not expanded.
+
+    When `stop` is set it is polled every ``STOP_CHECK_NODES`` nodes and
+    the search raises ``SearchCancelled`` once it returns True.
+
+    With a `table`, chance nodes missing from the LRU cache are looked up
+    in it and every computed value and best move is stored in it. The
+    table must be tagged with ``tableTag`` of the same evaluation.
+
+    A bound `evaluate` whose object has a true ``afterstate`` attribute,
+    like ``NTupleNetwork.evaluate``, is taken for the score still to come
+    after a move: the score of each move is then added to its value.
+    '''
+
+    STOP_CHECK_NODES = 256
+
+    def __init__(self, depth=2, cache_size=1 << 18, prob_cutoff=PROB_CUTOFF,
+                 evaluate: Callable[[int], float] = heuristic,
+                 table: TranspositionTable | None = None) -> None:
+        if table is not None and table.tag != tableTag(prob_cutoff,
+                                                       evaluate):
+            raise ValueError('Transposition table holds values of another '
+                             'evaluation')
+        self.depth = depth
+        self.cache_size = cache_size
+        self.prob_cutoff = prob_cutoff
+        self.evaluate = evaluate
+        self.rewards = bool(getattr(getattr(evaluate, '__self__', None),
+                                    'afterstate', False))
+        self.stop: Callable[[], bool] | None = None
+        self.table = table
+
+        self._cache: OrderedDict[int, tuple[int, float]] = OrderedDict()
+        self._nodes = 0
+        self._hits = 0
+        self._misses = 0
+        self._table_hits = 0
+
+    def stats(self) -> SearchStats:
+        return SearchStats(self._nodes, self._hits, self._misses,
+                           len(self._cache), self._table_hits)
+
+    def resetStats(self):
+        self._nodes = self._hits = self._misses = self._table_hits = 0
+
+    def clearCache(self):
+        self._cache.clear()
+
+    def bestMove(self, board: int) -> Direction | None:
+        'Best direction for the board, None if no move is possible'
+        return self.search(board)[0]
+
+    def bestMoveForGrid(self, grid) -> Direction | None:
+        return self.bestMove(bitboard.fromGrid(grid))
+
+    def search(self, board: int,
+               depth: int | None = None) -> tuple[Direction | None, float]:
+        depth = self.depth if depth is None else depth
+        if self.table is not None:
+            stored = self.table.probe(board, ttable.ROOT)
+            if stored is not None and stored[0] >= depth:
+                self._table_hits += 1
+                move = stored[2]
+                return (None if move == ttable.NO_MOVE else Direction(move),
+                        stored[1])
+        best_move = None
+        best_value = 0.
+        for direction, func in bitboard.MOVES.items():
+            new_board, gained = func(board)
+            if new_board == board:
+                continue
+            value = self._chanceNode(new_board, depth - 1, 1.)
+            if self.rewards:
+                value += gained
+            if best_move is None or value > best_value:
+                best_move = direction
+                best_value = value
+        if self.table is not None:
+            self.table.store(
+                board, depth, best_value,
+                ttable.NO_MOVE if best_move is None else best_move,
+                ttable.ROOT)
+        return best_move, best_value
+
+    def deepen(self, board: int, max_depth: int
+               ) -> Iterator[tuple[int, Direction | None, float]]:
+        '''
+        Searches depth 1, 2, ... `max_depth`, yields (depth, move, value)
+        after each one. Ends early, without a result for the depth being
+        searched, when ``stop`` says so.
+        '''
+        for depth in range(1, max_depth + 1):
+            try:
+                move, value = self.search(board, depth)
+            except SearchCancelled:
+                return
+            yield depth, move, value
+            if move is None:
+                return
+
+    def _maxNode(self, board: int, depth: int, prob: float) -> float:
+        best = 0.
+        rewards = self.rewards
+        for func in bitboard.MOVES.values():
+            new_board, gained = func(board)
+            if new_board != board:
+                value = self._chanceNode(new_board, depth - 1, prob)
+                best = max(best, value + gained if rewards else value)
+        return best
+
+    def _chanceNode(self, board: int, depth: int, prob: float) -> float:
+        self._nodes += 1
+        if self.stop is not None \
+                and not self._nodes % self.STOP_CHECK_NODES and self.stop():
+            raise SearchCancelled()
+        if depth <= 0 or prob < self.prob_cutoff:
+            return self.evaluate(board)
+
+        key = bitboard.canonical(board)
+        cached = self._cache.get(key)
+        if cached is not None and cached[0] >= depth:
+            self._hits += 1
+            self._cache.move_to_end(key)
+            return cached[1]
+        if self.table is not None:
+            stored = self.table.probe(key)
+            if stored is not None and stored[0] >= depth:
+                self._table_hits += 1
+                self._remember(key, stored[0], stored[1])
+                return stored[1]
+        self._misses += 1
+
+        cells = bitboard.emptyCells(board)
+        two_prob = prob * .75 / len(cells)
+        four_prob = prob * .25 / len(cells)
+        total = 0.
+        for i in cells:
+            shift = 4 * i
+            total += .75 * self._maxNode(board | (1 << shift), depth,
+                                         two_prob)
+            total += .25 * self._maxNode(board | (2 << shift), depth,
+                                         four_prob)
+        value = total / len(cells)
+
+        self._remember(key, depth, value)
+        if self.table is not None:
+            self.table.store(key, depth, value)
+        return value
+
+    def _remember(self, key: int, depth: int, value: float):
+        self._cache[key] = (depth, value)
+        self._cache.move_to_end(key)
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
@@ -0,0 +1,169 @@
+'''
+Move hints searched in the background.
+
+``HintEngine.request`` takes a bitboard snapshot of the grid and starts an
+expectimax search on ``QThreadPool``. The search deepens one move at a
+time until the time budget runs out or it is cancelled, and the best move
+of the deepest finished search is delivered by ``hintReady`` on the thread
+the engine lives in. Only 4x4 grids can be searched.
+
+The search is pure Python, so it shares the interpreter with the GUI
+thread: animations keep running, interleaved with the search.
+'''
+import threading
+import time
+from typing import Callable
+
+from PySide6.QtCore import (
+    QObject, QRunnable, QThreadPool, Signal, Slot
+)
+
+from core.ai.expectimax import ExpectimaxSolver, heuristic
+from core.ai.ttable import TranspositionTable
+from core.game import bitboard
+from core.game.direction import Direction
+
+
+HINT_TIME_BUDGET = 0.3
+'Seconds a hint search may take'
+HINT_MAX_DEPTH = 6
+HINT_CACHE_SIZE = 1 << 16
+
+NO_MOVE = -1
+
+
+class _HintSignals(QObject):
+    # generation, direction or NO_MOVE, depth, final
+    searched = Signal(int, int, int, bool)
+
+
+class _HintTask(QRunnable):
+    def __init__(self, board: int, generation: int, budget: float,
+                 max_depth: int, signals: _HintSignals,
+                 table: TranspositionTable | None = None,
+                 evaluate: Callable[[int], float] = heuristic) -> None:
+        super().__init__()
+        self.setAutoDelete(True)
+        self.board = board
+        self.generation = generation
+        self.deadline = time.monotonic() + budget
+        self.max_depth = max_depth
+        self.signals = signals
+        self.table = table
+        self.evaluate = evaluate
+        self.cancelled = threading.Event()
+
+    def _stop(self) -> bool:
+        return self.cancelled.is_set() or time.monotonic() > self.deadline
+
+    def run(self):
+        solver = ExpectimaxSolver(cache_size=HINT_CACHE_SIZE,
+                                  evaluate=self.evaluate, table=self.table)
+        solver.stop = self._stop
+        move, depth = None, 0
+        for depth, move, _ in solver.deepen(self.board, self.max_depth):
+            if self.cancelled.is_set():
+                return
+            self.signals.searched.emit(
+                self.generation, NO_MOVE if move is None else move, depth,
+                False)
+        if not self.cancelled.is_set():
+            self.signals.searched.emit(
+                self.generation, NO_MOVE if move is None else move, depth,
+                True)
+
+
+class HintEngine(QObject):
+    '''
+    Searches the best move of a grid without blocking the caller.
+
+    `hintUpdated` is emitted after each finished depth, `hintReady` once
+    the search is over. Results of a search that was cancelled, or
+    replaced by a newer request, are never emitted.
+    '''
+
+    hintUpdated = Signal(object, int)
+    'Best move so far (Direction or None) and the depth it was found at'
+    hintReady = Signal(object, int)
+
+    def __init__(self, parent: QObject | None = None,
+                 pool: QThreadPool | None = None) -> None:
+        super().__init__(parent)
+        self._pool = pool if pool is not None else QThreadPool.globalInstance()
+        self._budget = HINT_TIME_BUDGET
+        self._max_depth = HINT_MAX_DEPTH
+        self._generation = 0
+        self._task: _HintTask | None = None
+        self._table: TranspositionTable | None = None
+        self._evaluate = heuristic
+
+        # Lives in the engine's thread, so results are queued to it
+        self._signals = _HintSignals(self)
+        self._signals.searched.connect(self._onSearched)
+
+    def setTimeBudget(self, seconds: float):
+        self._budget = seconds
+
+    def timeBudget(self):
+        return self._budget
+
+    def setMaxDepth(self, depth: int):
+        self._max_depth = depth
+
+    def maxDepth(self):
+        return self._max_depth
+
+    def setEvaluate(self, evaluate: Callable[[int], float]):
+        'Board evaluation of the searches, e.g. ``NTupleNetwork.evaluate``'
+        self._evaluate = evaluate
+
+    def evaluate(self):
+        return self._evaluate
+
+    def setTable(self, table: TranspositionTable | None):
+        '''
+        Persistent table the searches read and fill, tagged with
+        ``expectimax.tableTag`` of the evaluation
+        '''
+        self._table = table
+
+    def table(self):
+        return self._table
+
+    def isSearching(self):
+        return self._task is not None
+
+    def request(self, grid) -> bool:
+        '''
+        Cancels the running search and starts one for `grid`. Returns
+        False, and emits nothing, if the grid cannot be searched.
+        '''
+        self.cancel()
+        try:
+            board = bitboard.fromGrid(grid)
+        except ValueError:
+            return False
+        self._generation += 1
+        self._task = _HintTask(board, self._generation, self._budget,
+                               self._max_depth, self._signals, self._table,
+                               self._evaluate)
+        self._pool.start(self._task)
+        return True
+
+    def cancel(self):
+        if self._task is not None:
+            self._task.cancelled.set()
+            self._task = None
+            self._generation += 1
+
+    @Slot(int, int, int, bool)
+    def _onSearched(self, generation: int, move: int, depth: int,
+                    final: bool):
+        if generation != self._generation:
+            return
+        direction = None if move == NO_MOVE else Direction(move)
+        if final:
+            self._task = None
+            self.hintReady.emit(direction, depth)
+        else:
+            self.hintUpdated.emit(direction, depth)
@@ -0,0 +1,266 @@
+'''
+Monte Carlo tree search over 4x4 bitboards.
+
+Decision nodes hold a board to move from, their children are one chance
+node per move that changes it. A chance node holds the board after the
+move; its children are the decision nodes of the spawns drawn from it so
+far, a 2 three times in four and a 4 otherwise like
+``GameController.spawnRandom``. Each iteration walks down with UCT at
+decision nodes and a drawn spawn at chance nodes, plays a random or
+greedy rollout from the first new node and backs up the score gained
+since the root.
+
+Nodes are rows of flat arrays instead of objects, 33 bytes each, so a
+search keeps millions of them. It stops after `rollouts` iterations or
+`time_budget` seconds, whichever comes first.
+'''
+import math
+import random
+import time
+from array import array
+from typing import Callable, NamedTuple
+
+from core.game import bitboard
+from core.game.direction import Direction
+
+
+ROLLOUTS = 1000
+ROLLOUT_DEPTH = 100
+'Moves a rollout plays at most before its score is taken'
+EXPLORATION = 1.
+
+UNEXPANDED = -2
+NONE = -1
+
+_MOVES = tuple(bitboard.MOVES.items())
+_FUNCS = tuple(func for _, func in _MOVES)
+
+
+class MCTSResult(NamedTuple):
+    move: Direction | None
+    rollouts: int
+    nodes: int
+    seconds: float
+
+    @property
+    def rollouts_per_second(self) -> float:
+        return self.rollouts / self.seconds if self.seconds else 0.
+
+
+def _spawn(board: int, rng: random.Random) -> tuple[int, int]:
+    'Board with a random tile added, and the label of the spawn'
+    cells = bitboard.emptyCells(board)
+    index = cells[int(rng.random() * len(cells))]
+    exponent = 1 if rng.random() < .75 else 2
+    return board | (exponent << (4 * index)), 2 * index + exponent - 1
+
+
+def randomRollout(board: int, rng: random.Random, depth: int) -> int:
+    'Score of up to `depth` random moves'
+    score = 0
+    for _ in range(depth):
+        # Blocked moves pass to the next one, the order matters little
+        start = int(rng.random() * 4)
+        for i in range(4):
+            new_board, gained = _FUNCS[(start + i) & 3](board)
+            if new_board != board:
+                break
+        else:
+            break
+        board = _spawn(new_board, rng)[0]
+        score += gained
+    return score
+
+
+def greedyRollout(board: int, rng: random.Random, depth: int) -> int:
+    'Score of up to `depth` moves each taking the most score, then room'
+    score = 0
+    for _ in range(depth):
+        best = None
+        best_key = None
+        for func in _FUNCS:
+            new_board, gained = func(board)
+            if new_board == board:
+                continue
+            key = (gained, bitboard.emptyCount(new_board), rng.random())
+            if best_key is None or key > best_key:
+                best, best_key = new_board, key
+        if best is None:
+            break
+        board = _spawn(best, rng)[0]
+        score += best_key[0]
+    return score
+
+
+ROLLOUT_POLICIES: dict[str, Callable[[int, random.Random, int], int]] = {
+    'random': randomRollout,
+    'greedy': greedyRollout,
+}
+
+
+class MCTSSolver:
+    '''
+    UCT search with sampled spawns.
+
+    `exploration` scales the UCT bonus, which is relative to the mean
+    score of the root so it works for any stage of the game. `rollout`
+    names one of ``ROLLOUT_POLICIES``. When `stop` is set it is polled
+    after every rollout and ends the search once it returns True.
+    '''
+
+    def __init__(self, rollouts: int | None = ROLLOUTS,
+                 time_budget: float | None = None,
+                 exploration=EXPLORATION, rollout='random',
+                 rollout_depth=ROLLOUT_DEPTH) -> None:
+        if rollouts is None and time_budget is None:
+            raise ValueError('Search needs a rollout count or a time budget')
+        try:
+            self.rollout = ROLLOUT_POLICIES[rollout]
+        except KeyError:
+            raise ValueError(
+                f'Unknown rollout {rollout!r}, expected one of '
+                f'{", ".join(ROLLOUT_POLICIES)}') from None
+        self.rollouts = rollouts
+        self.time_budget = time_budget
+        self.exploration = exploration
+        self.rollout_depth = rollout_depth
+        self.stop: Callable[[], bool] | None = None
+
+        self._board = array('Q')
+        self._visits = array('I')
+        # Sum of the scores backed up through the node, counted from the
+        # root, so siblings compare by their means
+        self._total = array('d')
+        self._first = array('i')
+        self._next = array('i')
+        # Direction of a chance node, spawn (2 * cell + exponent - 1) of a
+        # decision node
+        self._label = array('B')
+        # Score of the move into a chance node
+        self._reward = array('I')
+
+    def nodes(self) -> int:
+        return len(self._board)
+
+    def clear(self):
+        for column in (self._board, self._visits, self._total, self._first,
+                       self._next, self._label, self._reward):
+            del column[:]
+
+    def _add(self, board: int, label: int, reward=0) -> int:
+        self._board.append(board)
+        self._visits.append(0)
+        self._total.append(0.)
+        self._first.append(UNEXPANDED)
+        self._next.append(NONE)
+        self._label.append(label)
+        self._reward.append(reward)
+        return len(self._board) - 1
+
+    def _expand(self, node: int):
+        board = self._board[node]
+        last = NONE
+        for direction, func in reversed(_MOVES):
+            new_board, gained = func(board)
+            if new_board != board:
+                child = self._add(new_board, direction, gained)
+                self._next[child] = last
+                last = child
+        self._first[node] = last
+
+    def _select(self, node: int) -> int:
+        visits = self._visits
+        total = self._total
+        count = max(visits[node], 1)
+        log_visits = math.log(count)
+        scale = self.exploration * max(total[node] / count, 1.)
+        best = NONE
+        best_value = -math.inf
+        child = self._first[node]
+        while child != NONE:
+            count = visits[child]
+            if not count:
+                return child
+            value = total[child] / count \
+                + scale * math.sqrt(log_visits / count)
+            if value > best_value:
+                best, best_value = child, value
+            child = self._next[child]
+        return best
+
+    def _outcome(self, chance: int, rng: random.Random) -> int:
+        'Decision node of a spawn drawn after `chance`, added if new'
+        board, label = _spawn(self._board[chance], rng)
+        child = self._first[chance]
+        if child == UNEXPANDED:
+            child = NONE
+        first = child
+        while child != NONE:
+            if self._label[child] == label:
+                return child
+            child = self._next[child]
+        child = self._add(board, label)
+        self._next[child] = first
+        self._first[chance] = child
+        return child
+
+    def _iterate(self, root: int, rng: random.Random):
+        path = [root]
+        node = root
+        score = 0
+        while True:
+            if self._first[node] == UNEXPANDED:
+                self._expand(node)
+            if self._first[node] == NONE \
+                    or not self._visits[node] and node != root:
+                # Game over, or a node reached for the first time
+                break
+            chance = self._select(node)
+            score += self._reward[chance]
+            node = self._outcome(chance, rng)
+            path += (chance, node)
+        if self._first[node] != NONE:
+            score += self.rollout(self._board[node], rng,
+                                  self.rollout_depth)
+
+        visits = self._visits
+        total = self._total
+        for node in path:
+            visits[node] += 1
+            total[node] += score
+
+    def search(self, board: int,
+               rng: random.Random | None = None) -> MCTSResult:
+        'Best move for the board, None if no move is possible'
+        rng = rng if rng is not None else random.Random()
+        start = time.perf_counter()
+        deadline = None if self.time_budget is None \
+            else start + self.time_budget
+
+        self.clear()
+        root = self._add(board, 0)
+        self._expand(root)
+        done = 0
+        if self._first[root] != NONE:
+            while self.rollouts is None or done < self.rollouts:
+                self._iterate(root, rng)
+                done += 1
+                if deadline is not None and time.perf_counter() > deadline:
+                    break
+                if self.stop is not None and self.stop():
+                    break
+
+        best = None
+        best_visits = -1
+        child = self._first[root]
+        while child != NONE:
+            if self._visits[child] > best_visits:
+                best, best_visits = child, self._visits[child]
+            child = self._next[child]
+        move = None if best is None else Direction(self._label[best])
+        return MCTSResult(move, done, self.nodes(),
+                          time.perf_counter() - start)
+
+    def bestMove(self, board: int,
+                 rng: random.Random | None = None) -> Direction | None:
+        return self.search(board, rng).move
@@ -0,0 +1,357 @@
+'''
+N-tuple network evaluating 4x4 bitboards, and its TD training.
+
+Each pattern is a tuple of cells. The exponents in those cells index a
+table of weights, and a board is worth the sum of the weights its
+patterns select. Every pattern is also read through the 8 rotations and
+reflections of the board, sharing one table, so symmetric boards are
+worth the same and each game teaches 8 times as much.
+
+The value learned is the score still to come from an afterstate, the
+board after a move and before the spawn (TD(0) on afterstates, Szubert
+and Jaskowski). Training runs self-play games on worker processes: each
+round a worker maps the weights copy-on-write, learns from its games and
+sends back the weights it changed as (index, delta) arrays. A weight
+changed by several workers in a round moves by the mean of their deltas,
+so the step size does not grow with the number of workers.
+
+Weights file, little-endian: magic 'P2NT', version, pattern count and
+pattern length (3 x u32), the cells of every pattern (u8 each), zeros up
+to ``WEIGHTS_OFFSET``, then one float32 table of ``16 ** length`` weights
+per pattern. The file is mapped as it is, loading it costs nothing.
+
+    python -m core.ai.ntuple weights.ntuple --games 100000
+'''
+import argparse
+import os
+import random
+import struct
+import sys
+import time
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, NamedTuple, Sequence
+
+import numpy as np
+
+from core.game import bitboard
+from core.game.engine import TILES_AT_START
+
+
+MAGIC = b'P2NT'
+VERSION = 1
+WEIGHTS_OFFSET = 256
+
+PATTERNS = ((0, 1, 2, 3), (4, 5, 6, 7),
+            (0, 1, 4, 5), (1, 2, 5, 6), (5, 6, 9, 10))
+'Rows and squares, 5 tables of 64 Ki weights (1.25 MiB)'
+LARGE_PATTERNS = ((0, 1, 2, 3, 4, 5), (4, 5, 6, 7, 8, 9),
+                  (0, 1, 2, 4, 5, 6), (4, 5, 6, 8, 9, 10))
+'Six-cell patterns, 4 tables of 16 Mi weights (256 MiB)'
+
+LEARNING_RATE = .0025
+ROUND_GAMES = 64
+'Games a worker plays between two merges'
+
+_HEADER = struct.Struct('<4sIII')
+
+
+def _symmetries(cell: int) -> list[int]:
+    'Where the 8 rotations and reflections of the board take a cell'
+    row, col = divmod(cell, bitboard.COLUMNS)
+    last = bitboard.ROWS - 1
+    points = []
+    for r, c in ((row, col), (col, row)):
+        points += [(r, c), (r, last - c), (last - r, c), (last - r, last - c)]
+    return [r * bitboard.COLUMNS + c for r, c in points]
+
+
+class NTupleNetwork:
+    '''
+    Weights of `patterns` in a float32 array, usually a ``numpy.memmap``
+    of a weights file. ``evaluate`` fits ``ExpectimaxSolver``.
+    '''
+
+    afterstate = True
+    'Values are the score still to come after a move, see ``evaluate``'
+
+    def __init__(self, weights: np.ndarray,
+                 patterns: Sequence[Sequence[int]] = PATTERNS,
+                 tag=0) -> None:
+        lengths = {len(pattern) for pattern in patterns}
+        if len(lengths) != 1:
+            raise ValueError('Patterns must all have the same length')
+        self.patterns = tuple(tuple(pattern) for pattern in patterns)
+        self.length = lengths.pop()
+        self.table_size = 1 << (4 * self.length)
+        if weights.shape != (len(self.patterns) * self.table_size,):
+            raise ValueError('Weights do not fit the patterns')
+        self.weights = weights
+        self.tag = tag
+        # Python floats straight from the buffer, much faster than numpy
+        # scalars one at a time
+        self._values = memoryview(weights)
+
+        # (table offset, nibble shifts) of every pattern in every symmetry
+        self._images: list[tuple[int, tuple[int, ...]]] = []
+        for i, pattern in enumerate(self.patterns):
+            images = zip(*(_symmetries(cell) for cell in pattern))
+            for image in dict.fromkeys(images):
+                self._images.append(
+                    (i * self.table_size, tuple(4 * c for c in image)))
+
+    @classmethod
+    def create(cls, path: str, patterns=PATTERNS) -> 'NTupleNetwork':
+        'Writes a weights file of zeros and maps it'
+        length = len(patterns[0])
+        header = _HEADER.pack(MAGIC, VERSION, len(patterns), length) \
+            + bytes(cell for pattern in patterns for cell in pattern)
+        if len(header) > WEIGHTS_OFFSET:
+            raise ValueError('Too many patterns for the header')
+        size = WEIGHTS_OFFSET + 4 * len(patterns) * (1 << (4 * length))
+        temp = f'{path}.{os.getpid()}.tmp'
+        with open(temp, 'wb') as file:
+            file.write(header)
+            file.truncate(size)
+        os.replace(temp, path)
+        return cls.load(path, 'r+')
+
+    @classmethod
+    def load(cls, path: str, mode='r') -> 'NTupleNetwork':
+        '''
+        Maps a weights file. `mode` is the ``numpy.memmap`` one: 'r' to
+        read, 'r+' to train it, 'c' to train a private copy.
+        '''
+        with open(path, 'rb') as file:
+            head = file.read(WEIGHTS_OFFSET)
+            stat = os.fstat(file.fileno())
+        if len(head) < _HEADER.size:
+            raise ValueError(f'{path} is not a weights file')
+        magic, version, count, length = _HEADER.unpack_from(head)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a weights file')
+        if version != VERSION:
+            raise ValueError(f'Unsupported weights version {version}')
+        cells = head[_HEADER.size:_HEADER.size + count * length]
+        patterns = [tuple(cells[i:i + length])
+                    for i in range(0, len(cells), length)]
+        weights = np.memmap(path, np.float32, mode, WEIGHTS_OFFSET,
+                            (count * (1 << (4 * length)),))
+        tag = zlib.crc32(repr((head, stat.st_size,
+                               stat.st_mtime_ns)).encode())
+        return cls(weights, patterns, tag)
+
+    def evaluate(self, board: int) -> float:
+        'Score expected from the afterstate `board` to the end'
+        values = self._values
+        total = 0.
+        for base, shifts in self._images:
+            index = 0
+            for shift in shifts:
+                index = (index << 4) | ((board >> shift) & 0xF)
+            total += values[base + index]
+        return total
+
+    def indices(self, board: int) -> list[int]:
+        'Indices of the weights `board` selects'
+        result = []
+        for base, shifts in self._images:
+            index = 0
+            for shift in shifts:
+                index = (index << 4) | ((board >> shift) & 0xF)
+            result.append(base + index)
+        return result
+
+    def update(self, board: int, delta: float):
+        'Adds `delta` to every weight `board` selects'
+        values = self._values
+        for base, shifts in self._images:
+            index = 0
+            for shift in shifts:
+                index = (index << 4) | ((board >> shift) & 0xF)
+            values[base + index] += delta
+
+    def bestMove(self, board: int):
+        '''
+        Move with the most score plus value of its afterstate, as
+        (direction, score, afterstate, value), or None
+        '''
+        best = None
+        best_total = 0.
+        for direction, func in bitboard.MOVES.items():
+            after, gained = func(board)
+            if after == board:
+                continue
+            value = self.evaluate(after)
+            if best is None or gained + value > best_total:
+                best = (direction, gained, after, value)
+                best_total = gained + value
+        return best
+
+    def flush(self):
+        if isinstance(self.weights, np.memmap):
+            self.weights.flush()
+
+
+class TrainingRound(NamedTuple):
+    games: int
+    'Games played so far'
+    mean_score: float
+    'Of the games of this round'
+    max_tile: int
+    changed: int
+    'Weights changed by this round'
+    seconds: float
+
+
+def trainGame(network: NTupleNetwork, rng: random.Random,
+              learning_rate=LEARNING_RATE,
+              updated: set[int] | None = None) -> tuple[int, int, int]:
+    '''
+    Plays one game and learns from it, returns (score, max tile, moves).
+    The afterstates whose weights were updated are added to `updated`.
+    '''
+    board = 0
+    for _ in range(TILES_AT_START):
+        board = bitboard.spawnRandom(board, rng)
+    score = 0
+    moves = 0
+    last = None
+    last_value = 0.
+    while True:
+        best = network.bestMove(board)
+        if best is None:
+            break
+        _, gained, after, value = best
+        if last is not None:
+            network.update(
+                last, learning_rate * (gained + value - last_value))
+            if updated is not None:
+                updated.add(last)
+        last, last_value = after, value
+        board = bitboard.spawnRandom(after, rng)
+        score += gained
+        moves += 1
+    if last is not None:
+        # Nothing is left to gain after the last afterstate
+        network.update(last, -learning_rate * last_value)
+        if updated is not None:
+            updated.add(last)
+    return score, 1 << bitboard.maxExponent(board), moves
+
+
+def _trainChunk(path: str, seed: int, games: range, learning_rate: float):
+    network = NTupleNetwork.load(path, 'c')
+    # The file itself keeps the weights the round started from
+    start = NTupleNetwork.load(path).weights
+    updated: set[int] = set()
+    scores = []
+    max_tile = 0
+    for game in games:
+        # Seeded like core.selfplay games
+        rng = random.Random((seed << 32) | game)
+        score, tile, _ = trainGame(network, rng, learning_rate, updated)
+        scores.append(score)
+        max_tile = max(max_tile, tile)
+    index = np.unique(np.fromiter(
+        (i for board in updated for i in network.indices(board)),
+        np.int64))
+    delta = network.weights[index] - start[index]
+    changed = np.flatnonzero(delta)
+    return index[changed], delta[changed], scores, max_tile
+
+
+def mergeDeltas(chunks: Sequence[tuple[np.ndarray, np.ndarray]]
+                ) -> tuple[np.ndarray, np.ndarray]:
+    '''
+    Combines the (index, delta) arrays of several workers into one, taking
+    the mean of the deltas of an index changed by more than one
+    '''
+    if not chunks:
+        return np.empty(0, np.int64), np.empty(0, np.float32)
+    index, inverse = np.unique(
+        np.concatenate([index for index, _ in chunks]), return_inverse=True)
+    deltas = np.concatenate([delta for _, delta in chunks])
+    total = np.bincount(inverse, deltas, len(index))
+    count = np.bincount(inverse, minlength=len(index))
+    return index, (total / count).astype(np.float32)
+
+
+def train(path: str, games: int, workers: int | None = None,
+          round_games=ROUND_GAMES, learning_rate=LEARNING_RATE,
+          seed=0, patterns=PATTERNS) -> Iterator[TrainingRound]:
+    '''
+    Trains the weights file at `path`, created if missing, with `games`
+    self-play games. Yields after each round, once its updates are in the
+    file.
+    '''
+    if not os.path.exists(path):
+        NTupleNetwork.create(path, patterns).flush()
+    network = NTupleNetwork.load(path, 'r+')
+    workers = workers or os.cpu_count() or 1
+
+    played = 0
+    with ProcessPoolExecutor(workers) as executor:
+        while played < games:
+            start = time.perf_counter()
+            futures = []
+            for _ in range(workers):
+                count = min(round_games, games - played)
+                if not count:
+                    break
+                futures.append(executor.submit(
+                    _trainChunk, path, seed,
+                    range(played, played + count), learning_rate))
+                played += count
+
+            scores = []
+            max_tile = 0
+            deltas = []
+            for future in futures:
+                index, delta, chunk_scores, tile = future.result()
+                deltas.append((index, delta))
+                scores += chunk_scores
+                max_tile = max(max_tile, tile)
+            index, delta = mergeDeltas(deltas)
+            network.weights[index] += delta
+            changed = len(index)
+            network.flush()
+            yield TrainingRound(played, sum(scores) / len(scores), max_tile,
+                                changed, time.perf_counter() - start)
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(
+        prog='python -m core.ai.ntuple',
+        description='Train an n-tuple network by self-play.')
+    parser.add_argument('weights', help='weights file, created if missing')
+    parser.add_argument('--games', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=None,
+                        help='worker processes (default: all cores)')
+    parser.add_argument('--round-games', type=int, default=ROUND_GAMES,
+                        help='games per worker between merges')
+    parser.add_argument('--learning-rate', type=float,
+                        default=LEARNING_RATE)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--large', action='store_true',
+                        help='six-cell patterns for a new file')
+    args = parser.parse_args(argv)
+
+    patterns = LARGE_PATTERNS if args.large else PATTERNS
+    started = time.perf_counter()
+    try:
+        for result in train(args.weights, args.games, args.workers,
+                            args.round_games, args.learning_rate,
+                            args.seed, patterns):
+            print(f'{result.games} games: mean score '
+                  f'{result.mean_score:.0f}, max tile {result.max_tile}, '
+                  f'{result.changed} weights changed in '
+                  f'{result.seconds:.1f}s')
+    except ValueError as error:
+        print(error, file=sys.stderr)
+        return 1
+    print(f'{args.games} games in {time.perf_counter() - started:.1f}s')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
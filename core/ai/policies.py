@@ -0,0 +1,132 @@
+'''
+Move policies for 4x4 bitboards.
+
+A policy is called with a board and a ``random.Random`` and returns the
+direction to play, or None when no move is possible.
+'''
+import random
+
+from core.game import bitboard
+from core.game.direction import Direction
+from core.ai.expectimax import (
+    ExpectimaxSolver, PROB_CUTOFF, heuristic, tableTag
+)
+from core.ai.mcts import ROLLOUTS, ROLLOUT_DEPTH, MCTSSolver
+from core.ai.ntuple import NTupleNetwork
+from core.ai.ttable import DEFAULT_SLOTS, TranspositionTable
+
+
+class RandomPolicy:
+    'Any move that changes the board'
+
+    def reset(self):
+        pass
+
+    def __call__(self, board: int, rng: random.Random) -> Direction | None:
+        moves = [direction
+                 for direction, func in bitboard.MOVES.items()
+                 if func(board)[0] != board]
+        return rng.choice(moves) if moves else None
+
+
+class GreedyPolicy:
+    'The move scoring most right now, the one leaving most room on ties'
+
+    def reset(self):
+        pass
+
+    def __call__(self, board: int, rng: random.Random) -> Direction | None:
+        best = None
+        best_key = None
+        for direction, func in bitboard.MOVES.items():
+            new_board, score = func(board)
+            if new_board == board:
+                continue
+            key = (score, bitboard.emptyCount(new_board), rng.random())
+            if best_key is None or key > best_key:
+                best = direction
+                best_key = key
+        return best
+
+
+class ExpectimaxPolicy:
+    '''
+    Expectimax search, backed by the transposition table file `table` if
+    given. Processes sharing a table see each other's results, so their
+    games depend on timing and are no longer reproducible. With `weights`
+    boards are evaluated by that ``NTupleNetwork`` file instead of the
+    heuristic.
+    '''
+
+    def __init__(self, depth=2, cache_size=1 << 18,
+                 prob_cutoff=PROB_CUTOFF, table: str | None = None,
+                 table_slots=DEFAULT_SLOTS,
+                 weights: str | None = None) -> None:
+        evaluate = heuristic if weights is None \
+            else NTupleNetwork.load(weights).evaluate
+        if table is not None:
+            table = TranspositionTable(table, table_slots,
+                                       tableTag(prob_cutoff, evaluate))
+        self.solver = ExpectimaxSolver(depth, cache_size, prob_cutoff,
+                                       evaluate, table)
+
+    def reset(self):
+        # Cached values depend on the order boards were searched in,
+        # so games only stay reproducible if they start from scratch
+        self.solver.clearCache()
+
+    def __call__(self, board: int, rng: random.Random) -> Direction | None:
+        return self.solver.bestMove(board)
+
+
+class NTuplePolicy:
+    'The move whose score and afterstate value, by `weights`, is highest'
+
+    def __init__(self, weights: str) -> None:
+        self.network = NTupleNetwork.load(weights)
+
+    def reset(self):
+        pass
+
+    def __call__(self, board: int, rng: random.Random) -> Direction | None:
+        best = self.network.bestMove(board)
+        return None if best is None else best[0]
+
+
+class MCTSPolicy:
+    '''
+    Monte Carlo tree search, drawing spawns and rollouts from the game's
+    generator. Games with a `time_budget` depend on the machine.
+    '''
+
+    def __init__(self, rollouts: int | None = ROLLOUTS,
+                 time_budget: float | None = None, exploration=1.,
+                 rollout='random', rollout_depth=ROLLOUT_DEPTH) -> None:
+        self.solver = MCTSSolver(rollouts, time_budget, exploration,
+                                 rollout, rollout_depth)
+        self.last = None
+
+    def reset(self):
+        self.last = None
+
+    def __call__(self, board: int, rng: random.Random) -> Direction | None:
+        self.last = self.solver.search(board, rng)
+        return self.last.move
+
+
+POLICIES = {
+    'random': RandomPolicy,
+    'greedy': GreedyPolicy,
+    'expectimax': ExpectimaxPolicy,
+    'mcts': MCTSPolicy,
+    'ntuple': NTuplePolicy,
+}
+
+
+def makePolicy(name: str, **options):
+    try:
+        policy_class = POLICIES[name]
+    except KeyError:
+        raise ValueError(f'Unknown policy {name!r}, '
+                         f'expected one of {", ".join(POLICIES)}') from None
+    return policy_class(**options)
@@ -0,0 +1,209 @@
+'''
+Transposition table in a memory-mapped file.
+
+A fixed number of slots, open-addressed: a key may sit in any of the
+``PROBES`` slots after its hash. Each slot is three 64-bit words,
+
+    check   key ^ info ^ value bits
+    info    valid bit 63, generation (u16) << 24, kind (u8) << 16,
+            move (u8) << 8, depth (u8)
+    value   float64
+
+Slots are written and read without locks. A probe reads each word once
+and never writes. Two processes writing the same slot at once, or a
+reader catching a write halfway, leave a slot whose check does not match
+its key, which reads as empty, so many processes can share one table.
+
+Every opening of the table starts a new generation. An entry is replaced
+by one searched at least as deep, less ``AGE_WEIGHT`` per generation it is
+old, so a table kept across sessions makes room for new positions instead
+of filling up with deep entries of old ones.
+
+The file starts with a header holding the slot count, a tag telling what
+the values were computed with and the last generation. Opening a file
+whose header does not match builds a new empty table next to it and
+renames it over the old one, processes still using the old file are not
+disturbed.
+'''
+import mmap
+import os
+import struct
+
+
+MAGIC = b'P2TT'
+VERSION = 2
+
+PROBES = 4
+DEFAULT_SLOTS = 1 << 20
+AGE_WEIGHT = 8
+'Depth an entry loses, for replacement, per generation it is old'
+
+CHANCE = 0
+'Value of a board before the spawn, keyed by its canonical board'
+ROOT = 1
+'Best move of a board to move from, keyed by the board itself'
+
+NO_MOVE = 0xFF
+
+_HEADER = struct.Struct('<4sIIII12x')
+# Magic, version, bits and tag: a file without them is rebuilt
+_IDENTITY = 16
+_GENERATION = struct.Struct('<I')
+_WORDS = 3
+_VALID = 1 << 63
+_HASH = 0x9E37_79B9_7F4A_7C15
+_MASK64 = (1 << 64) - 1
+_WORD = struct.Struct('Q')
+_FLOAT = struct.Struct('d')
+
+
+def _info(kind: int, depth: int, move: int, generation: int) -> int:
+    return _VALID | (generation << 24) | (kind << 16) | (move << 8) | depth
+
+
+class TranspositionTable:
+    '''
+    Table of (depth, value, move) by board key stored at `path`, with
+    `slots` slots (rounded up to a power of two). `tag` identifies the
+    evaluation that produced the values; a file with another tag or size
+    starts over empty.
+    '''
+
+    def __init__(self, path: str, slots=DEFAULT_SLOTS, tag=0) -> None:
+        self.path = path
+        self.tag = tag
+        self.bits = max(PROBES, slots - 1).bit_length()
+        self.slots = 1 << self.bits
+
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+
+        size = _HEADER.size + self.slots * _WORDS * 8
+        if not self._matches(size):
+            self._create(size)
+        with open(path, 'r+b') as file:
+            self._mmap = mmap.mmap(file.fileno(), size)
+        self._words = memoryview(self._mmap)[_HEADER.size:].cast('Q')
+        self.generation = 0
+        self.newGeneration()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def _header(self) -> bytes:
+        return _HEADER.pack(MAGIC, VERSION, self.bits, self.tag, 0)
+
+    def _matches(self, size: int) -> bool:
+        try:
+            with open(self.path, 'rb') as file:
+                header = file.read(_HEADER.size)
+                return header[:_IDENTITY] == self._header()[:_IDENTITY] \
+                    and os.fstat(file.fileno()).st_size == size
+        except FileNotFoundError:
+            return False
+
+    def _create(self, size: int):
+        temp = f'{self.path}.{os.getpid()}.tmp'
+        with open(temp, 'wb') as file:
+            file.write(self._header())
+            # Sparse on most file systems, empty slots are zeros
+            file.truncate(size)
+        os.replace(temp, self.path)
+
+    def newGeneration(self):
+        '''
+        Ages every entry by one generation. Processes opening the table
+        at the same time may share a generation or skip one, which only
+        shifts replacement priorities.
+        '''
+        generation, = _GENERATION.unpack_from(self._mmap, _IDENTITY)
+        generation = (generation + 1) & 0xFFFF
+        _GENERATION.pack_into(self._mmap, _IDENTITY, generation)
+        self.generation = generation
+
+    def _priority(self, info: int) -> int:
+        'Depth an entry is kept for, lowered by its age'
+        age = (self.generation - (info >> 24)) & 0xFFFF
+        return (info & 0xFF) - AGE_WEIGHT * age
+
+    def _first(self, key: int, kind: int) -> int:
+        return (((key ^ kind) * _HASH) & _MASK64) >> (64 - self.bits)
+
+    def probe(self, key: int, kind=CHANCE) -> tuple[int, float, int] | None:
+        'Stored (depth, value, move) of `key`, None if it is not stored'
+        words = self._words
+        first = self._first(key, kind)
+        mask = self.slots - 1
+        for i in range(PROBES):
+            slot = ((first + i) & mask) * _WORDS
+            info = words[slot + 1]
+            if not info & _VALID or (info >> 16) & 0xFF != kind:
+                continue
+            # The value returned is the word the check was made with
+            bits = words[slot + 2]
+            if words[slot] ^ info ^ bits == key:
+                self.hits += 1
+                value, = _FLOAT.unpack(_WORD.pack(bits))
+                return info & 0xFF, value, (info >> 8) & 0xFF
+        self.misses += 1
+        return None
+
+    def store(self, key: int, depth: int, value: float, move=NO_MOVE,
+              kind=CHANCE):
+        '''
+        Stores an entry unless the slots of `key` only hold ones deeper
+        once their age is counted. An entry for the same key is replaced
+        the same way.
+        '''
+        words = self._words
+        first = self._first(key, kind)
+        mask = self.slots - 1
+        depth = min(depth, 0xFF)
+        victim = None
+        victim_priority = 0x100
+        for i in range(PROBES):
+            slot = ((first + i) & mask) * _WORDS
+            info = words[slot + 1]
+            if not info & _VALID:
+                victim, victim_priority = slot, -1
+                break
+            if (info >> 16) & 0xFF == kind \
+                    and words[slot] ^ info ^ words[slot + 2] == key:
+                victim, victim_priority = slot, self._priority(info)
+                break
+            priority = self._priority(info)
+            if priority < victim_priority:
+                victim, victim_priority = slot, priority
+        if depth < victim_priority:
+            return
+
+        info = _info(kind, depth, move, self.generation)
+        bits, = _WORD.unpack(_FLOAT.pack(value))
+        words[victim + 2] = bits
+        words[victim + 1] = info
+        words[victim] = key ^ info ^ bits
+        self.stores += 1
+
+    def count(self) -> int:
+        'Number of valid entries, scans the whole table'
+        words = self._words
+        return sum(1 for slot in range(1, len(words), _WORDS)
+                   if words[slot] & _VALID)
+
+    def clear(self):
+        self._mmap[_HEADER.size:] = bytes(len(self._mmap) - _HEADER.size)
+
+    def flush(self):
+        'Writes the table through to the file'
+        self._mmap.flush()
+
+    def close(self):
+        if self._mmap.closed:
+            return
+        self._words.release()
+        self._mmap.close()
@@ -0,0 +1,226 @@
+import sys
+from collections import deque
+
+from PySide6.QtCore import (
+    QObject, Signal, QTimer
+)
+from PySide6.QtGui import (
+    QAction
+)
+
+from core import tracing
+from core.commands.turn_commands import TurnCommand
+from core.game.diff import TurnDiff
+from core.game.tile import TileGrid
+from core.widgets.game_widget import GameScene
+
+
+class TurnHistory(QObject):
+    '''
+    Undo history holding one ``TurnDiff`` per turn.
+
+    Only the diffs are kept. A ``TurnCommand`` and its animations are
+    built when a turn is played and dropped once the animation is over.
+    The oldest turns are forgotten when the history gets deeper than
+    ``undoLimit()`` turns or bigger than ``byteLimit()`` bytes (0 means no
+    limit).
+    '''
+
+    canUndoChanged = Signal(bool)
+    canRedoChanged = Signal(bool)
+    indexChanged = Signal(int)
+    animationsFinished = Signal()
+    undone = Signal()
+    redone = Signal()
+
+    def __init__(self, grid: TileGrid, scene: GameScene,
+                 parent: QObject | None = None) -> None:
+        super().__init__(parent)
+
+        self._grid = grid
+        self._scene = scene
+
+        self._turns: deque[TurnDiff] = deque()
+        self._index = 0
+        self._bytes = 0
+        # Turns forgotten from the front since the last clear
+        self._dropped = 0
+        self._undo_limit = 0
+        self._byte_limit = 0
+
+        # Commands whose animation is still running
+        self._playing: list[TurnCommand] = []
+        self._finished: list[QObject] = []
+
+    def setUndoLimit(self, limit: int):
+        self._undo_limit = limit
+        self._trim()
+
+    def undoLimit(self):
+        return self._undo_limit
+
+    def setByteLimit(self, limit: int):
+        self._byte_limit = limit
+        self._trim()
+
+    def byteLimit(self):
+        return self._byte_limit
+
+    def count(self):
+        return len(self._turns)
+
+    def index(self):
+        return self._index
+
+    def dropped(self):
+        '''
+        Turns forgotten because of the limits, ``dropped() + index()`` is
+        the number of turns played
+        '''
+        return self._dropped
+
+    def canUndo(self):
+        return self._index > 0
+
+    def canRedo(self):
+        return self._index < len(self._turns)
+
+    def turns(self) -> list[TurnDiff]:
+        return list(self._turns)
+
+    def memoryUsage(self) -> int:
+        'Bytes held by the stored turns'
+        return sys.getsizeof(self._turns) + self._bytes
+
+    def isAnimating(self):
+        return any(command.isRunning() for command in self._playing)
+
+    def finishAnimations(self):
+        'Puts every running turn animation at its end'
+        for command in list(self._playing):
+            command.finish()
+
+    def push(self, diff: TurnDiff, animate=True):
+        '''
+        Plays a new turn and drops the turns that could be redone.
+        Without `animate` the turn is shown at its end state at once.
+        '''
+        state = self._state()
+        while len(self._turns) > self._index:
+            self._bytes -= self._turns.pop().nbytes()
+        self._turns.append(diff)
+        self._bytes += diff.nbytes()
+        self._index += 1
+        command = self._play(diff)
+        self._run(command, command.redo)
+        if not animate:
+            command.finish()
+        self._trim()
+        self._emitChanges(state)
+
+    def undo(self):
+        if not self.canUndo():
+            return
+        state = self._state()
+        self._index -= 1
+        command = self._play(self._turns[self._index])
+        self._run(command, command.undo)
+        self.undone.emit()
+        self._emitChanges(state)
+
+    def redo(self):
+        if not self.canRedo():
+            return
+        state = self._state()
+        self._index += 1
+        command = self._play(self._turns[self._index - 1])
+        self._run(command, command.redo)
+        self.redone.emit()
+        self._emitChanges(state)
+
+    def clear(self):
+        state = self._state()
+        self._turns.clear()
+        self._index = 0
+        self._bytes = 0
+        self._dropped = 0
+        self._emitChanges(state)
+
+    def restore(self, turns: list[TurnDiff], index: int, dropped=0):
+        '''
+        Replaces the history with `turns`, of which the first `index` are
+        already on the grid and the scene. Nothing is played.
+        '''
+        state = self._state()
+        self._turns = deque(turns)
+        self._index = index
+        self._bytes = sum(diff.nbytes() for diff in turns)
+        self._dropped = dropped
+        self._trim()
+        self._emitChanges(state)
+
+    def createUndoAction(self, parent: QObject, text='Undo') -> QAction:
+        action = QAction(text, parent)
+        action.setEnabled(self.canUndo())
+        self.canUndoChanged.connect(action.setEnabled)
+        action.triggered.connect(self.undo)
+        return action
+
+    def createRedoAction(self, parent: QObject, text='Redo') -> QAction:
+        action = QAction(text, parent)
+        action.setEnabled(self.canRedo())
+        self.canRedoChanged.connect(action.setEnabled)
+        action.triggered.connect(self.redo)
+        return action
+
+    def _play(self, diff: TurnDiff) -> TurnCommand:
+        with tracing.span('TurnCommand.build', ops=len(diff)):
+            command = TurnCommand(diff, self._scene, self._grid)
+        self._playing.append(command)
+        # A lambda holding the command would keep it alive through Qt
+        command.anim.finished.connect(self._onFinished)
+        return command
+
+    def _run(self, command: TurnCommand, do):
+        with tracing.span('TurnCommand.do'):
+            do()
+        tracing.asyncBegin('animation', id(command.anim))
+
+    def _onFinished(self):
+        tracing.asyncEnd('animation', id(self.sender()))
+        self._finished.append(self.sender())
+        # The group is still emitting, it can only be deleted afterwards
+        QTimer.singleShot(0, self._dropFinished)
+        if not self.isAnimating():
+            self.animationsFinished.emit()
+
+    def _dropFinished(self):
+        finished = self._finished
+        self._finished = []
+        self._playing = [command for command in self._playing
+                         if not any(command.anim is anim for anim in finished)]
+
+    def _trim(self):
+        def tooBig():
+            return (self._undo_limit and len(self._turns) > self._undo_limit
+                    or self._byte_limit and self._bytes > self._byte_limit)
+
+        while self._index > 0 and tooBig():
+            self._bytes -= self._turns.popleft().nbytes()
+            self._index -= 1
+            self._dropped += 1
+
+    def _state(self):
+        return self.canUndo(), self.canRedo(), self._index
+
+    def _emitChanges(self, state):
+        can_undo, can_redo, index = state
+        if can_undo != self.canUndo():
+            tracing.count('history.signals')
+            self.canUndoChanged.emit(self.canUndo())
+        if can_redo != self.canRedo():
+            tracing.count('history.signals')
+            self.canRedoChanged.emit(self.canRedo())
+        if index != self._index:
+            tracing.count('history.signals')
+            self.indexChanged.emit(self._index)
@@ -0,0 +1,256 @@
+'''
+4x4 board packed into a 64-bit integer.
+
+Every cell holds the exponent of its tile (0 for an empty cell, 1 for 2,
+2 for 4, ...) in 4 bits. Cell (row, col) lives at nibble ``4 * row + col``
+counting from the least significant bit, so row 0 is the lowest 16 bits
+and column 0 is the lowest nibble of each row.
+
+Moves are resolved with precomputed 65536-entry tables indexed by a
+16-bit row; columns go through the same tables after a transpose. The
+merge rules are those of ``GameController``: a tile merges at most once
+per move and merges are resolved from the side the tiles slide to.
+Exponent 15 (32768) is the largest value a nibble can hold, so two such
+tiles never merge.
+'''
+import random
+
+from core.game.direction import Direction
+
+
+ROWS = 4
+COLUMNS = 4
+CELLS = ROWS * COLUMNS
+MAX_EXPONENT = 15
+
+ROW_MASK = 0xFFFF
+COL_MASK = 0x000F_000F_000F_000F
+
+
+def _reverseRow(row: int) -> int:
+    return ((row >> 12) | ((row >> 4) & 0x00F0)
+            | ((row << 4) & 0x0F00) | ((row << 12) & 0xF000))
+
+
+def _unpackCol(row: int) -> int:
+    return ((row & 0x000F) | ((row & 0x00F0) << 12)
+            | ((row & 0x0F00) << 24) | ((row & 0xF000) << 36))
+
+
+def _slideRow(row: int) -> tuple[int, int]:
+    line = [(row >> (4 * i)) & 0xF for i in range(COLUMNS)]
+    result = []
+    score = 0
+    mergeable = False
+    for exponent in line:
+        if not exponent:
+            continue
+        if mergeable and result[-1] == exponent \
+                and exponent < MAX_EXPONENT:
+            result[-1] += 1
+            score += 1 << result[-1]
+            mergeable = False
+        else:
+            result.append(exponent)
+            mergeable = True
+
+    packed = 0
+    for i, exponent in enumerate(result):
+        packed |= exponent << (4 * i)
+    return packed, score
+
+
+def _buildTables():
+    size = ROW_MASK + 1
+    row_left = [0] * size
+    row_right = [0] * size
+    col_up = [0] * size
+    col_down = [0] * size
+    score_left = [0] * size
+    score_right = [0] * size
+
+    for row in range(size):
+        result, score = _slideRow(row)
+        reversed_row = _reverseRow(row)
+        reversed_result = _reverseRow(result)
+
+        row_left[row] = result
+        col_up[row] = _unpackCol(result)
+        score_left[row] = score
+        row_right[reversed_row] = reversed_result
+        col_down[reversed_row] = _unpackCol(reversed_result)
+        score_right[reversed_row] = score
+
+    return row_left, row_right, col_up, col_down, score_left, score_right
+
+
+(_ROW_LEFT, _ROW_RIGHT, _COL_UP, _COL_DOWN,
+ _SCORE_LEFT, _SCORE_RIGHT) = _buildTables()
+
+
+def pack(exponents) -> int:
+    'Packs 16 row-major exponents into a board'
+    board = 0
+    for i, exponent in enumerate(exponents):
+        if not 0 <= exponent <= MAX_EXPONENT:
+            raise ValueError(f'Exponent {exponent} does not fit a nibble')
+        board |= exponent << (4 * i)
+    return board
+
+
+def unpack(board: int) -> list[int]:
+    'Returns 16 row-major exponents of the board'
+    return [(board >> (4 * i)) & 0xF for i in range(CELLS)]
+
+
+def fromGrid(grid) -> int:
+    'Packs a 4x4 ``TileGrid`` (or anything with ``exponents()``)'
+    if (grid.row_count, grid.column_count) != (ROWS, COLUMNS):
+        raise ValueError(
+            f'Bitboards are {ROWS}x{COLUMNS}, '
+            f'got {grid.row_count}x{grid.column_count}'
+        )
+    return pack(grid.exponents())
+
+
+def transpose(board: int) -> int:
+    a1 = board & 0xF0F0_0F0F_F0F0_0F0F
+    a2 = board & 0x0000_F0F0_0000_F0F0
+    a3 = board & 0x0F0F_0000_0F0F_0000
+    a = a1 | (a2 << 12) | (a3 >> 12)
+    b1 = a & 0xFF00_FF00_00FF_00FF
+    b2 = a & 0x00FF_00FF_0000_0000
+    b3 = a & 0x0000_0000_FF00_FF00
+    return b1 | (b2 >> 24) | (b3 << 24)
+
+
+def mirror(board: int) -> int:
+    'Reverses the order of columns'
+    return (((board & 0x000F_000F_000F_000F) << 12)
+            | ((board & 0x00F0_00F0_00F0_00F0) << 4)
+            | ((board >> 4) & 0x00F0_00F0_00F0_00F0)
+            | ((board >> 12) & 0x000F_000F_000F_000F))
+
+
+def flip(board: int) -> int:
+    'Reverses the order of rows'
+    return (((board & 0xFFFF) << 48)
+            | ((board & 0xFFFF_0000) << 16)
+            | ((board >> 16) & 0xFFFF_0000)
+            | (board >> 48))
+
+
+def symmetries(board: int) -> list[int]:
+    'The 8 rotations and reflections of the board'
+    t = transpose(board)
+    boards = [board, mirror(board), flip(board), t, mirror(t), flip(t)]
+    boards.append(flip(boards[1]))
+    boards.append(flip(boards[4]))
+    return boards
+
+
+def canonical(board: int) -> int:
+    'Smallest of the symmetric boards, shared by all 8 of them'
+    return min(symmetries(board))
+
+
+def moveLeft(board: int) -> tuple[int, int]:
+    r0 = board & ROW_MASK
+    r1 = (board >> 16) & ROW_MASK
+    r2 = (board >> 32) & ROW_MASK
+    r3 = board >> 48
+    return (
+        _ROW_LEFT[r0] | (_ROW_LEFT[r1] << 16)
+        | (_ROW_LEFT[r2] << 32) | (_ROW_LEFT[r3] << 48),
+        _SCORE_LEFT[r0] + _SCORE_LEFT[r1]
+        + _SCORE_LEFT[r2] + _SCORE_LEFT[r3]
+    )
+
+
+def moveRight(board: int) -> tuple[int, int]:
+    r0 = board & ROW_MASK
+    r1 = (board >> 16) & ROW_MASK
+    r2 = (board >> 32) & ROW_MASK
+    r3 = board >> 48
+    return (
+        _ROW_RIGHT[r0] | (_ROW_RIGHT[r1] << 16)
+        | (_ROW_RIGHT[r2] << 32) | (_ROW_RIGHT[r3] << 48),
+        _SCORE_RIGHT[r0] + _SCORE_RIGHT[r1]
+        + _SCORE_RIGHT[r2] + _SCORE_RIGHT[r3]
+    )
+
+
+def moveUp(board: int) -> tuple[int, int]:
+    t = transpose(board)
+    c0 = t & ROW_MASK
+    c1 = (t >> 16) & ROW_MASK
+    c2 = (t >> 32) & ROW_MASK
+    c3 = t >> 48
+    return (
+        _COL_UP[c0] | (_COL_UP[c1] << 4)
+        | (_COL_UP[c2] << 8) | (_COL_UP[c3] << 12),
+        _SCORE_LEFT[c0] + _SCORE_LEFT[c1]
+        + _SCORE_LEFT[c2] + _SCORE_LEFT[c3]
+    )
+
+
+def moveDown(board: int) -> tuple[int, int]:
+    t = transpose(board)
+    c0 = t & ROW_MASK
+    c1 = (t >> 16) & ROW_MASK
+    c2 = (t >> 32) & ROW_MASK
+    c3 = t >> 48
+    return (
+        _COL_DOWN[c0] | (_COL_DOWN[c1] << 4)
+        | (_COL_DOWN[c2] << 8) | (_COL_DOWN[c3] << 12),
+        _SCORE_RIGHT[c0] + _SCORE_RIGHT[c1]
+        + _SCORE_RIGHT[c2] + _SCORE_RIGHT[c3]
+    )
+
+
+MOVES = {
+    Direction.Up: moveUp,
+    Direction.Down: moveDown,
+    Direction.Left: moveLeft,
+    Direction.Right: moveRight,
+}
+
+
+def move(board: int, direction: Direction) -> tuple[int, int, bool]:
+    'Returns the new board, the score gained and whether anything moved'
+    new_board, score = MOVES[direction](board)
+    return new_board, score, new_board != board
+
+
+def emptyCells(board: int) -> list[int]:
+    return [i for i in range(CELLS) if not (board >> (4 * i)) & 0xF]
+
+
+def emptyCount(board: int) -> int:
+    # Fold every nibble into its lowest bit, set for occupied cells
+    board |= board >> 2
+    board |= board >> 1
+    return CELLS - (board & 0x1111_1111_1111_1111).bit_count()
+
+
+def maxExponent(board: int) -> int:
+    return max(unpack(board))
+
+
+def addTile(board: int, index: int, exponent: int) -> int:
+    if (board >> (4 * index)) & 0xF:
+        raise IndexError(f'[Add] Cell {divmod(index, COLUMNS)} is not empty')
+    return board | (exponent << (4 * index))
+
+
+def spawnRandom(board: int, rng: random.Random = random) -> int:
+    'Adds a 2 (or a 4 once in four times) to a random empty cell'
+    cells = emptyCells(board)
+    if not cells:
+        return board
+    index = rng.choice(cells)
+    return board | ((1 if rng.randint(0, 3) else 2) << (4 * index))
+
+
+def isGameOver(board: int) -> bool:
+    return all(func(board)[0] == board for func in MOVES.values())
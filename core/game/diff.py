@@ -0,0 +1,108 @@
+'''
+Compact record of what one turn did to a board.
+'''
+import sys
+from array import array
+from typing import Iterable, Iterator
+
+
+MOVE = 0
+'Tile moved from cell a to empty cell b'
+MERGE = 1
+'Tile in cell a merged into the equal tile in cell b'
+SPAWN = 2
+'Tile with exponent b appeared in cell a'
+
+
+class TurnDiff:
+    '''
+    Immutable list of (kind, a, b) ops in the order they were applied,
+    plus the score the turn gained. Cells are row-major indices.
+
+    Ops are kept as packed unsigned shorts, a 4x4 turn takes a few dozen
+    bytes.
+    '''
+    __slots__ = ('_ops', 'score')
+
+    def __init__(self, ops: Iterable[tuple[int, int, int]] = (),
+                 score=0) -> None:
+        packed = array('H')
+        for op in ops:
+            packed.extend(op)
+        self._ops = packed.tobytes()
+        self.score = score
+
+    def __iter__(self) -> Iterator[tuple[int, int, int]]:
+        return self.ops()
+
+    def __len__(self) -> int:
+        return len(self._ops) // 6
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, TurnDiff) and self._ops == other._ops \
+            and self.score == other.score
+
+    def __hash__(self) -> int:
+        return hash((self._ops, self.score))
+
+    def __repr__(self) -> str:
+        return f'TurnDiff({list(self.ops())}, score={self.score})'
+
+    def ops(self) -> Iterator[tuple[int, int, int]]:
+        values = array('H', self._ops)
+        return zip(values[0::3], values[1::3], values[2::3])
+
+    def moves(self) -> list[tuple[int, int]]:
+        return [(a, b) for kind, a, b in self.ops() if kind == MOVE]
+
+    def merges(self) -> list[tuple[int, int]]:
+        return [(a, b) for kind, a, b in self.ops() if kind == MERGE]
+
+    def spawns(self) -> list[tuple[int, int]]:
+        return [(a, b) for kind, a, b in self.ops() if kind == SPAWN]
+
+    def apply(self, cells: list[int]):
+        'Plays the turn on a row-major list of exponents'
+        for kind, a, b in self.ops():
+            if kind == MOVE:
+                cells[b] = cells[a]
+                cells[a] = 0
+            elif kind == MERGE:
+                cells[b] += 1
+                cells[a] = 0
+            else:
+                cells[a] = b
+
+    def revert(self, cells: list[int]):
+        'Takes the turn back on a row-major list of exponents'
+        for kind, a, b in reversed(list(self.ops())):
+            if kind == MOVE:
+                cells[a] = cells[b]
+                cells[b] = 0
+            elif kind == MERGE:
+                cells[b] -= 1
+                cells[a] = cells[b]
+            else:
+                cells[a] = 0
+
+    def nbytes(self) -> int:
+        return sys.getsizeof(self) + sys.getsizeof(self._ops)
+
+    def toBytes(self) -> bytes:
+        'Score and ops, little-endian'
+        return self.score.to_bytes(4, 'little') + _swapped(self._ops)
+
+    @classmethod
+    def fromBytes(cls, data: bytes) -> 'TurnDiff':
+        diff = cls.__new__(cls)
+        diff.score = int.from_bytes(data[:4], 'little')
+        diff._ops = _swapped(bytes(data[4:]))
+        return diff
+
+
+def _swapped(ops: bytes) -> bytes:
+    if sys.byteorder == 'little':
+        return ops
+    values = array('H', ops)
+    values.byteswap()
+    return values.tobytes()
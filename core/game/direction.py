@@ -0,0 +1,12 @@
+from enum import IntEnum
+
+
+class Direction(IntEnum):
+    Up = 0
+    'Tiles slide towards row 0'
+    Down = 1
+    'Tiles slide towards the last row'
+    Left = 2
+    'Tiles slide towards column 0'
+    Right = 3
+    'Tiles slide towards the last column'
@@ -0,0 +1,364 @@
+'''
+Qt-free game rules.
+
+A board is a flat row-major list of tile exponents (0 for an empty cell,
+1 for 2, 2 for 4, ...), so cell (row, col) has index ``row * columns +
+col``. The functions here only read such lists, which lets both the
+headless ``Game`` and ``GameController`` resolve turns the same way.
+'''
+import random
+from enum import Enum
+from functools import lru_cache
+from operator import itemgetter
+from typing import NamedTuple, Sequence
+
+from core.game.direction import Direction
+
+
+TILES_AT_START = 4
+TILES_AT_TURN = 1
+LINE_CACHE_SIZE = 1 << 14
+CACHED_LINE_LENGTH = 8
+'Longer lines hardly ever repeat, they are slid without the cache'
+
+
+class MoveAction(Enum):
+    Empty = 1
+    'Source cell is empty'
+    Move = 2
+    'Move source to target'
+    Merge = 3
+    'Merge source cell to target'
+    Stay = 4
+    'Cannot merge source to target'
+
+
+class MoveResult(NamedTuple):
+    cells: list[int]
+    'Board after the move'
+    ops: list[tuple[MoveAction, int, int]]
+    'Moves and merges as (action, source index, target index)'
+    score: int
+    changed: bool
+
+
+def slideLine(line: Sequence[int]
+              ) -> tuple[list[int], list[tuple[MoveAction, int, int]], int]:
+    '''
+    Slides a line of exponents towards its start.
+
+    Returns the new line, the moves and merges in the order they have to
+    be applied (positions are line offsets) and the score gained.
+    '''
+    result = [0] * len(line)
+    ops = []
+    score = 0
+    last = -1
+    mergeable = False
+    for i, exponent in enumerate(line):
+        if not exponent:
+            continue
+        if mergeable and result[last] == exponent:
+            result[last] += 1
+            score += 1 << result[last]
+            ops.append((MoveAction.Merge, i, last))
+            mergeable = False
+        else:
+            last += 1
+            result[last] = exponent
+            mergeable = True
+            if last != i:
+                ops.append((MoveAction.Move, i, last))
+    return result, ops, score
+
+
+@lru_cache(maxsize=LINE_CACHE_SIZE)
+def _compressShortLine(line: tuple[int, ...]
+                       ) -> tuple[tuple[int, ...],
+                                  tuple[tuple[MoveAction, int, int], ...],
+                                  int]:
+    result, ops, score = slideLine(line)
+    return tuple(result), tuple(ops), score
+
+
+def compressLine(line: tuple[int, ...]
+                 ) -> tuple[tuple[int, ...],
+                            tuple[tuple[MoveAction, int, int], ...], int]:
+    '''
+    ``slideLine`` of a tuple of exponents, results are tuples. Lines up to
+    ``CACHED_LINE_LENGTH`` long are memoized.
+    '''
+    if len(line) <= CACHED_LINE_LENGTH:
+        return _compressShortLine(line)
+    result, ops, score = slideLine(line)
+    return tuple(result), tuple(ops), score
+
+
+def clearLineCache():
+    _compressShortLine.cache_clear()
+
+
+@lru_cache(maxsize=None)
+def lineIndices(rows: int, columns: int, direction: Direction
+                ) -> tuple[tuple[int, ...], ...]:
+    'Cell indices of every line, starting at the side tiles slide to'
+    if direction == Direction.Up:
+        return tuple(tuple(i * columns + j for i in range(rows))
+                     for j in range(columns))
+    if direction == Direction.Down:
+        return tuple(tuple(i * columns + j for i in reversed(range(rows)))
+                     for j in range(columns))
+    if direction == Direction.Left:
+        return tuple(tuple(i * columns + j for j in range(columns))
+                     for i in range(rows))
+    if direction == Direction.Right:
+        return tuple(tuple(i * columns + j for j in reversed(range(columns)))
+                     for i in range(rows))
+    raise ValueError(f'Unknown direction {direction}')
+
+
+@lru_cache(maxsize=None)
+def _lineGetters(rows: int, columns: int, direction: Direction):
+    'Pairs of line indices and a getter returning the line as a tuple'
+    getters = []
+    for indices in lineIndices(rows, columns, direction):
+        if len(indices) > 1:
+            getters.append((indices, itemgetter(*indices)))
+        else:
+            getters.append((indices, lambda cells, i=indices[0]: (cells[i],)))
+    return tuple(getters)
+
+
+def planMove(cells: Sequence[int], rows: int, columns: int,
+             direction: Direction) -> MoveResult:
+    '''
+    Resolves a move on any board size. Each line is compressed in one
+    pass, and short lines already seen are answered by ``compressLine``'s
+    cache.
+    '''
+    new_cells = list(cells)
+    ops = []
+    score = 0
+    for indices, getLine in _lineGetters(rows, columns, direction):
+        line, line_ops, line_score = compressLine(getLine(cells))
+        if not line_ops:
+            continue
+        for i, exponent in zip(indices, line):
+            new_cells[i] = exponent
+        ops.extend((action, indices[src], indices[dst])
+                   for action, src, dst in line_ops)
+        score += line_score
+    return MoveResult(new_cells, ops, score, bool(ops))
+
+
+def spawnExponent(rng: random.Random = random) -> int:
+    'A 2 three times in four, a 4 otherwise'
+    return 1 if rng.randint(0, 3) else 2
+
+
+_MASK64 = (1 << 64) - 1
+_GOLDEN = 0x9E37_79B9_7F4A_7C15
+
+
+def _splitmix(z: int) -> int:
+    'splitmix64 finalizer, a bijective mix of a 64-bit word'
+    z = ((z ^ (z >> 30)) * 0xBF58_476D_1CE4_E5B9) & _MASK64
+    z = ((z ^ (z >> 27)) * 0x94D0_49BB_1331_11EB) & _MASK64
+    return z ^ (z >> 31)
+
+
+class TurnRandom:
+    '''
+    splitmix64 generator with the ``random.Random`` methods spawning uses.
+    Starting one is two mixes, where seeding a ``random.Random`` fills the
+    whole Mersenne Twister state.
+    '''
+    __slots__ = ('_state',)
+
+    def __init__(self, seed: int, turn: int) -> None:
+        self._state = _splitmix(_splitmix(seed & _MASK64) ^ turn)
+
+    def _next(self) -> int:
+        self._state = state = (self._state + _GOLDEN) & _MASK64
+        return _splitmix(state)
+
+    def random(self) -> float:
+        return (self._next() >> 11) * (1. / (1 << 53))
+
+    def randrange(self, stop: int) -> int:
+        'Number in [0, stop), by multiplying instead of a modulo'
+        return (self._next() * stop) >> 64
+
+    def randint(self, a: int, b: int) -> int:
+        return a + self.randrange(b - a + 1)
+
+    def choice(self, seq: Sequence):
+        return seq[self.randrange(len(seq))]
+
+
+def turnRandom(seed: int, turn: int) -> TurnRandom:
+    '''
+    Generator for the tiles spawned by turn number `turn` of a seeded game,
+    turn 0 being the start.
+
+    Each turn gets its own generator, so the board after any list of moves
+    only depends on the seed and the moves, whatever was undone on the way.
+    '''
+    return TurnRandom(seed, turn)
+
+
+def legacyTurnRandom(seed: int, turn: int) -> random.Random:
+    'Generator ``turnRandom`` used to return, spawns of version 1 replays'
+    return random.Random((seed << 32) | turn)
+
+
+def emptyMask(cells: Sequence[int]) -> int:
+    'Bitmask with bit i set when cell i is empty'
+    mask = 0
+    for i, exponent in enumerate(cells):
+        if not exponent:
+            mask |= 1 << i
+    return mask
+
+
+def nthSetBit(mask: int, n: int) -> int:
+    'Position of the n-th (from 0) set bit, counting from the lowest one'
+    lo, hi = 0, mask.bit_length()
+    if not 0 <= n < mask.bit_count():
+        raise IndexError(f'Mask has no set bit number {n}')
+    # Bits below lo are at most n, bits below hi are more than n
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if (mask & ((1 << mid) - 1)).bit_count() > n:
+            hi = mid
+        else:
+            lo = mid
+    return lo
+
+
+def chooseSpawns(empty: int, num=TILES_AT_TURN,
+                 rng: random.Random = random) -> list[tuple[int, int]]:
+    '''
+    Picks up to `num` cells from the `empty` bitmask, returns them as
+    (index, exponent).
+
+    A cell is drawn as the k-th empty one in row-major order, which is
+    what ``random.choice`` over the list of empty cells would give.
+    '''
+    spawns = []
+    count = empty.bit_count()
+    for _ in range(min(num, count)):
+        i = nthSetBit(empty, rng.randrange(count))
+        empty &= ~(1 << i)
+        count -= 1
+        spawns.append((i, spawnExponent(rng)))
+    return spawns
+
+
+def applyOps(empty: int, ops: list[tuple[MoveAction, int, int]]) -> int:
+    'Updates an empty-cell bitmask with the ops of a move'
+    for action, src, dst in ops:
+        empty |= 1 << src
+        if action == MoveAction.Move:
+            empty &= ~(1 << dst)
+    return empty
+
+
+def legalMoves(cells: Sequence[int], rows: int, columns: int) -> int:
+    '''
+    Bitmask of the directions that change the board, bit
+    ``1 << direction`` for each of them.
+
+    Only looks at pairs of neighbours: a tile can go towards an empty
+    neighbour or an equal one.
+    '''
+    up, down, left, right = (1 << d for d in (Direction.Up, Direction.Down,
+                                              Direction.Left,
+                                              Direction.Right))
+    everything = up | down | left | right
+    mask = 0
+    for i in range(rows):
+        row = i * columns
+        for a, b in zip(cells[row:row + columns - 1],
+                        cells[row + 1:row + columns]):
+            if a == b:
+                if a:
+                    mask |= left | right
+            elif not a:
+                mask |= left
+            elif not b:
+                mask |= right
+        if mask & (left | right) == left | right:
+            break
+    for i in range(rows - 1):
+        row = i * columns
+        for a, b in zip(cells[row:row + columns],
+                        cells[row + columns:row + 2 * columns]):
+            if a == b:
+                if a:
+                    mask |= up | down
+            elif not a:
+                mask |= up
+            elif not b:
+                mask |= down
+        if mask == everything:
+            break
+    return mask
+
+
+class Game:
+    '''
+    Headless game: board, score, spawning and game over, without Qt.
+
+    With a `seed`, spawns come from ``turnRandom(seed, moves)`` instead of
+    `rng`, as in a ``GameController`` game started with that seed.
+    '''
+
+    def __init__(self, rows=4, columns=4,
+                 rng: random.Random | None = None,
+                 seed: int | None = None) -> None:
+        self.row_count = rows
+        self.column_count = columns
+        self.rng = rng if rng is not None else random.Random()
+        self.seed = seed
+
+        self.cells = [0] * (rows * columns)
+        self.empty = (1 << (rows * columns)) - 1
+        self.score = 0
+        self.moves = 0
+
+    def start(self):
+        return self.spawnRandom(TILES_AT_START)
+
+    def spawnRandom(self, num=TILES_AT_TURN):
+        rng = self.rng if self.seed is None \
+            else turnRandom(self.seed, self.moves)
+        spawns = chooseSpawns(self.empty, num, rng)
+        for i, exponent in spawns:
+            self.cells[i] = exponent
+            self.empty &= ~(1 << i)
+        return spawns
+
+    def move(self, direction: Direction):
+        'Applies a move and, if anything changed, spawns new tiles'
+        result = planMove(self.cells, self.row_count, self.column_count,
+                          direction)
+        if result.changed:
+            self.cells = result.cells
+            self.empty = applyOps(self.empty, result.ops)
+            self.score += result.score
+            self.moves += 1
+            self.spawnRandom()
+        return result
+
+    def isGameOver(self):
+        return not self.empty \
+            and not legalMoves(self.cells, self.row_count, self.column_count)
+
+    def maxTile(self):
+        return 1 << max(self.cells) if any(self.cells) else 0
+
+    def values(self) -> list[list[int]]:
+        return [[1 << e if e else 0
+                 for e in self.cells[i:i + self.column_count]]
+                for i in range(0, len(self.cells), self.column_count)]
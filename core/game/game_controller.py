@@ -1,47 +1,118 @@
 import random
+from collections import deque
 
 from PySide6.QtCore import (
-    QObject, Signal, Qt, QPoint
+    QObject, Signal, Qt, QPoint, QTimer
 )
 from PySide6.QtGui import (
-    QKeyEvent, QUndoStack
+    QKeyEvent
 )
 
-from core.game.tile import TileGrid, MoveAction
-from core.widgets.game_widget import GameScene
-from core.commands.turn_commands import (
-    TurnCommand, AddCommand, MoveCommand, MergeCommand
+from core import tracing
+from core.ai.hint import HintEngine
+from core.game.diff import TurnDiff, MOVE, MERGE, SPAWN
+from core.game.direction import Direction
+from core.game.engine import (
+    MoveAction, TILES_AT_START, TILES_AT_TURN,
+    planMove, chooseSpawns, applyOps, turnRandom
 )
+from core.game.journal import Journal, SessionState
+from core.game.replay import Replay
+from core.game.tile import TileGrid
+from core.widgets.game_widget import GameScene
+from core.commands.history import TurnHistory
 
-TILES_AT_START = 4
-TILES_AT_TURN = 1
+_KEY_DIRECTIONS = {
+    Qt.Key.Key_Up: Direction.Up,
+    Qt.Key.Key_Down: Direction.Down,
+    Qt.Key.Key_Left: Direction.Left,
+    Qt.Key.Key_Right: Direction.Right,
+}
+_DIRECTION_KEYS = {d: key for key, d in _KEY_DIRECTIONS.items()}
+_DIFF_KINDS = {MoveAction.Move: MOVE, MoveAction.Merge: MERGE}
 
+INPUT_QUEUE_LIMIT = 1
+'Moves that may wait for the running animation before it is skipped'
 
-class GameController(QObject):
 
-    turnStarted = Signal()
-    turnEnded = Signal()
-
-    tileAdded = Signal(int, QPoint)
-    tileRemoved = Signal(QPoint)
-    tileValueChanged = Signal(int, QPoint)
-    tileMoved = Signal(QPoint, QPoint)
+class GameController(QObject):
 
     def __init__(self, rows=4, columns=4,
                  parent: QObject | None = None) -> None:
         super().__init__(parent)
         parent.installEventFilter(self)
 
-        self._undo_stack = None
-        self._turn_command = None
+        self._history = None
+        self._journal: Journal | None = None
+        # Ops and score of the turn being built
+        self._turn_ops: list[tuple[int, int, int]] | None = None
+        self._turn_score = 0
 
         self._grid = None
         self._scene = None
+        # Board and empty-cell mask as they will be once the turn is done
+        self._cells: list[int] | None = None
+        self._empty = 0
+
+        # Keys waiting for the running animation to finish
+        self._pending: deque[Qt.Key] = deque()
+        self._draining = False
+
+        # Spawns of turn t come from turnRandom(seed, t). Moves that
+        # changed the board, including the ones that could be redone
+        self._seed = 0
+        self._moves: list[Direction] = []
+        # Move of the turn being built, None for the start
+        self._turn_direction: Direction | None = None
+
+        # Replay being played back
+        self._replay_keys: deque[Qt.Key] = deque()
+        self._replay_timer = QTimer(self)
+        self._replay_timer.timeout.connect(self._playNextMove)
+
+        self._hints = HintEngine(self)
+        self._hints.hintReady.connect(self.hintReady)
 
         self.setGrid(TileGrid(rows, columns))
 
-    def setUndoStack(self, undo_stack: QUndoStack):
-        self._undo_stack = undo_stack
+    def setHistory(self, history: TurnHistory):
+        if self._history is not None:
+            self._history.animationsFinished.disconnect(
+                self._processPending)
+            self._history.indexChanged.disconnect(self._hints.cancel)
+        self._history = history
+        history.animationsFinished.connect(self._processPending)
+        # Any change of the board makes a hint being searched stale
+        history.indexChanged.connect(self._hints.cancel)
+
+    def history(self):
+        return self._history
+
+    def setJournal(self, journal: Journal | None):
+        'Journal every turn, undo and redo is written to'
+        if self._journal is not None:
+            self._history.undone.disconnect(self._journal.undo)
+            self._history.redone.disconnect(self._journal.redo)
+        self._journal = journal
+        if journal is not None:
+            self._history.undone.connect(journal.undo)
+            self._history.redone.connect(journal.redo)
+
+    def journal(self):
+        return self._journal
+
+    hintReady = Signal(object, int)
+    'Suggested Direction, None if no move is left, and the search depth'
+
+    def requestHint(self) -> bool:
+        '''
+        Starts searching the best move in the background, ``hintReady``
+        delivers it. Returns False if the grid cannot be searched.
+        '''
+        return self._hints.request(self._grid)
+
+    def hints(self) -> HintEngine:
+        return self._hints
 
     gridChanged = Signal(TileGrid)
 
@@ -49,7 +120,9 @@ class GameController(QObject):
         if self._grid == grid:
             return
 
+        self._connectScene(False)
         self._grid = grid
+        self._connectScene(True)
         self.row_count = grid.row_count
         self.column_count = grid.column_count
         self.gridChanged.emit(self._grid)
@@ -61,45 +134,164 @@ class GameController(QObject):
         if self._scene == scene:
             return
 
+        self._connectScene(False)
         self._scene = scene
         self._scene.setSize(self.row_count, self.column_count)
+        self._connectScene(True)
 
     def scene(self):
         return self._scene
 
-    def start(self):
+    def _connectScene(self, connect: bool):
+        'The scene follows every turn the grid applies or reverts'
+        if self._grid is None or self._scene is None:
+            return
+        if connect:
+            self._grid.turnApplied.connect(self._scene.applyDiff)
+            self._grid.turnReverted.connect(self._scene.revertDiff)
+        else:
+            self._grid.turnApplied.disconnect(self._scene.applyDiff)
+            self._grid.turnReverted.disconnect(self._scene.revertDiff)
+
+    def start(self, seed: int | None = None):
+        'Starts a game on an empty grid, with a random seed by default'
+        self._seed = random.getrandbits(64) if seed is None else seed
+        self._moves = []
+        if self._journal is not None:
+            self._journal.start(self._seed, self.row_count, self.column_count)
         self.beginTurn()
         self.spawnRandom(TILES_AT_START)
         self.endTurn()
 
+    def clear(self):
+        'Empties the grid, the scene and the history'
+        self.stopReplay()
+        self._pending.clear()
+        self._history.finishAnimations()
+        for i, exponent in enumerate(self._grid.exponents()):
+            if exponent:
+                row, col = divmod(i, self.column_count)
+                self._grid.removeTile(row, col)
+                self._scene.removeTile(QPoint(col, row))
+        self._grid.score = 0
+        self._history.clear()
+
+    def restore(self, state: SessionState):
+        'Puts back a journaled session, with its undo history'
+        if (state.row_count, state.column_count) \
+                != (self.row_count, self.column_count):
+            raise ValueError('Session does not fit the grid')
+        # Nothing is touched unless the whole session can be put back
+        state.check()
+        self.clear()
+        for i, exponent in enumerate(state.cells):
+            if exponent:
+                row, col = divmod(i, self.column_count)
+                self._grid.addTile(row, col, 1 << exponent)
+                self._scene.addTile(1 << exponent, QPoint(col, row))
+        self._grid.score = state.score
+        self._seed = state.seed
+        self._moves = [Direction(d) for d in state.moves]
+        self._history.restore(list(state.turns), state.index, state.dropped)
+
+    def newGame(self, seed: int | None = None):
+        self.clear()
+        self.start(seed)
+
+    def seed(self):
+        return self._seed
+
+    def turn(self):
+        'Turns played in the current game, the start being turn 0'
+        return self._history.dropped() + self._history.index() - 1
+
+    def replay(self) -> Replay:
+        'Seed and moves leading to the current board'
+        return Replay(self._seed, self.row_count, self.column_count,
+                      self._moves[:max(self.turn(), 0)])
+
+    replayFinished = Signal()
+
+    def playReplay(self, replay: Replay, interval=250):
+        '''
+        Starts a new game with the seed of `replay` and plays its moves, one
+        every `interval` ms. Arrow keys are ignored until it is over.
+        '''
+        if (replay.row_count, replay.column_count) \
+                != (self.row_count, self.column_count):
+            raise ValueError(
+                f'Replay is {replay.row_count}x{replay.column_count}, '
+                f'the game {self.row_count}x{self.column_count}')
+        self.newGame(replay.seed)
+        self._replay_keys = deque(_DIRECTION_KEYS[d] for d in replay.moves())
+        self._replay_timer.start(interval)
+
+    def isReplaying(self):
+        return self._replay_timer.isActive()
+
+    def stopReplay(self):
+        if self.isReplaying():
+            self._replay_timer.stop()
+            self._replay_keys.clear()
+            self.replayFinished.emit()
+
+    def _playNextMove(self):
+        if not self._replay_keys:
+            self.stopReplay()
+            return
+        self._pending.append(self._replay_keys.popleft())
+        self._processPending()
+
     def spawnRandom(self, num=TILES_AT_TURN):
-        empty_cells: list[tuple[int, int]] = []
-        for i in range(self.grid().row_count):
-            for j in range(self.grid().column_count):
-                if self.grid().isCellEmpty(i, j):
-                    empty_cells.append((i, j))
-        for i, j in random.sample(empty_cells, num):
+        rng = turnRandom(self._seed, self.turn() + 1)
+        for i, exponent in chooseSpawns(self._empty, num, rng):
+            self._cells[i] = exponent
+            self._empty &= ~(1 << i)
             self.addTile(
-                2 if random.randint(0, 3) else 4,
-                QPoint(i, j)
+                1 << exponent,
+                QPoint(*divmod(i, self.column_count))
             )
 
-    def beginTurn(self):
-        self._grid.beginTurn()
-        self._turn_command = TurnCommand(self.grid())
-        print('start turn')
+    def score(self):
+        return self._grid.score
+
+    def isGameOver(self):
+        return self._grid.isGameOver()
 
-    def endTurn(self, do_push=True):
-        self._grid.endTurn()
-        if do_push:
-            self._undo_stack.push(self._turn_command)
-        self._turn_command = None
-        print('end turn')
+    gameOver = Signal()
+
+    def beginTurn(self):
+        with tracing.span('beginTurn'):
+            self._grid.beginTurn()
+            self._cells = self._grid.exponents()
+            self._empty = self._grid.emptyMask()
+            self._turn_ops = []
+            self._turn_score = 0
+        tracing.log('start turn')
+
+    def endTurn(self, do_push=True, animate=True):
+        with tracing.span('endTurn', pushed=bool(do_push)):
+            self._grid.endTurn()
+            if do_push:
+                diff = TurnDiff(self._turn_ops, self._turn_score)
+                self._history.push(diff, animate)
+                if self._journal is not None:
+                    self._journal.push(diff, self._turn_direction)
+            self._turn_direction = None
+            self._turn_ops = None
+            self._cells = None
+        tracing.log('end turn')
+        tracing.sampleCounters()
+        if do_push and self.isGameOver():
+            self.gameOver.emit()
+
+    def _index(self, cell: QPoint):
+        return cell.x() * self.column_count + cell.y()
 
     def addTile(self, value: int, cell: QPoint):
-        AddCommand(value, cell,
-                   self.scene(), self.grid(), self._turn_command)
-        print('add tile')
+        self._turn_ops.append(
+            (SPAWN, self._index(cell), value.bit_length() - 1))
+        tracing.log('add tile')
 
     # @Slot(QPoint)
     # def removeTile(self, cell: QPoint):
@@ -107,134 +299,93 @@ class GameController(QObject):
     #     print('remove tile')
 
     def mergeTile(self, new_cell: QPoint, old_cell: QPoint):
-        MergeCommand(new_cell, old_cell,
-                     self.scene(), self.grid(), self._turn_command)
-        print('merge tile')
+        self._turn_ops.append(
+            (MERGE, self._index(old_cell), self._index(new_cell)))
+        tracing.log('merge tile')
 
     def moveTile(self, new_cell: QPoint, old_cell: QPoint):
-        MoveCommand(new_cell, old_cell,
-                    self.scene(), self.grid(), self._turn_command)
-        print('move tile')
+        self._turn_ops.append(
+            (MOVE, self._index(old_cell), self._index(new_cell)))
+        tracing.log('move tile')
 
     def eventFilter(self, obj, event):
         if type(event) is QKeyEvent \
                 and event.type() == QKeyEvent.Type.KeyRelease:
-            if event.key() in (Qt.Key.Key_Up, Qt.Key.Key_Down,
-                               Qt.Key.Key_Left, Qt.Key.Key_Right):
-                self._processMove(event.key())
+            if event.key() in _KEY_DIRECTIONS and not self.isReplaying():
+                self._hints.cancel()
+                self._pending.append(event.key())
+                self._processPending()
         return False
 
-    def _processMove(self, key: Qt.Key):
+    def _processPending(self):
+        '''
+        Plays the queued moves.
+
+        A move waits for the running animation to end. Once more than
+        ``INPUT_QUEUE_LIMIT`` moves are waiting, the animation jumps to its
+        end, every queued move but the last is applied without animation
+        and the last one is animated.
+        '''
+        if self._draining or not self._pending:
+            return
+        if self._history.isAnimating():
+            if len(self._pending) <= INPUT_QUEUE_LIMIT:
+                return
+            self._draining = True
+            self._history.finishAnimations()
+            self._draining = False
+
+        self._draining = True
+        try:
+            while self._pending:
+                key = self._pending.popleft()
+                self._processMove(key, animate=not self._pending)
+        finally:
+            self._draining = False
+
+    def _processMove(self, key: Qt.Key, animate=True):
+        with tracing.span('turn', key=int(key), animated=animate):
+            self._processTurn(key, animate)
+
+    def _processTurn(self, key: Qt.Key, animate: bool):
         self.beginTurn()
 
-        if key == Qt.Key.Key_Up:
-            result = self._moveUp()
-        elif key == Qt.Key.Key_Down:
-            result = self._moveDown()
-        elif key == Qt.Key.Key_Left:
-            result = self._moveLeft()
-        elif key == Qt.Key.Key_Right:
-            result = self._moveRight()
+        direction = _KEY_DIRECTIONS.get(key)
+        if direction is not None and self._grid.canMove(direction):
+            result = self._move(direction)
         else:
             result = False
 
         if result:
             self.spawnRandom()
-
-        self.endTurn(result)
+            turn = self.turn()
+            del self._moves[turn:]
+            self._moves.append(direction)
+            self._turn_direction = direction
+
+        self.endTurn(result, animate)
+
+    def _move(self, direction: Direction):
+        with tracing.span('move.scan', direction=direction.name):
+            result = planMove(self._cells, self.row_count,
+                              self.column_count, direction)
+        # Ops are already flat indices, no need to go through cells
+        self._turn_ops.extend(
+            (_DIFF_KINDS[action], src, dst) for action, src, dst in result.ops
+        )
+        self._cells = result.cells
+        self._empty = applyOps(self._empty, result.ops)
+        self._turn_score += result.score
+        return result.changed
 
     def _moveUp(self):
-        field_changed = False
-        for j in range(self.grid().column_count):
-            target_cell = 0
-            for i in range(1, self.grid().row_count):
-                for k in range(target_cell, i):
-                    result = self.grid().checkMove(
-                        i, j, k, j
-                    )
-                    # print(result)
-                    if result in (MoveAction.Move, MoveAction.Merge):
-                        break
-                if result == MoveAction.Move:
-                    self.moveTile(QPoint(k, j), QPoint(i, j))
-                    target_cell = k
-                    field_changed = True
-                elif result == MoveAction.Merge:
-                    self.mergeTile(QPoint(k, j), QPoint(i, j))
-                    target_cell = k + 1
-                    field_changed = True
-                elif result == MoveAction.Stay:
-                    target_cell = i
-        return field_changed
+        return self._move(Direction.Up)
 
     def _moveDown(self):
-        field_changed = False
-        for j in range(self.grid().column_count):
-            target_cell = self.grid().row_count - 1
-            for i in range(target_cell - 1, -1, -1):
-                for k in range(target_cell, i, -1):
-                    result = self.grid().checkMove(
-                        i, j, k, j
-                    )
-                    # print(result)
-                    if result in (MoveAction.Move, MoveAction.Merge):
-                        break
-                if result == MoveAction.Move:
-                    self.moveTile(QPoint(k, j), QPoint(i, j))
-                    target_cell = k
-                    field_changed = True
-                elif result == MoveAction.Merge:
-                    self.mergeTile(QPoint(k, j), QPoint(i, j))
-                    target_cell = k - 1
-                    field_changed = True
-                elif result == MoveAction.Stay:
-                    target_cell = i
-        return field_changed
+        return self._move(Direction.Down)
 
     def _moveLeft(self):
-        field_changed = False
-        for i in range(self.grid().row_count):
-            target_cell = 0
-            for j in range(1, self.grid().column_count):
-                for k in range(target_cell, j):
-                    result = self.grid().checkMove(
-                        i, j, i, k
-                    )
-                    # print(result)
-                    if result in (MoveAction.Move, MoveAction.Merge):
-                        break
-                if result == MoveAction.Move:
-                    self.moveTile(QPoint(i, k), QPoint(i, j))
-                    target_cell = k
-                    field_changed = True
-                elif result == MoveAction.Merge:
-                    self.mergeTile(QPoint(i, k), QPoint(i, j))
-                    target_cell = k + 1
-                    field_changed = True
-                elif result == MoveAction.Stay:
-                    target_cell = j
-        return field_changed
+        return self._move(Direction.Left)
 
     def _moveRight(self):
-        field_changed = False
-        for i in range(self.grid().row_count):
-            target_cell = self.grid().column_count - 1
-            for j in range(target_cell - 1, -1, -1):
-                for k in range(target_cell, j, -1):
-                    result = self.grid().checkMove(
-                        i, j, i, k
-                    )
-                    # print(result)
-                    if result in (MoveAction.Move, MoveAction.Merge):
-                        break
-                if result == MoveAction.Move:
-                    self.moveTile(QPoint(i, k), QPoint(i, j))
-                    target_cell = k
-                    field_changed = True
-                elif result == MoveAction.Merge:
-                    self.mergeTile(QPoint(i, k), QPoint(i, j))
-                    target_cell = k - 1
-                    field_changed = True
-                elif result == MoveAction.Stay:
-                    target_cell = j
-        return field_changed
+        return self._move(Direction.Right)
@@ -0,0 +1,372 @@
+'''
+Append-only session journal.
+
+Every turn, undo and redo of a game is appended to a file as a record,
+so the session, with its undo history, can be restored after the window
+is closed or the process dies. Records are written at once but only
+fsynced in batches. Every ``snapshot_every`` records the journal is
+compacted into a single snapshot of the session, so restoring reads one
+snapshot and at most that many records, however long the session ran.
+
+Record layout, little-endian: payload length (u32), kind (u8), payload,
+CRC-32 of kind and payload (u32). A record cut short by a crash fails the
+check and is dropped, with everything after it.
+'''
+import os
+import struct
+import time
+import zlib
+from collections import deque
+from typing import Iterator
+
+from core.game.diff import TurnDiff, MERGE, SPAWN
+from core.game.direction import Direction
+
+
+START = 0
+'New game: seed (u64), rows, columns (u8)'
+TURN = 1
+'Turn pushed: direction (u8, NO_DIRECTION for the start), TurnDiff bytes'
+UNDO = 2
+REDO = 3
+SNAPSHOT = 4
+'Whole ``SessionState``'
+
+NO_DIRECTION = 0xFF
+
+_HEAD = struct.Struct('<IB')
+_CRC = struct.Struct('<I')
+_START = struct.Struct('<QBB')
+_SNAPSHOT = struct.Struct('<QBBIIIII')
+
+
+class SessionState:
+    '''
+    Board, score, seed, moves and undo history of a game, as rebuilt
+    from journal records.
+
+    Mirrors ``TurnHistory``: `turns` are the diffs it holds, `index` the
+    number of them that are played and `dropped` the turns forgotten at
+    the front. Like its undo and byte limits, at most `max_turns` turns
+    taking at most `max_bytes` bytes are kept (0 means no limit).
+    '''
+
+    def __init__(self, seed=0, rows=4, columns=4,
+                 max_turns=1000, max_bytes=0) -> None:
+        self.seed = seed
+        self.row_count = rows
+        self.column_count = columns
+        self.max_turns = max_turns
+        self.max_bytes = max_bytes
+        self.cells = [0] * (rows * columns)
+        self.score = 0
+        self.turns: deque[TurnDiff] = deque()
+        self.index = 0
+        self.dropped = 0
+        self._bytes = 0
+        # Directions of every move of the game, including the ones that
+        # could be redone
+        self.moves = bytearray()
+
+    def push(self, diff: TurnDiff, direction: Direction | None):
+        while len(self.turns) > self.index:
+            self._bytes -= self.turns.pop().nbytes()
+        self.turns.append(diff)
+        self._bytes += diff.nbytes()
+        self.index += 1
+        _checkTurn(diff, self.cells, self._top(), True)
+        self.score += diff.score
+        if direction is not None:
+            del self.moves[self.dropped + self.index - 2:]
+            self.moves.append(direction)
+        self._trim()
+
+    def _trim(self):
+        def tooBig():
+            return (self.max_turns and len(self.turns) > self.max_turns
+                    or self.max_bytes and self._bytes > self.max_bytes)
+
+        while self.index > 0 and tooBig():
+            self._bytes -= self.turns.popleft().nbytes()
+            self.index -= 1
+            self.dropped += 1
+
+    def undo(self):
+        if self.index > 0:
+            self.index -= 1
+            diff = self.turns[self.index]
+            _checkTurn(diff, self.cells, self._top(), False)
+            self.score -= diff.score
+
+    def redo(self):
+        if self.index < len(self.turns):
+            diff = self.turns[self.index]
+            _checkTurn(diff, self.cells, self._top(), True)
+            self.score += diff.score
+            self.index += 1
+
+    def _top(self) -> int:
+        # Spawning only 4s on an empty board reaches 2 ** (cells + 1)
+        return self.row_count * self.column_count + 1
+
+    def check(self):
+        '''
+        Raises ValueError unless the board fits its size, tiles are in
+        range and every turn can be undone and redone on it
+        '''
+        size = self.row_count * self.column_count
+        if len(self.cells) != size:
+            raise ValueError('Session board does not fit its size')
+        top = self._top()
+        if any(not 0 <= exponent <= top for exponent in self.cells):
+            raise ValueError('Session holds a tile out of range')
+        if not 0 <= self.index <= len(self.turns):
+            raise ValueError('Session history index out of range')
+        for direction in self.moves:
+            Direction(direction)
+
+        board = list(self.cells)
+        turns = list(self.turns)
+        for diff in reversed(turns[:self.index]):
+            _checkTurn(diff, board, top, False)
+        for diff in turns:
+            _checkTurn(diff, board, top, True)
+
+    def toBytes(self) -> bytes:
+        parts = [
+            _SNAPSHOT.pack(self.seed, self.row_count, self.column_count,
+                           self.score, self.index, self.dropped,
+                           len(self.turns), len(self.moves)),
+            bytes(self.cells),
+            bytes(self.moves)
+        ]
+        for diff in self.turns:
+            data = diff.toBytes()
+            parts.append(_CRC.pack(len(data)))
+            parts.append(data)
+        return b''.join(parts)
+
+    @classmethod
+    def fromBytes(cls, data: bytes, max_turns=1000,
+                  max_bytes=0) -> 'SessionState':
+        seed, rows, columns, score, index, dropped, turns, moves = \
+            _SNAPSHOT.unpack_from(data)
+        state = cls(seed, rows, columns, max_turns, max_bytes)
+        offset = _SNAPSHOT.size
+        cells = rows * columns
+        state.cells = list(data[offset:offset + cells])
+        offset += cells
+        state.moves = bytearray(data[offset:offset + moves])
+        offset += moves
+        for _ in range(turns):
+            size, = _CRC.unpack_from(data, offset)
+            offset += _CRC.size
+            state.turns.append(TurnDiff.fromBytes(data[offset:offset + size]))
+            offset += size
+        state.score = score
+        state.index = index
+        state.dropped = dropped
+        state._bytes = sum(diff.nbytes() for diff in state.turns)
+        return state
+
+
+def _checkTurn(diff: TurnDiff, board: list[int], top: int, forward: bool):
+    '''
+    Plays `diff` on `board` one op at a time, raises ValueError when an op
+    does not fit the cells it is played on
+    '''
+    size = len(board)
+    ops = list(diff.ops())
+    for kind, a, b in ops if forward else reversed(ops):
+        if not 0 <= a < size or kind != SPAWN and not 0 <= b < size:
+            raise ValueError('Session turn does not fit the board')
+        if kind == SPAWN:
+            fits = not board[a] and 0 < b <= top if forward \
+                else board[a] == b
+        elif kind == MERGE:
+            fits = 0 < board[a] == board[b] < top if forward \
+                else not board[a] and board[b] > 1
+        else:
+            fits = board[a] and not board[b] if forward \
+                else board[b] and not board[a]
+        if not fits:
+            raise ValueError('Session turn does not fit the board')
+        if kind == SPAWN:
+            board[a] = b if forward else 0
+        elif kind == MERGE:
+            board[b] += 1 if forward else -1
+            board[a] = 0 if forward else board[b]
+        elif forward:
+            board[b], board[a] = board[a], 0
+        else:
+            board[a], board[b] = board[b], 0
+
+
+def _records(data: bytes) -> Iterator[tuple[int, bytes, int]]:
+    'Valid records as (kind, payload, end offset)'
+    offset = 0
+    while offset + _HEAD.size <= len(data):
+        size, kind = _HEAD.unpack_from(data, offset)
+        start = offset + _HEAD.size
+        end = start + size + _CRC.size
+        if end > len(data):
+            return
+        crc, = _CRC.unpack_from(data, start + size)
+        if zlib.crc32(data[offset + 4:start + size]) != crc:
+            return
+        yield kind, data[start:start + size], end
+        offset = end
+
+
+def _record(kind: int, payload: bytes) -> bytes:
+    head = _HEAD.pack(len(payload), kind)
+    return head + payload + _CRC.pack(zlib.crc32(head[4:] + payload))
+
+
+class Journal:
+    '''
+    Session journal stored at `path`.
+
+    Opening it reads the session left in the file, if any, into `state`
+    and drops a torn last record. A record that is whole but does not fit
+    the session drops the session, and everything from that record on.
+    From then on `state` follows what is appended. `max_turns` and
+    `max_bytes` should be the limits of the game's ``TurnHistory``.
+    '''
+
+    def __init__(self, path: str, max_turns=1000, snapshot_every=256,
+                 batch=16, interval=0.5, max_bytes=0) -> None:
+        self.path = path
+        self.max_turns = max_turns
+        self.max_bytes = max_bytes
+        self.snapshot_every = snapshot_every
+        self.batch = batch
+        self.interval = interval
+
+        self.state: SessionState | None = None
+        self._records = 0
+        self._pending = 0
+        self._synced = time.monotonic()
+
+        size = self._load()
+        self._file = open(path, 'ab')
+        if self._file.tell() > size:
+            self._file.truncate(size)
+            self._file.seek(size)
+
+    def start(self, seed: int, rows: int, columns: int):
+        self.state = SessionState(seed, rows, columns, self.max_turns,
+                                  self.max_bytes)
+        self._append(START, _START.pack(seed, rows, columns))
+
+    def push(self, diff: TurnDiff, direction: Direction | None = None):
+        if self.state is None:
+            raise RuntimeError('Journal has no game started')
+        self.state.push(diff, direction)
+        self._append(TURN, bytes([NO_DIRECTION if direction is None
+                                  else direction]) + diff.toBytes())
+
+    def undo(self):
+        if self.state is not None:
+            self.state.undo()
+            self._append(UNDO, b'')
+
+    def redo(self):
+        if self.state is not None:
+            self.state.redo()
+            self._append(REDO, b'')
+
+    def sync(self):
+        'Writes buffered records through to the disk'
+        if self._pending:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._pending = 0
+        self._synced = time.monotonic()
+
+    def compact(self):
+        'Replaces the records with one snapshot of the session'
+        if self.state is None:
+            return
+        temp = self.path + '.tmp'
+        with open(temp, 'wb') as file:
+            file.write(_record(SNAPSHOT, self.state.toBytes()))
+            file.flush()
+            os.fsync(file.fileno())
+        self._file.close()
+        os.replace(temp, self.path)
+        self._syncDirectory()
+        self._file = open(self.path, 'ab')
+        self._records = 0
+        self._pending = 0
+
+    def close(self):
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
+
+    def _append(self, kind: int, payload: bytes):
+        self._file.write(_record(kind, payload))
+        self._records += 1
+        self._pending += 1
+        if self.snapshot_every and self._records >= self.snapshot_every:
+            self.compact()
+        elif self._pending >= self.batch \
+                or time.monotonic() - self._synced >= self.interval:
+            self.sync()
+
+    def _load(self) -> int:
+        'Rebuilds the state from the file, returns the size of its valid part'
+        try:
+            with open(self.path, 'rb') as file:
+                data = file.read()
+        except FileNotFoundError:
+            return 0
+
+        valid = 0
+        for kind, payload, end in _records(data):
+            try:
+                self._replay(kind, payload)
+            except (ValueError, IndexError, struct.error):
+                # Written whole but not by a consistent session: the
+                # session is lost, and the record is dropped like a torn
+                # one
+                self.state = None
+                return valid
+            valid = end
+        return valid
+
+    def _replay(self, kind: int, payload: bytes):
+        'Plays one record on the state, raises if it does not fit'
+        self._records += 1
+        if kind == START:
+            seed, rows, columns = _START.unpack(payload)
+            self.state = SessionState(seed, rows, columns, self.max_turns,
+                                      self.max_bytes)
+        elif kind == SNAPSHOT:
+            self.state = SessionState.fromBytes(payload, self.max_turns,
+                                                self.max_bytes)
+            self.state.check()
+            self._records = 0
+        elif self.state is None:
+            return
+        elif kind == TURN:
+            self.state.push(
+                TurnDiff.fromBytes(payload[1:]),
+                None if payload[0] == NO_DIRECTION
+                else Direction(payload[0]))
+        elif kind == UNDO:
+            self.state.undo()
+        elif kind == REDO:
+            self.state.redo()
+
+    def _syncDirectory(self):
+        # The rename is only durable once the directory is synced
+        if not hasattr(os, 'O_DIRECTORY'):
+            return
+        fd = os.open(os.path.dirname(os.path.abspath(self.path)),
+                     os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
@@ -0,0 +1,287 @@
+'''
+Seeded game records and a headless replayer.
+
+A replay is the seed of a game and the moves that changed the board.
+Spawns of turn ``t`` come from ``turnRandom(seed, t)``, so the seed and
+the moves are enough to rebuild every board of the game.
+
+    python -m core.game.replay game1.2048 game2.2048
+
+Binary layout, little-endian:
+
+    header       magic 'P2RP', version, rows, columns, flags (4 x u8),
+                 seed (u64), move count (u32), checkpoint count (u32)
+    moves        2 bits per ``Direction``, four moves per byte, first move
+                 in the lowest bits
+    checkpoints  turn (u32), score (u32), one exponent byte per cell
+
+Checkpoints are optional boards at some turns, they let the replayer start
+close to the turn it is asked for instead of at the start.
+
+Version 1 replays were recorded when ``turnRandom`` seeded a
+``random.Random`` per turn; they are replayed with
+``legacyTurnRandom`` and saved again as version 1.
+'''
+import argparse
+import struct
+import sys
+import time
+from typing import Iterable, Iterator, NamedTuple
+
+from core.game import bitboard
+from core.game.direction import Direction
+from core.game.engine import (
+    TILES_AT_START, planMove, chooseSpawns, applyOps, emptyMask, turnRandom,
+    legacyTurnRandom
+)
+
+
+MAGIC = b'P2RP'
+VERSION = 2
+
+_HEADER = struct.Struct('<4sBBBBQII')
+_CHECKPOINT = struct.Struct('<II')
+_DIRECTIONS = tuple(Direction)
+
+
+class ReplayState(NamedTuple):
+    turn: int
+    'Moves played, 0 for the start'
+    cells: list[int]
+    'Row-major exponents'
+    score: int
+
+
+class Replay:
+    '''
+    Seed, board size and moves of one game, plus optional checkpoints.
+    '''
+
+    def __init__(self, seed: int, rows=4, columns=4,
+                 moves: Iterable[Direction] = ()) -> None:
+        if not 0 <= seed < 1 << 64:
+            raise ValueError(f'Seed {seed} does not fit in 64 bits')
+        self.seed = seed
+        self.row_count = rows
+        self.column_count = columns
+        self._moves = bytearray(Direction(d) for d in moves)
+        self.version = VERSION
+        # turn -> (exponents, score)
+        self.checkpoints: dict[int, tuple[bytes, int]] = {}
+
+    def __len__(self) -> int:
+        return len(self._moves)
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Replay) \
+            and self.toBytes() == other.toBytes()
+
+    def __repr__(self) -> str:
+        return (f'Replay(seed={self.seed}, {self.row_count}x'
+                f'{self.column_count}, {len(self)} moves)')
+
+    def append(self, direction: Direction):
+        self._moves.append(Direction(direction))
+
+    def moves(self) -> list[Direction]:
+        return [_DIRECTIONS[d] for d in self._moves]
+
+    def addCheckpoint(self, state: ReplayState):
+        if len(state.cells) != self.row_count * self.column_count:
+            raise ValueError('Checkpoint does not fit the board')
+        self.checkpoints[state.turn] = (bytes(state.cells), state.score)
+
+    def checkpoint(self, turn: int) -> ReplayState | None:
+        'Latest checkpoint at or before `turn`'
+        best = max((t for t in self.checkpoints if t <= turn), default=None)
+        if best is None:
+            return None
+        cells, score = self.checkpoints[best]
+        return ReplayState(best, list(cells), score)
+
+    def toBytes(self) -> bytes:
+        moves = bytearray((len(self._moves) + 3) // 4)
+        for i, d in enumerate(self._moves):
+            moves[i >> 2] |= d << (2 * (i & 3))
+        parts = [
+            _HEADER.pack(MAGIC, self.version, self.row_count,
+                         self.column_count,
+                         0, self.seed, len(self._moves),
+                         len(self.checkpoints)),
+            bytes(moves)
+        ]
+        for turn in sorted(self.checkpoints):
+            cells, score = self.checkpoints[turn]
+            parts.append(_CHECKPOINT.pack(turn, score))
+            parts.append(cells)
+        return b''.join(parts)
+
+    @classmethod
+    def fromBytes(cls, data: bytes) -> 'Replay':
+        if len(data) < _HEADER.size:
+            raise ValueError('Replay is truncated')
+        magic, version, rows, columns, _, seed, count, checkpoints = \
+            _HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError('Not a replay')
+        if not 1 <= version <= VERSION:
+            raise ValueError(f'Unsupported replay version {version}')
+
+        replay = cls(seed, rows, columns)
+        replay.version = version
+        offset = _HEADER.size
+        moves = data[offset:offset + (count + 3) // 4]
+        offset += (count + 3) // 4
+        cells = rows * columns
+        if len(moves) * 4 < count \
+                or len(data) < offset + checkpoints * (_CHECKPOINT.size
+                                                       + cells):
+            raise ValueError('Replay is truncated')
+        replay._moves = bytearray(
+            (moves[i >> 2] >> (2 * (i & 3))) & 3 for i in range(count))
+
+        for _ in range(checkpoints):
+            turn, score = _CHECKPOINT.unpack_from(data, offset)
+            offset += _CHECKPOINT.size
+            replay.checkpoints[turn] = (bytes(data[offset:offset + cells]),
+                                        score)
+            offset += cells
+        return replay
+
+    def save(self, path: str):
+        with open(path, 'wb') as file:
+            file.write(self.toBytes())
+
+    @classmethod
+    def load(cls, path: str) -> 'Replay':
+        with open(path, 'rb') as file:
+            return cls.fromBytes(file.read())
+
+
+class Replayer:
+    '''
+    Rebuilds the boards of a replay without Qt.
+
+    4x4 games run on ``bitboard``, other sizes on ``engine.planMove``.
+    A move that does not change the board means the replay does not match
+    its seed and raises ``ValueError``.
+    '''
+
+    def __init__(self, replay: Replay) -> None:
+        self.replay = replay
+        self._bitboard = replay.row_count == bitboard.ROWS \
+            and replay.column_count == bitboard.COLUMNS
+        self._random = turnRandom if replay.version >= 2 \
+            else legacyTurnRandom
+
+    def start(self) -> ReplayState:
+        cells = [0] * (self.replay.row_count * self.replay.column_count)
+        for i, exponent in chooseSpawns(emptyMask(cells), TILES_AT_START,
+                                        self._random(self.replay.seed, 0)):
+            cells[i] = exponent
+        return ReplayState(0, cells, 0)
+
+    def state(self, turn: int | None = None) -> ReplayState:
+        'Board after `turn` moves, the last one by default'
+        if turn is None:
+            turn = len(self.replay)
+        if not 0 <= turn <= len(self.replay):
+            raise IndexError(f'Replay has no turn {turn}')
+        state = self.replay.checkpoint(turn) or self.start()
+        for state in self._run(state, turn):
+            pass
+        return state
+
+    def states(self) -> Iterator[ReplayState]:
+        'Every board from the start to the last move'
+        state = self.start()
+        yield state
+        yield from self._run(state, len(self.replay), every=True)
+
+    def addCheckpoints(self, every: int):
+        'Stores a checkpoint every `every` turns'
+        for state in self.states():
+            if state.turn and state.turn % every == 0:
+                self.replay.addCheckpoint(state)
+
+    def _run(self, state: ReplayState, turn: int,
+             every=False) -> Iterator[ReplayState]:
+        if self._bitboard:
+            return self._runBitboard(state, turn, every)
+        return self._runCells(state, turn)
+
+    def _runBitboard(self, state: ReplayState, turn: int,
+                     every: bool) -> Iterator[ReplayState]:
+        seed = self.replay.seed
+        moves = self.replay._moves
+        board, score = bitboard.pack(state.cells), state.score
+        yield state
+        for t in range(state.turn + 1, turn + 1):
+            board, gained, changed = bitboard.move(
+                board, _DIRECTIONS[moves[t - 1]])
+            if not changed:
+                raise ValueError(f'Move {t} does not change the board')
+            board = bitboard.spawnRandom(board, self._random(seed, t))
+            score += gained
+            if every or t == turn:
+                yield ReplayState(t, bitboard.unpack(board), score)
+
+    def _runCells(self, state: ReplayState,
+                  turn: int) -> Iterator[ReplayState]:
+        seed = self.replay.seed
+        moves = self.replay._moves
+        rows, columns = self.replay.row_count, self.replay.column_count
+        cells, score = list(state.cells), state.score
+        empty = emptyMask(cells)
+        yield state
+        for t in range(state.turn + 1, turn + 1):
+            result = planMove(cells, rows, columns, _DIRECTIONS[moves[t - 1]])
+            if not result.changed:
+                raise ValueError(f'Move {t} does not change the board')
+            cells = result.cells
+            empty = applyOps(empty, result.ops)
+            for i, exponent in chooseSpawns(empty, 1, self._random(seed, t)):
+                cells[i] = exponent
+                empty &= ~(1 << i)
+            score += result.score
+            yield ReplayState(t, list(cells), score)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m core.game.replay',
+        description='Replays recorded games and prints their outcome.')
+    parser.add_argument('paths', nargs='+')
+    parser.add_argument('--checkpoints', type=int, default=0, metavar='N',
+                        help='rewrite the files with a checkpoint every N '
+                             'turns')
+    args = parser.parse_args(argv)
+
+    turns = 0
+    failed = 0
+    started = time.perf_counter()
+    for path in args.paths:
+        try:
+            replay = Replay.load(path)
+            replayer = Replayer(replay)
+            state = replayer.state()
+        except (OSError, ValueError) as error:
+            print(f'{path}: {error}', file=sys.stderr)
+            failed += 1
+            continue
+        if args.checkpoints:
+            replay.checkpoints.clear()
+            replayer.addCheckpoints(args.checkpoints)
+            replay.save(path)
+        turns += state.turn
+        print(f'{path}: {state.turn} moves, score {state.score}, '
+              f'max tile {1 << max(state.cells)}')
+
+    seconds = time.perf_counter() - started
+    print(f'{len(args.paths) - failed} games, {turns} turns in '
+          f'{seconds:.2f} s ({turns / max(seconds, 1e-9):.0f} turns/s)')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
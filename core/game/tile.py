@@ -1,51 +1,59 @@
-from enum import Enum
+from array import array
 
 from PySide6.QtCore import (
-    QObject, Signal, Property, QPoint
+    QObject, Signal, QPoint
 )
 
+from core import tracing
+from core.game.diff import TurnDiff, MOVE, MERGE, SPAWN
+from core.game.direction import Direction
+from core.game.engine import MoveAction, nthSetBit, legalMoves
 
-class Tile(QObject):
-    def __init__(self, value=2, parent: QObject | None = None) -> None:
-        super().__init__(parent)
 
-        self._value = int(value)
+class Tile:
+    '''
+    Lightweight handle to a cell of a ``TileGrid``.
+
+    Tiles are not stored anywhere, the grid only keeps exponents. A tile
+    refers to its cell, so after the grid moves it away the handle shows
+    whatever is in that cell now.
+    '''
+    __slots__ = ('_grid', '_index')
 
-    valueChanged = Signal(int)
+    def __init__(self, grid: 'TileGrid', index: int) -> None:
+        self._grid = grid
+        self._index = index
 
-    @Property(int, notify=valueChanged)
+    @property
     def value(self):
-        return self._value
+        exponent = self._grid._cells[self._index]
+        return 1 << exponent if exponent else 0
 
     @value.setter
     def value(self, value):
-        value = int(value)
-        if self._value != value:
-            self._value = value
-            self.valueChanged.emit(value)
-
-    _cell = QPoint()
+        self._grid._cells[self._index] = _exponent(value)
+        self._grid._legal = None
 
     def cell(self):
-        parent: TileGrid = self.parent()
-        try:
-            self._cell = parent.findTile(self)
-        finally:
-            return self._cell
+        return QPoint(*divmod(self._index, self._grid.column_count))
+
+    def __eq__(self, other) -> bool:
+        return isinstance(other, Tile) and self._grid is other._grid \
+            and self._index == other._index
+
+    def __hash__(self) -> int:
+        return hash((id(self._grid), self._index))
 
     def __str__(self) -> str:
         return str(self.value)
 
 
-class MoveAction(Enum):
-    Empty = 1
-    'Source cell is empty'
-    Move = 2
-    'Move source to target'
-    Merge = 3
-    'Merge source cell to target'
-    Stay = 4
-    'Cannot merge source to target'
+def _exponent(value) -> int:
+    value = int(value)
+    exponent = value.bit_length() - 1
+    if value <= 0 or value != 1 << exponent:
+        raise ValueError(f'Tile value {value} is not a power of two')
+    return exponent
 
 
 class TileGrid(QObject):
@@ -53,11 +61,10 @@ class TileGrid(QObject):
     turnStarted = Signal()
     turnEnded = Signal()
 
-    tileAdded = Signal(int, QPoint)
-    tileRemoved = Signal(QPoint)
-    tileMerged = Signal(int, QPoint, QPoint)
-    tileMoved = Signal(QPoint, QPoint)
-    tileValueChanged = Signal(int, QPoint)
+    turnApplied = Signal(object)
+    'TurnDiff just played by applyDiff'
+    turnReverted = Signal(object)
+    'TurnDiff just taken back by revertDiff'
 
     def __init__(self, rows=4, columns=4,
                  parent: QObject | None = None) -> None:
@@ -65,143 +72,281 @@ class TileGrid(QObject):
 
         self.row_count = rows
         self.column_count = columns
-        self._grid: list[list[Tile | None]] = \
-            [[None for _ in range(rows)] for _ in range(columns)]
+        # Row-major tile exponents, 0 for empty cells
+        self._cells = array('B', bytes(rows * columns))
+        self._new_cells: array | None = None
+        # Bit i is set while cell i is empty
+        self._empty = (1 << (rows * columns)) - 1
+        self._free_count = rows * columns
+        # legalMoves() of the current cells, None once they changed
+        self._legal: int | None = 0
+        self.score = 0
+
+    def _index(self, row, col):
+        if not (0 <= row < self.row_count and 0 <= col < self.column_count):
+            raise IndexError(f'Cell {row, col} is out of the grid')
+        return row * self.column_count + col
+
+    def _occupy(self, index):
+        self._empty &= ~(1 << index)
+        self._free_count -= 1
+        self._legal = None
+
+    def _vacate(self, index):
+        self._empty |= 1 << index
+        self._free_count += 1
+        self._legal = None
 
     def beginTurn(self):
-        self._new_grid = [row.copy() for row in self._grid]
+        self._new_cells = array('B', self._cells)
+        tracing.count('grid.signals')
         self.turnStarted.emit()
 
     def endTurn(self):
-        self._new_grid = None
+        self._new_cells = None
+        tracing.count('grid.signals')
         self.turnEnded.emit()
 
     def addTile(self, row, col, value):
-        target: Tile | None = self._grid[row][col]
-        if target is not None:
-            self.print()
-            raise IndexError(f'[Add] Cell {row, col} is not empty')
-
-        tile = Tile(value, self)
-        self._grid[row][col] = tile
-        self.tileAdded.emit(tile.value, tile.cell())
-        return tile
+        index = self._index(row, col)
+        if self._cells[index]:
+            raise IndexError(
+                self._error(f'[Add] Cell {row, col} is not empty'))
+
+        self._cells[index] = _exponent(value)
+        self._occupy(index)
+        return Tile(self, index)
 
     def mergeTile(self, old_row, old_col, row, col):
-        source: Tile | None = self._grid[old_row][old_col]
-        target: Tile | None = self._grid[row][col]
-        if source is None:
-            self.print()
-            raise ValueError(
+        source = self._index(old_row, old_col)
+        target = self._index(row, col)
+        if not self._cells[source]:
+            raise ValueError(self._error(
                 f'[Merge] Source cell {old_row, old_col} is empty'
-            )
-        if target is None:
-            self.print()
-            raise ValueError(f'[Merge] Target cell {row, col} is empty')
-        if source.value != target.value:
-            self.print()
+            ))
+        if not self._cells[target]:
             raise ValueError(
+                self._error(f'[Merge] Target cell {row, col} is empty'))
+        if self._cells[source] != self._cells[target]:
+            raise ValueError(self._error(
                 '[Merge] Source and target cell values are not equal ' +
-                f'({source.value} vs {target.value})'
-            )
-
-        self._grid[row][col] = source
-        self._grid[old_row][old_col] = None
-        source.value *= 2
-        self.tileMerged.emit(
-            source.value,
-            QPoint(row, col),
-            QPoint(old_row, old_col))
-        return source
+                f'({1 << self._cells[source]} vs {1 << self._cells[target]})'
+            ))
+
+        self._cells[target] += 1
+        self._cells[source] = 0
+        self._vacate(source)
+        tile = Tile(self, target)
+        self.score += tile.value
+        return tile
 
     def unmergeTile(self, old_row, old_col, row, col):
-        source: Tile | None = self._grid[old_row][old_col]
-        target: Tile | None = self._grid[row][col]
-        if source is None:
-            self.print()
-            raise ValueError(
+        source = self._index(old_row, old_col)
+        target = self._index(row, col)
+        if not self._cells[source]:
+            raise ValueError(self._error(
                 f'[Unmerge] Source cell {old_row, old_col} is empty'
-            )
-        if target is not None:
-            self.print()
-            raise ValueError(f'[Unmerge] Target cell {row, col} is not empty')
-
-        self._grid[row][col] = Tile(source.value / 2, self)
-        source.value /= 2
-        # self.tileMerged.emit(
-        #     source.value,
-        #     QPoint(row, col),
-        #     QPoint(old_row, old_col))
-        return self._grid[row][col]
+            ))
+        if self._cells[target]:
+            raise ValueError(self._error(
+                f'[Unmerge] Target cell {row, col} is not empty'))
+
+        self.score -= 1 << self._cells[source]
+        self._cells[source] -= 1
+        self._cells[target] = self._cells[source]
+        self._occupy(target)
+        return Tile(self, target)
 
     def moveTile(self, old_row, old_col, row, col):
-        source: Tile | None = self._grid[old_row][old_col]
-        target: Tile | None = self._grid[row][col]
-        if source is None:
-            self.print()
-            raise ValueError(f'[Move] Source cell {old_row, old_col} is empty')
-        if target is not None:
-            self.print()
-            raise ValueError(f'[Move] Target cell {row, col} is not empty')
-
-        self._grid[row][col] = source
-        self._grid[old_row][old_col] = None
-        self.tileMoved.emit(QPoint(row, col), QPoint(old_row, old_col))
-        return source
+        source = self._index(old_row, old_col)
+        target = self._index(row, col)
+        if not self._cells[source]:
+            raise ValueError(self._error(
+                f'[Move] Source cell {old_row, old_col} is empty'))
+        if self._cells[target]:
+            raise ValueError(
+                self._error(f'[Move] Target cell {row, col} is not empty'))
+
+        self._cells[target] = self._cells[source]
+        self._cells[source] = 0
+        self._vacate(source)
+        self._occupy(target)
+        return Tile(self, target)
 
     def changeTileValue(self, value, row, col):
-        target: Tile | None = self._grid[row][col]
-        if target is None:
-            self.print()
-            raise ValueError(f'[Change value] Target cell {row, col} is empty')
+        index = self._index(row, col)
+        if not self._cells[index]:
+            raise ValueError(self._error(
+                f'[Change value] Target cell {row, col} is empty'))
 
-        target.value = value
-        self.tileValueChanged.emit(value, QPoint(row, col))
-        return target
+        self._cells[index] = _exponent(value)
+        self._legal = None
+        return Tile(self, index)
 
     def removeTile(self, row, col):
-        target: Tile | None = self._grid[row][col]
-        if target is None:
-            self.print()
-            raise ValueError(f'[Remove] Target cell {row, col} is empty')
+        index = self._index(row, col)
+        if not self._cells[index]:
+            raise ValueError(
+                self._error(f'[Remove] Target cell {row, col} is empty'))
+
+        value = 1 << self._cells[index]
+        self._cells[index] = 0
+        self._vacate(index)
+        return value
+
+    def applyDiff(self, diff: TurnDiff):
+        '''
+        Plays a whole turn and emits ``turnApplied`` once. Ops are checked
+        like the single-tile methods would check them.
+        '''
+        cells = self._cells
+        for kind, a, b in diff.ops():
+            if kind == SPAWN:
+                if cells[a]:
+                    raise IndexError(self._error(
+                        f'[Add] Cell {self._cell(a)} is not empty'))
+                cells[a] = b
+                self._occupy(a)
+            elif not cells[a]:
+                raise ValueError(
+                    self._error(f'Source cell {self._cell(a)} is empty'))
+            elif kind == MERGE:
+                if cells[a] != cells[b]:
+                    raise ValueError(self._error(
+                        f'[Merge] Cells {self._cell(a)} and {self._cell(b)} '
+                        'are not equal'))
+                cells[b] += 1
+                cells[a] = 0
+                self._vacate(a)
+            else:
+                if cells[b]:
+                    raise ValueError(self._error(
+                        f'[Move] Target cell {self._cell(b)} is not empty'))
+                cells[b] = cells[a]
+                cells[a] = 0
+                self._vacate(a)
+                self._occupy(b)
+        self.score += diff.score
+        tracing.count('grid.signals')
+        self.turnApplied.emit(diff)
+
+    def revertDiff(self, diff: TurnDiff):
+        'Takes a turn back and emits ``turnReverted`` once'
+        cells = self._cells
+        for kind, a, b in reversed(list(diff.ops())):
+            if kind == SPAWN:
+                if not cells[a]:
+                    raise ValueError(self._error(
+                        f'[Remove] Cell {self._cell(a)} is empty'))
+                cells[a] = 0
+                self._vacate(a)
+            elif not cells[b]:
+                raise ValueError(
+                    self._error(f'Target cell {self._cell(b)} is empty'))
+            elif cells[a]:
+                raise ValueError(
+                    self._error(f'Source cell {self._cell(a)} is not empty'))
+            elif kind == MERGE:
+                cells[b] -= 1
+                cells[a] = cells[b]
+                self._occupy(a)
+            else:
+                cells[a] = cells[b]
+                cells[b] = 0
+                self._vacate(b)
+                self._occupy(a)
+        self.score -= diff.score
+        tracing.count('grid.signals')
+        self.turnReverted.emit(diff)
 
-        self._grid[row][col] = None
-        self.tileRemoved.emit(QPoint(row, col))
-        return target
+    def _cell(self, index) -> tuple[int, int]:
+        return divmod(index, self.column_count)
 
     def checkMove(self, old_row, old_col, row, col):
-        target: Tile | None = self._new_grid[row][col]
-        source: Tile | None = self._new_grid[old_row][old_col]
-        if source is None:
+        cells = self._new_cells
+        target = row * self.column_count + col
+        source = old_row * self.column_count + old_col
+        if not cells[source]:
             return MoveAction.Empty
-        elif target is None:
-            self._new_grid[row][col] = source
-            self._new_grid[old_row][old_col] = None
+        elif not cells[target]:
+            cells[target] = cells[source]
+            cells[source] = 0
             return MoveAction.Move
         else:
-            if source.value == target.value:
-                self._new_grid[row][col] = source
-                self._new_grid[old_row][old_col] = None
+            if cells[source] == cells[target]:
+                # Like a merge in the real grid, minus doubling the value
+                cells[target] = cells[source]
+                cells[source] = 0
                 return MoveAction.Merge
             else:
                 return MoveAction.Stay
 
     def isCellEmpty(self, row, col):
-        grid = self._new_grid if self._new_grid else self._grid
-        return grid[row][col] is None
+        cells = self._new_cells if self._new_cells is not None \
+            else self._cells
+        return not cells[self._index(row, col)]
+
+    def emptyMask(self) -> int:
+        'Bitmask with bit ``row * column_count + col`` set for empty cells'
+        return self._empty
+
+    def freeCount(self) -> int:
+        return self._free_count
+
+    def isFull(self) -> bool:
+        return not self._free_count
+
+    def legalMoves(self) -> int:
+        '''
+        Bitmask of the directions that would change the grid, bit
+        ``1 << direction`` for each. Computed once per change of the cells.
+        '''
+        if self._legal is None:
+            self._legal = legalMoves(self._cells, self.row_count,
+                                     self.column_count)
+        return self._legal
+
+    def canMove(self, direction: Direction) -> bool:
+        return bool(self.legalMoves() & (1 << direction))
+
+    def isGameOver(self) -> bool:
+        'No move left on a full grid, an empty one has not started'
+        return self.isFull() and not self.legalMoves()
+
+    def randomEmptyCell(self, rng) -> tuple[int, int] | None:
+        'A uniformly drawn empty (row, col), None if the grid is full'
+        if not self._free_count:
+            return None
+        index = nthSetBit(self._empty, rng.randrange(self._free_count))
+        return divmod(index, self.column_count)
+
+    def tile(self, row, col) -> Tile | None:
+        index = self._index(row, col)
+        return Tile(self, index) if self._cells[index] else None
+
+    def exponents(self) -> list[int]:
+        'Row-major tile exponents, 0 for empty cells'
+        return self._cells.tolist()
 
     def findTile(self, tile: Tile):
-        for i in range(self.row_count):
-            for j in range(self.column_count):
-                if self._grid[i][j] == tile:
-                    return QPoint(i, j)
-        raise ValueError('Tile not in grid')
+        if tile._grid is not self or not self._cells[tile._index]:
+            raise ValueError('Tile not in grid')
+        return tile.cell()
+
+    def dump(self) -> str:
+        cells = self._new_cells if self._new_cells is not None \
+            else self._cells
+        return '\n'.join(
+            ['====================']
+            + ['\t'.join([str(1 << it) if it else 'None'
+                          for it in cells[i:i + self.column_count]])
+               for i in range(0, len(cells), self.column_count)]
+            + ['====================']
+        )
 
     def print(self):
-        grid = self._new_grid if self._new_grid else self._grid
-        print('====================')
-        print('\n'.join(
-            ['\t'.join([str(it) for it in row])
-             for row in grid]
-        ))
-        print('====================')
+        print(self.dump())
+
+    def _error(self, message: str) -> str:
+        'Message of an error, followed by the board it happened on'
+        return f'{message}\n{self.dump()}'
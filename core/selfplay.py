@@ -0,0 +1,173 @@
+'''
+Headless self-play on every core.
+
+    python -m core.selfplay --games 10000 --policy greedy --seed 1
+
+Games are split into chunks that run on a ``ProcessPoolExecutor``. Each
+game gets its own ``random.Random`` seeded from the base seed and the
+game number, so results do not depend on how games were scheduled.
+Workers send one message per chunk with a compact record per game.
+'''
+import argparse
+import csv
+import os
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Iterator, NamedTuple
+
+from core.game import bitboard
+from core.game.engine import TILES_AT_START
+from core.ai.policies import POLICIES, makePolicy
+
+
+class GameResult(NamedTuple):
+    game: int
+    score: int
+    max_tile: int
+    moves: int
+    seconds: float
+
+
+def gameSeed(seed: int, game: int) -> int:
+    return (seed << 32) | game
+
+
+def playGame(policy, rng: random.Random,
+             max_moves: int | None = None) -> tuple[int, int, int, int]:
+    'Plays one game, returns (final board, score, max tile, moves)'
+    policy.reset()
+    board = 0
+    for _ in range(TILES_AT_START):
+        board = bitboard.spawnRandom(board, rng)
+
+    score = 0
+    moves = 0
+    while max_moves is None or moves < max_moves:
+        direction = policy(board, rng)
+        if direction is None:
+            break
+        board, gained, _ = bitboard.move(board, direction)
+        board = bitboard.spawnRandom(board, rng)
+        score += gained
+        moves += 1
+    return board, score, 1 << bitboard.maxExponent(board), moves
+
+
+_policy = None
+
+
+def _initWorker(policy: str, options: dict):
+    global _policy
+    _policy = makePolicy(policy, **options)
+
+
+def _playChunk(seed: int, games: range,
+               max_moves: int | None) -> list[GameResult]:
+    results = []
+    for game in games:
+        start = time.perf_counter()
+        _, score, max_tile, moves = playGame(
+            _policy, random.Random(gameSeed(seed, game)), max_moves
+        )
+        results.append(GameResult(game, score, max_tile, moves,
+                                  time.perf_counter() - start))
+    return results
+
+
+def selfPlay(games: int, policy='random', seed=0,
+             workers: int | None = None, chunk_size: int | None = None,
+             max_moves: int | None = None,
+             **options) -> Iterator[list[GameResult]]:
+    'Yields chunks of results in the order they finish'
+    workers = workers or os.cpu_count() or 1
+    if chunk_size is None:
+        # A few chunks per worker keeps cores busy until the end
+        chunk_size = max(1, min(256, games // (workers * 4)))
+
+    with ProcessPoolExecutor(workers, initializer=_initWorker,
+                             initargs=(policy, options)) as executor:
+        futures = [
+            executor.submit(_playChunk, seed,
+                            range(start, min(start + chunk_size, games)),
+                            max_moves)
+            for start in range(0, games, chunk_size)
+        ]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(
+        prog='python -m core.selfplay',
+        description='Play 2048 games headlessly on every core.')
+    parser.add_argument('--games', type=int, default=100)
+    parser.add_argument('--policy', choices=POLICIES, default='random')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None,
+                        help='worker processes (default: all cores)')
+    parser.add_argument('--chunk-size', type=int, default=None,
+                        help='games per worker message')
+    parser.add_argument('--max-moves', type=int, default=None)
+    parser.add_argument('--depth', type=int, default=2,
+                        help='expectimax search depth')
+    parser.add_argument('--table', default=None,
+                        help='transposition table file shared by the '
+                             'expectimax workers')
+    parser.add_argument('--weights', default=None,
+                        help='n-tuple network file, needed by ntuple and '
+                             'replacing the expectimax heuristic')
+    parser.add_argument('--output', default=None,
+                        help='CSV file for per-game results')
+    args = parser.parse_args(argv)
+
+    options = {}
+    if args.policy == 'expectimax':
+        options['depth'] = args.depth
+        options['table'] = args.table
+        options['weights'] = args.weights
+    elif args.policy == 'ntuple':
+        if args.weights is None:
+            parser.error('--policy ntuple needs --weights')
+        options['weights'] = args.weights
+
+    output = open(args.output, 'w', newline='') if args.output else None
+    writer = None
+    if output is not None:
+        writer = csv.writer(output)
+        writer.writerow(GameResult._fields)
+
+    start = time.perf_counter()
+    count = total_score = total_moves = 0
+    best_tile = 0
+    tiles: dict[int, int] = {}
+    try:
+        for chunk in selfPlay(args.games, args.policy, args.seed,
+                              args.workers, args.chunk_size,
+                              args.max_moves, **options):
+            if writer is not None:
+                writer.writerows(chunk)
+            for result in chunk:
+                count += 1
+                total_score += result.score
+                total_moves += result.moves
+                best_tile = max(best_tile, result.max_tile)
+                tiles[result.max_tile] = tiles.get(result.max_tile, 0) + 1
+    finally:
+        if output is not None:
+            output.close()
+    elapsed = time.perf_counter() - start
+
+    if not count:
+        return
+    print(f'{count} games of {args.policy} in {elapsed:.2f}s '
+          f'({total_moves / elapsed:.0f} moves/s)')
+    print(f'mean score {total_score / count:.1f}, '
+          f'mean moves {total_moves / count:.1f}, best tile {best_tile}')
+    for tile in sorted(tiles):
+        print(f'{tile:>6}: {tiles[tile] / count:6.1%}')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,342 @@
+'''
+Policies played against each other on the same games.
+
+    python -m core.tournament random greedy expectimax:depth=1 --games 2000
+
+Every game number gets one seed, and every policy plays that game. Spawns
+of turn ``t`` come from ``turnRandom(seed, t)`` like in a seeded
+``GameController`` game, so all policies see the same spawns for as long
+as their boards allow. Game ``game`` can be watched again as a ``Replay``
+of seed ``gameSeed(seed, game)``, which fits the 64 bits of a replay
+while the base seed is below ``2 ** 32``, so larger ones are refused.
+Policies draw their own choices from a separate generator.
+
+Results are folded into running aggregates as chunks come back from the
+workers, no game is kept. Each policy is compared with the first one on
+the score difference of each game: pairing removes most of the luck of
+the spawns from the comparison, so far fewer games are needed to tell
+two policies apart.
+'''
+import argparse
+import json
+import math
+import os
+import random
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from statistics import NormalDist
+from typing import Iterator
+
+from core.game import bitboard
+from core.game.engine import TILES_AT_START, chooseSpawns, turnRandom
+from core.selfplay import GameResult, gameSeed
+from core.ai.policies import makePolicy
+
+
+CONFIDENCE = .95
+
+
+def parsePolicy(spec: str) -> tuple[str, dict]:
+    '''
+    Splits ``name:key=value,...`` into a policy name and its options,
+    e.g. ``expectimax:depth=3,prob_cutoff=0.001,table=hints.ttable``.
+    Values that are not numbers stay strings.
+    '''
+    name, _, rest = spec.partition(':')
+    options = {}
+    for item in filter(None, rest.split(',')):
+        key, sep, value = item.partition('=')
+        if not sep:
+            raise ValueError(f'Option {item!r} of {spec!r} has no value')
+        for convert in (int, float, str):
+            try:
+                options[key] = convert(value)
+                break
+            except ValueError:
+                pass
+    return name, options
+
+
+def playSeeded(policy, seed: int,
+               max_moves: int | None = None) -> tuple[int, int, int]:
+    'Plays the game of `seed`, returns (score, max tile, moves)'
+    policy.reset()
+    rng = random.Random(seed)
+    cells = [0] * bitboard.CELLS
+    for i, exponent in chooseSpawns((1 << bitboard.CELLS) - 1,
+                                    TILES_AT_START, turnRandom(seed, 0)):
+        cells[i] = exponent
+    board = bitboard.pack(cells)
+
+    score = 0
+    moves = 0
+    while max_moves is None or moves < max_moves:
+        direction = policy(board, rng)
+        if direction is None:
+            break
+        board, gained, _ = bitboard.move(board, direction)
+        moves += 1
+        board = bitboard.spawnRandom(board, turnRandom(seed, moves))
+        score += gained
+    return score, 1 << bitboard.maxExponent(board), moves
+
+
+class RunningStats:
+    '''
+    Count, mean, variance, minimum and maximum of a stream of numbers,
+    updated one value at a time (Welford).
+    '''
+    __slots__ = ('count', 'mean', '_m2', 'min', 'max')
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.mean = 0.
+        self._m2 = 0.
+        self.min = math.inf
+        self.max = -math.inf
+
+    def add(self, value: float):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self._m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def variance(self) -> float:
+        'Sample variance, 0 below two values'
+        return self._m2 / (self.count - 1) if self.count > 1 else 0.
+
+    def stdev(self) -> float:
+        return math.sqrt(self.variance())
+
+    def interval(self, confidence=CONFIDENCE) -> tuple[float, float]:
+        'Normal confidence interval of the mean'
+        if not self.count:
+            return math.nan, math.nan
+        z = NormalDist().inv_cdf(.5 + confidence / 2)
+        half = z * self.stdev() / math.sqrt(self.count)
+        return self.mean - half, self.mean + half
+
+    def toDict(self, confidence=CONFIDENCE) -> dict:
+        low, high = self.interval(confidence)
+        return {'mean': self.mean, 'stdev': self.stdev(),
+                'ci': [low, high], 'min': self.min, 'max': self.max}
+
+
+def wilsonInterval(hits: int, count: int,
+                   confidence=CONFIDENCE) -> tuple[float, float]:
+    'Confidence interval of a proportion, sound near 0 and 1'
+    if not count:
+        return math.nan, math.nan
+    z = NormalDist().inv_cdf(.5 + confidence / 2)
+    p = hits / count
+    center = p + z * z / (2 * count)
+    half = z * math.sqrt(p * (1 - p) / count + z * z / (4 * count * count))
+    scale = 1 + z * z / count
+    return (center - half) / scale, (center + half) / scale
+
+
+class PolicyStats:
+    'Aggregates of one policy, and of its games against the baseline'
+    __slots__ = ('score', 'moves', 'tiles', 'diff', 'wins', 'losses')
+
+    def __init__(self) -> None:
+        self.score = RunningStats()
+        self.moves = RunningStats()
+        # Max tile -> games
+        self.tiles: Counter[int] = Counter()
+        # Score minus the baseline's on the same game
+        self.diff = RunningStats()
+        self.wins = 0
+        self.losses = 0
+
+    def add(self, result: GameResult, baseline: GameResult):
+        self.score.add(result.score)
+        self.moves.add(result.moves)
+        self.tiles[result.max_tile] += 1
+        self.diff.add(result.score - baseline.score)
+        if result.score > baseline.score:
+            self.wins += 1
+        elif result.score < baseline.score:
+            self.losses += 1
+
+    def tileRates(self, confidence=CONFIDENCE) -> dict[int, dict]:
+        'Share of games reaching at least each tile'
+        games = self.score.count
+        rates = {}
+        reached = 0
+        for tile in sorted(self.tiles, reverse=True):
+            reached += self.tiles[tile]
+            low, high = wilsonInterval(reached, games, confidence)
+            rates[tile] = {'rate': reached / games, 'ci': [low, high]}
+        return dict(sorted(rates.items()))
+
+
+class Standings:
+    '''
+    Running results of a tournament. `policies` are the specs passed to
+    ``tournament``, the first one is the baseline.
+    '''
+
+    def __init__(self, policies: list[str]) -> None:
+        if len(set(policies)) != len(policies):
+            raise ValueError('Policies are listed more than once')
+        self.policies = list(policies)
+        self.stats = {policy: PolicyStats() for policy in self.policies}
+
+    def add(self, results: tuple[GameResult, ...]):
+        'Results of one game, in the order of `policies`'
+        baseline = results[0]
+        for policy, result in zip(self.policies, results):
+            self.stats[policy].add(result, baseline)
+
+    def games(self) -> int:
+        return self.stats[self.policies[0]].score.count
+
+    def report(self, confidence=CONFIDENCE) -> dict:
+        baseline = self.policies[0]
+        policies = {}
+        for policy in self.policies:
+            stats = self.stats[policy]
+            entry = {
+                'score': stats.score.toDict(confidence),
+                'moves': stats.moves.toDict(confidence),
+                'max_tile': stats.tileRates(confidence),
+            }
+            if policy != baseline:
+                low, high = stats.diff.interval(confidence)
+                entry['vs_baseline'] = {
+                    'score_diff': stats.diff.toDict(confidence),
+                    'wins': stats.wins,
+                    'losses': stats.losses,
+                    # Sign of the difference is settled at this confidence
+                    'significant': low > 0 or high < 0,
+                }
+            policies[policy] = entry
+        return {'games': self.games(), 'confidence': confidence,
+                'baseline': baseline, 'policies': policies}
+
+
+_policies = None
+
+
+def _initWorker(policies: list[str]):
+    global _policies
+    _policies = [makePolicy(name, **options)
+                 for name, options in map(parsePolicy, policies)]
+
+
+def _playChunk(seed: int, games: range, max_moves: int | None
+               ) -> list[tuple[GameResult, ...]]:
+    chunk = []
+    for game in games:
+        game_seed = gameSeed(seed, game)
+        results = []
+        for policy in _policies:
+            start = time.perf_counter()
+            score, max_tile, moves = playSeeded(policy, game_seed, max_moves)
+            results.append(GameResult(game, score, max_tile, moves,
+                                      time.perf_counter() - start))
+        chunk.append(tuple(results))
+    return chunk
+
+
+def tournament(policies: list[str], games: int, seed=0,
+               workers: int | None = None, chunk_size: int | None = None,
+               max_moves: int | None = None
+               ) -> Iterator[list[tuple[GameResult, ...]]]:
+    '''
+    Plays every game with every policy, yields chunks of per-game results
+    in the order they finish.
+    '''
+    workers = workers or os.cpu_count() or 1
+    if chunk_size is None:
+        chunk_size = max(1, min(64, games // (workers * 4)))
+
+    with ProcessPoolExecutor(workers, initializer=_initWorker,
+                             initargs=(list(policies),)) as executor:
+        futures = [
+            executor.submit(_playChunk, seed,
+                            range(start, min(start + chunk_size, games)),
+                            max_moves)
+            for start in range(0, games, chunk_size)
+        ]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def _printReport(report: dict):
+    print(f'{report["games"]} games, {report["confidence"]:.0%} intervals, '
+          f'baseline {report["baseline"]}')
+    for policy, entry in report['policies'].items():
+        score = entry['score']
+        moves = entry['moves']
+        low, high = score['ci']
+        print(f'{policy}: score {score["mean"]:.0f} [{low:.0f}, {high:.0f}]'
+              f', moves {moves["mean"]:.0f}')
+        for tile, rate in entry['max_tile'].items():
+            if tile >= 512:
+                low, high = rate['ci']
+                print(f'  {tile:>6}+: {rate["rate"]:6.1%} '
+                      f'[{low:.1%}, {high:.1%}]')
+        versus = entry.get('vs_baseline')
+        if versus is not None:
+            diff = versus['score_diff']
+            low, high = diff['ci']
+            print(f'  vs baseline: {diff["mean"]:+.0f} '
+                  f'[{low:+.0f}, {high:+.0f}], {versus["wins"]} wins, '
+                  f'{versus["losses"]} losses'
+                  + (', significant' if versus['significant'] else ''))
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(
+        prog='python -m core.tournament',
+        description='Compare 2048 policies on the same seeded games.')
+    parser.add_argument('policies', nargs='+',
+                        help='policy specs, e.g. greedy or '
+                             'expectimax:depth=3; the first is the baseline')
+    parser.add_argument('--games', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None,
+                        help='worker processes (default: all cores)')
+    parser.add_argument('--chunk-size', type=int, default=None,
+                        help='games per worker message')
+    parser.add_argument('--max-moves', type=int, default=None)
+    parser.add_argument('--confidence', type=float, default=CONFIDENCE)
+    parser.add_argument('--output', default=None,
+                        help='JSON file for the report')
+    args = parser.parse_args(argv)
+    if not 0 <= args.seed < 1 << 32:
+        parser.error('--seed must be in [0, 2 ** 32) for games to be '
+                     'replayable')
+
+    try:
+        for spec in args.policies:
+            name, options = parsePolicy(spec)
+            makePolicy(name, **options)
+        standings = Standings(args.policies)
+    except (TypeError, ValueError) as error:
+        parser.error(str(error))
+
+    start = time.perf_counter()
+    for chunk in tournament(args.policies, args.games, args.seed,
+                            args.workers, args.chunk_size, args.max_moves):
+        for results in chunk:
+            standings.add(results)
+    elapsed = time.perf_counter() - start
+
+    report = standings.report(args.confidence)
+    report['seed'] = args.seed
+    report['seconds'] = elapsed
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(report, file, indent=2)
+    _printReport(report)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,158 @@
+'''
+Opt-in tracing of turns.
+
+Off by default, then spans, counters and log messages cost a flag check.
+Set ``PY2048_TRACE`` to a file name to record them and write them as
+Chrome trace-event JSON (chrome://tracing, https://ui.perfetto.dev) when
+the process exits. Set ``PY2048_VERBOSE`` to print log messages, as the
+game used to.
+
+    with tracing.span('beginTurn'):
+        ...
+    tracing.count('scene.lookups')
+    tracing.log(grid.dump)
+'''
+import atexit
+import json
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import nullcontext
+from typing import Callable
+
+
+_enabled = False
+_verbose = False
+_events: list[dict] = []
+_counters: Counter[str] = Counter()
+_origin = time.perf_counter_ns()
+_pid = os.getpid()
+_NULL = nullcontext()
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def enable(verbose: bool | None = None):
+    global _enabled, _verbose
+    _enabled = True
+    if verbose is not None:
+        _verbose = verbose
+
+
+def disable():
+    global _enabled
+    _enabled = False
+
+
+def setVerbose(verbose: bool):
+    global _verbose
+    _verbose = verbose
+
+
+def _now() -> float:
+    'Microseconds since the module was loaded'
+    return (time.perf_counter_ns() - _origin) / 1000
+
+
+class _Span:
+    __slots__ = ('name', 'category', 'args', 'start')
+
+    def __init__(self, name: str, category: str, args: dict) -> None:
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = _now()
+        return self
+
+    def __exit__(self, *exc):
+        _events.append({
+            'name': self.name, 'cat': self.category, 'ph': 'X',
+            'ts': self.start, 'dur': _now() - self.start,
+            'pid': _pid, 'tid': threading.get_ident(), 'args': self.args
+        })
+        return False
+
+
+def span(name: str, category='turn', **args):
+    'Context manager recording how long its body took'
+    if not _enabled:
+        return _NULL
+    return _Span(name, category, args)
+
+
+def asyncBegin(name: str, id: int, category='animation'):
+    'Start of something that ends in another call, e.g. an animation'
+    if _enabled:
+        _events.append({'name': name, 'cat': category, 'ph': 'b',
+                        'id': id, 'ts': _now(), 'pid': _pid, 'tid': 0})
+
+
+def asyncEnd(name: str, id: int, category='animation'):
+    if _enabled:
+        _events.append({'name': name, 'cat': category, 'ph': 'e',
+                        'id': id, 'ts': _now(), 'pid': _pid, 'tid': 0})
+
+
+def count(name: str, n=1):
+    if _enabled:
+        _counters[name] += n
+
+
+def sampleCounters():
+    'Adds the counters to the trace, as they are now'
+    if _enabled and _counters:
+        _events.append({'name': 'counters', 'ph': 'C', 'ts': _now(),
+                        'pid': _pid, 'tid': 0, 'args': dict(_counters)})
+
+
+def log(message: str | Callable[[], str]):
+    '''
+    Records a message, printed when verbose. A callable is only called
+    when the message is used.
+    '''
+    if not (_enabled or _verbose):
+        return
+    if callable(message):
+        message = message()
+    if _verbose:
+        print(message)
+    if _enabled:
+        _events.append({'name': message.split('\n', 1)[0], 'ph': 'i',
+                        's': 't', 'ts': _now(), 'pid': _pid,
+                        'tid': threading.get_ident(),
+                        'args': {'message': message}})
+
+
+def events() -> list[dict]:
+    return list(_events)
+
+
+def counters() -> dict[str, int]:
+    return dict(_counters)
+
+
+def clear():
+    _events.clear()
+    _counters.clear()
+
+
+def toJson() -> dict:
+    return {'traceEvents': _events, 'displayTimeUnit': 'ms',
+            'otherData': {'counters': dict(_counters)}}
+
+
+def export(path: str):
+    with open(path, 'w') as file:
+        json.dump(toJson(), file)
+
+
+if os.environ.get('PY2048_VERBOSE'):
+    _verbose = True
+if os.environ.get('PY2048_TRACE'):
+    enable()
+    atexit.register(export, os.environ['PY2048_TRACE'])
@@ -1,17 +1,20 @@
 from math import log2
 
 from PySide6.QtCore import (
-    QAbstractAnimation, QRectF, QRect, Slot, QPoint, Qt,
+    QAbstractAnimation, QPointF, QRectF, QRect, Slot, QPoint, Qt,
     QEasingCurve, QVariantAnimation
 )
 from PySide6.QtGui import (
-    QColor
+    QColor, QPainter, QPixmap
 )
 from PySide6.QtWidgets import (
     QWidget, QGraphicsScene,
     QGraphicsObject, QGraphicsItem
 )
 
+from core import tracing
+from core.game.diff import TurnDiff, MERGE, SPAWN
+
 
 TILE_SIZE = 100
 
@@ -22,6 +25,7 @@ class Tile2D(QGraphicsObject):
                  ) -> None:
         super().__init__(parent)
         self.setFlag(QGraphicsItem.GraphicsItemFlag.ItemSendsGeometryChanges)
+        self.setCacheMode(QGraphicsItem.CacheMode.DeviceCoordinateCache)
 
         self.setCell(cell)
         self._value = int(value)
@@ -39,6 +43,18 @@ class Tile2D(QGraphicsObject):
     def value(self):
         return self._value
 
+    _holds = 0
+
+    def hold(self):
+        'Hides the tile until every hold on it is released'
+        self._holds += 1
+        self.setOpacity(0.)
+
+    def release(self):
+        self._holds = max(self._holds - 1, 0)
+        if not self._holds:
+            self.setOpacity(1.)
+
     def setValue(self, v):
         v = int(v)
         if self._value != v:
@@ -49,21 +65,54 @@ class Tile2D(QGraphicsObject):
         return QRect(0, 0, TILE_SIZE, TILE_SIZE)
 
     def paint(self, painter, option, widget):
-        easing = QEasingCurve(QEasingCurve.Type.OutCubic)
-        color = QColor.fromHsvF(
-            (1 - easing.valueForProgress(log2(self.value()) / 11)) / 6,
-            1, 1, 1)
-        painter.fillRect(self.boundingRect(), color)
-        painter.drawRect(self.boundingRect())
-        painter.drawText(
-            self.boundingRect(),
-            f'{self.value()}',
-            Qt.AlignmentFlag.AlignCenter
-        )
+        if self.value() <= 0:
+            return
+        device = painter.device()
+        ratio = device.devicePixelRatioF() if device is not None else 1.
+        painter.drawPixmap(0, 0, tileSprite(self.value(), TILE_SIZE, ratio))
 
 
 class AnimatedTile2D(Tile2D):
-    pass
+    def __init__(self, cell: QPoint, value: int,
+                 parent: QGraphicsItem | None = None
+                 ) -> None:
+        super().__init__(cell, value, parent)
+        # Appearing tiles are scaled, which a device cache would redo
+        self.setCacheMode(QGraphicsItem.CacheMode.ItemCoordinateCache)
+
+
+_sprites: dict[tuple[int, int, float], QPixmap] = {}
+
+
+def tileColor(value: int) -> QColor:
+    easing = QEasingCurve(QEasingCurve.Type.OutCubic)
+    return QColor.fromHsvF(
+        (1 - easing.valueForProgress(log2(value) / 11)) / 6,
+        1, 1, 1)
+
+
+def tileSprite(value: int, size: int, ratio=1.) -> QPixmap:
+    'Prerendered tile of the given value, size and device pixel ratio'
+    key = (value, size, ratio)
+    sprite = _sprites.get(key)
+    if sprite is None:
+        sprite = QPixmap(round(size * ratio), round(size * ratio))
+        sprite.setDevicePixelRatio(ratio)
+        sprite.fill(Qt.GlobalColor.transparent)
+
+        rect = QRect(0, 0, size, size)
+        painter = QPainter(sprite)
+        painter.fillRect(rect, tileColor(value))
+        painter.drawRect(rect.adjusted(0, 0, -1, -1))
+        painter.drawText(rect, f'{value}', Qt.AlignmentFlag.AlignCenter)
+        painter.end()
+
+        _sprites[key] = sprite
+    return sprite
+
+
+def clearSpriteCache():
+    _sprites.clear()
 
 
 class AppearAnimation(QVariantAnimation):
@@ -74,21 +123,30 @@ class AppearAnimation(QVariantAnimation):
 
         self.tile = AnimatedTile2D(cell, value)
         self.tile.setZValue(-1)
-        target_pos = self.tile.pos()
-        center = self.tile.mapRectToScene(self.tile.boundingRect()).center()
-        self.tile.setPos(center)
-
         self.scene = scene
+        # Tile shown once the animation stops
+        self.reveal: Tile2D | None = None
+        self.reset(value, cell)
 
-        self.valueChanged.connect(self.tile.setScale)
-        self.valueChanged.connect(
-            lambda v: self.tile.setPos(
-                center * (1 - v) + target_pos * v)
-        )
+        self.valueChanged.connect(self._step)
         self.setStartValue(0.)
         self.setEndValue(1.)
         self.setDuration(200)
 
+    def reset(self, value: int, cell: QPoint):
+        # Positions are computed, a reused tile was moved and scaled
+        self.tile.setValue(value)
+        self.tile.setCell(cell)
+        self._target = (cell * TILE_SIZE).toPointF()
+        self._center = self._target + QPointF(TILE_SIZE, TILE_SIZE) / 2
+        self.tile.setPos(self._center)
+        self.tile.setScale(0.)
+        self.reveal = None
+
+    def _step(self, v):
+        self.tile.setScale(v)
+        self.tile.setPos(self._center * (1 - v) + self._target * v)
+
     def setDirection(self, direction: QVariantAnimation.Direction) -> None:
         if direction == QVariantAnimation.Direction.Forward:
             self.setEasingCurve(QEasingCurve(QEasingCurve.Type.OutExpo))
@@ -101,71 +159,185 @@ class AppearAnimation(QVariantAnimation):
         newState: QAbstractAnimation.State,
         oldState: QAbstractAnimation.State
     ) -> None:
-        if newState == QAbstractAnimation.State.Running:
-            self.scene.addItem(self.tile)
-        elif newState == QAbstractAnimation.State.Stopped:
-            self.scene.removeItem(self.tile)
+        _updateProxy(self, newState)
         return super().updateState(newState, oldState)
 
 
 class MovingAnimation(QVariantAnimation):
     def __init__(self,
                  new_cell: QPoint, old_cell: QPoint,
-                 scene: 'GameScene') -> None:
+                 scene: 'GameScene', value=0) -> None:
         super().__init__(scene)
 
-        self.tile = AnimatedTile2D(old_cell, 0)
+        self.tile = AnimatedTile2D(old_cell, value)
         self.tile.setZValue(0)
-
         self.scene = scene
+        # Tile shown once the animation stops
+        self.reveal: Tile2D | None = None
 
         self.valueChanged.connect(self.tile.setPos)
+        self.setDuration(100)
+        self.reset(new_cell, old_cell, value)
+
+    def reset(self, new_cell: QPoint, old_cell: QPoint, value=0):
+        self.tile.setValue(value)
+        self.tile.setCell(old_cell)
+        self.tile.setPos((old_cell * TILE_SIZE).toPointF())
         self.setStartValue((old_cell * TILE_SIZE).toPointF())
         self.setEndValue((new_cell * TILE_SIZE).toPointF())
-        self.setDuration(100)
+        self.reveal = None
 
     def updateState(
         self,
         newState: QAbstractAnimation.State,
         oldState: QAbstractAnimation.State
     ) -> None:
-        if newState == QAbstractAnimation.State.Running:
-            self.scene.addItem(self.tile)
-        elif newState == QAbstractAnimation.State.Stopped:
-            self.scene.removeItem(self.tile)
+        _updateProxy(self, newState)
         return super().updateState(newState, oldState)
 
 
+def _updateProxy(anim: AppearAnimation | MovingAnimation,
+                 state: QAbstractAnimation.State):
+    'Shows the proxy tile while running, then the tile it stands for'
+    if state == QAbstractAnimation.State.Running:
+        if anim.tile.scene() is None:
+            anim.scene.addItem(anim.tile)
+    elif state == QAbstractAnimation.State.Stopped:
+        if anim.tile.scene() is not None:
+            anim.scene.removeItem(anim.tile)
+        if anim.reveal is not None:
+            anim.reveal.release()
+            anim.reveal = None
+
+
+class AnimationPool:
+    '''
+    Reusable turn animations of a scene.
+
+    Commands take their animations when a turn is played and give them
+    back once it has finished, so animations and their proxy tiles are
+    only created for the largest turns played at once.
+    '''
+
+    def __init__(self, scene: 'GameScene', limit=256) -> None:
+        self._scene = scene
+        self._limit = limit
+        self._appear: list[AppearAnimation] = []
+        self._moving: list[MovingAnimation] = []
+        self.created = 0
+        self.reused = 0
+
+    def appear(self, value: int, cell: QPoint) -> AppearAnimation:
+        if self._appear:
+            self.reused += 1
+            anim = self._appear.pop()
+            anim.reset(value, cell)
+            return anim
+        self.created += 1
+        return AppearAnimation(value, cell, self._scene)
+
+    def moving(self, new_cell: QPoint, old_cell: QPoint,
+               value=0) -> MovingAnimation:
+        if self._moving:
+            self.reused += 1
+            anim = self._moving.pop()
+            anim.reset(new_cell, old_cell, value)
+            return anim
+        self.created += 1
+        return MovingAnimation(new_cell, old_cell, self._scene, value)
+
+    def release(self, anim: AppearAnimation | MovingAnimation):
+        anim.stop()
+        anim.setParent(self._scene)
+        free = self._appear if isinstance(anim, AppearAnimation) \
+            else self._moving
+        if len(free) < self._limit:
+            free.append(anim)
+        else:
+            anim.deleteLater()
+
+    def size(self) -> int:
+        'Animations waiting to be reused'
+        return len(self._appear) + len(self._moving)
+
+    def clear(self):
+        for anim in self._appear + self._moving:
+            anim.deleteLater()
+        self._appear.clear()
+        self._moving.clear()
+
+
 class GameScene(QGraphicsScene):
     def __init__(self, parent: QWidget | None = None):
         super().__init__(parent)
 
+        # Board tiles by (x, y) cell, animation proxies are not indexed
+        self._tiles: dict[tuple[int, int], Tile2D] = {}
+        self._column_count = 0
+        self._debug = False
+        self._animations = AnimationPool(self)
+
+    def animations(self) -> AnimationPool:
+        return self._animations
+
     def setSize(self, row_count, column_count):
+        self._column_count = column_count
         self.setSceneRect(0, 0,
                           TILE_SIZE * row_count,
                           TILE_SIZE * column_count)
 
-    def findTiles2D(self, cell: QPoint):
-        result: list[Tile2D] = []
+    def setDebug(self, debug: bool):
+        'Verify the cell index against the scene after every change'
+        self._debug = debug
+
+    def checkIndex(self):
+        tiles = [child for child in self.items() if type(child) is Tile2D]
+        if len(tiles) != len(self._tiles) or any(
+            self._tiles.get((tile.cell().x(), tile.cell().y())) is not tile
+            for tile in tiles
+        ):
+            raise RuntimeError(
+                'Tile 2D index does not match the scene: ' +
+                f'{len(self._tiles)} indexed, {len(tiles)} on scene'
+            )
+
+    def invalidateTiles(self):
+        'Rerenders every tile, e.g. after the device pixel ratio changed'
+        clearSpriteCache()
         for child in self.items():
-            if type(child) is Tile2D and child.cell() == cell:
-                result.append(child)
+            if isinstance(child, Tile2D):
+                child.update()
 
-        if result:
-            return result
+    def findTiles2D(self, cell: QPoint):
+        tracing.count('scene.lookups')
+        tile2d = self._tiles.get((cell.x(), cell.y()))
+        if tile2d is not None:
+            return [tile2d]
         raise ValueError(f'Tile 2D for {cell.transposed()} not found on scene')
 
     @Slot(int, QPoint)
     def addTile(self, value: int, cell: QPoint):
+        tracing.count('scene.lookups')
+        key = (cell.x(), cell.y())
+        if key in self._tiles:
+            raise IndexError(
+                f'[Add] Tile 2D for {cell.transposed()} already on scene'
+            )
         tile2d = Tile2D(cell, value)
         tile2d.setZValue(1)
         self.addItem(tile2d)
+        self._tiles[key] = tile2d
+        if self._debug:
+            self.checkIndex()
         return tile2d
 
     @Slot(QPoint)
     def removeTile(self, cell: QPoint):
         tile2d = self.findTiles2D(cell=cell)[0]
+        del self._tiles[(cell.x(), cell.y())]
         self.removeItem(tile2d)
+        if self._debug:
+            self.checkIndex()
         return tile2d
 
     # @Slot(int, QPoint)
@@ -178,6 +350,56 @@ class GameScene(QGraphicsScene):
 
     @Slot(QPoint, QPoint)
     def moveTile(self, new_cell: QPoint, old_cell: QPoint):
-        tile2d = self.findTiles2D(cell=old_cell)[0]
+        tracing.count('scene.lookups', 2)
+        key = (new_cell.x(), new_cell.y())
+        if key in self._tiles:
+            raise IndexError(
+                f'[Move] Tile 2D for {new_cell.transposed()} already on scene'
+            )
+        tile2d = self._tiles.pop((old_cell.x(), old_cell.y()), None)
+        if tile2d is None:
+            raise ValueError(
+                f'Tile 2D for {old_cell.transposed()} not found on scene'
+            )
         tile2d.setCell(new_cell)
+        self._tiles[key] = tile2d
+        if self._debug:
+            self.checkIndex()
         return tile2d
+
+    def cellAt(self, index: int) -> QPoint:
+        'Scene cell of a row-major grid index'
+        row, col = divmod(index, self._column_count)
+        return QPoint(col, row)
+
+    @Slot(object)
+    def applyDiff(self, diff: TurnDiff):
+        '''
+        Plays a turn of the grid on the tiles, without animations. Moved
+        and merged tiles end up in their target cell.
+        '''
+        for kind, a, b in diff.ops():
+            if kind == SPAWN:
+                self.addTile(1 << b, self.cellAt(a))
+                continue
+            target = self.cellAt(b)
+            if kind == MERGE:
+                self.removeTile(target)
+            tile2d = self.moveTile(target, self.cellAt(a))
+            if kind == MERGE:
+                tile2d.setValue(tile2d.value() * 2)
+
+    @Slot(object)
+    def revertDiff(self, diff: TurnDiff):
+        'Takes a turn of the grid back on the tiles'
+        for kind, a, b in reversed(list(diff.ops())):
+            source = self.cellAt(a)
+            if kind == SPAWN:
+                self.removeTile(source)
+                continue
+            target = self.cellAt(b)
+            tile2d = self.moveTile(source, target)
+            if kind == MERGE:
+                value = tile2d.value() // 2
+                tile2d.setValue(value)
+                self.addTile(value, target)
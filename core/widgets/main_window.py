@@ -1,16 +1,65 @@
-from PySide6.QtWidgets import (
-    QMainWindow, QLayout, QGraphicsView
+import os
+
+from PySide6.QtCore import (
+    QEvent, QStandardPaths, QThreadPool, QTimer
 )
 from PySide6.QtGui import (
-    QUndoStack
+    QAction
 )
-
+from PySide6.QtWidgets import (
+    QMainWindow, QLayout, QGraphicsView, QFileDialog, QMessageBox
+)
+from core.ai.expectimax import heuristic, tableTag
+from core.ai.ntuple import NTupleNetwork
+from core.ai.ttable import TranspositionTable
 from core.widgets.game_widget import GameScene
 from core.game.game_controller import GameController
+from core.commands.history import TurnHistory
+from core.game.journal import Journal
+from core.game.replay import Replay
+
+UNDO_LIMIT = 1000
+UNDO_BYTE_LIMIT = 1 << 20
+REPLAY_FILTER = 'Replays (*.2048)'
+JOURNAL_SYNC_INTERVAL = 1000
+HINT_TABLE_SLOTS = 1 << 20
+
+
+def sessionPath() -> str:
+    'Journal of the last session in the application data folder'
+    folder = QStandardPaths.writableLocation(
+        QStandardPaths.StandardLocation.AppDataLocation)
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, 'session.journal')
+
+
+def tablePath() -> str:
+    'Transposition table kept between sessions for hint searches'
+    folder = QStandardPaths.writableLocation(
+        QStandardPaths.StandardLocation.AppDataLocation)
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, 'hints.ttable')
+
+
+def weightsPath() -> str:
+    'N-tuple network weights hints are searched with, when the file exists'
+    folder = QStandardPaths.writableLocation(
+        QStandardPaths.StandardLocation.AppDataLocation)
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, 'hints.ntuple')
 
 
 class MainWindow(QMainWindow):
-    def __init__(self) -> None:
+    '''
+    Game window. With a `session_path` every turn is journaled there and
+    the session left in it is restored. With a `table_path` hint searches
+    share a transposition table stored there. Hints evaluate boards with
+    the n-tuple network at `weights_path` if there is one.
+    '''
+
+    def __init__(self, session_path: str | None = None,
+                 table_path: str | None = None,
+                 weights_path: str | None = None) -> None:
         super().__init__()
         self.layout().setSizeConstraint(QLayout.SizeConstraint.SetFixedSize)
 
@@ -19,18 +68,123 @@ class MainWindow(QMainWindow):
             columns=4,
             parent=self
         )
-        self.undo_stack = QUndoStack(self)
-        self.game.setUndoStack(self.undo_stack)
-        undo_action = self.undo_stack.createUndoAction(self)
-        undo_action.setShortcut('Ctrl+Z')
-        redo_action = self.undo_stack.createRedoAction(self)
-        redo_action.setShortcut('Ctrl+Shift+Z')
-        self.addActions([undo_action, redo_action])
-
         self.scene = GameScene(self)
         self.game.setScene(self.scene)
 
+        self.history = TurnHistory(self.game.grid(), self.scene, self)
+        self.history.setUndoLimit(UNDO_LIMIT)
+        self.history.setByteLimit(UNDO_BYTE_LIMIT)
+        self.game.setHistory(self.history)
+        undo_action = self.history.createUndoAction(self)
+        undo_action.setShortcut('Ctrl+Z')
+        redo_action = self.history.createRedoAction(self)
+        redo_action.setShortcut('Ctrl+Shift+Z')
+        save_action = QAction('Save replay', self)
+        save_action.setShortcut('Ctrl+S')
+        save_action.triggered.connect(self.saveReplay)
+        open_action = QAction('Open replay', self)
+        open_action.setShortcut('Ctrl+O')
+        open_action.triggered.connect(self.openReplay)
+        hint_action = QAction('Hint', self)
+        hint_action.setShortcut('H')
+        hint_action.triggered.connect(self.game.requestHint)
+        self.addActions([undo_action, redo_action, save_action, open_action,
+                         hint_action])
+        self.game.hintReady.connect(self.showHint)
+        self.game.gameOver.connect(self.showGameOver)
+        evaluate = heuristic
+        if weights_path is not None and os.path.exists(weights_path):
+            try:
+                evaluate = NTupleNetwork.load(weights_path).evaluate
+            except (OSError, ValueError):
+                pass
+            self.game.hints().setEvaluate(evaluate)
+        self.table = None
+        if table_path is not None:
+            try:
+                self.table = TranspositionTable(table_path, HINT_TABLE_SLOTS,
+                                                tableTag(evaluate=evaluate))
+            except OSError:
+                pass
+            self.game.hints().setTable(self.table)
+        self.history.indexChanged.connect(self.updateStatus)
+
         self.view = QGraphicsView(self.scene, self)
         self.setCentralWidget(self.view)
 
-        self.game.start()
+        self.journal = None
+        if session_path is not None:
+            try:
+                self.journal = Journal(session_path, max_turns=UNDO_LIMIT,
+                                       max_bytes=UNDO_BYTE_LIMIT)
+            except (OSError, ValueError):
+                # Played without a journal rather than not at all
+                self.journal = None
+        if self.journal is not None:
+            if self.journal.state is not None:
+                try:
+                    self.game.restore(self.journal.state)
+                except (ValueError, IndexError):
+                    self.game.clear()
+                    self.journal.state = None
+            self.game.setJournal(self.journal)
+            # Turns are synced in batches, this bounds how old the last
+            # synced one can get when nothing else is played
+            self.sync_timer = QTimer(self)
+            self.sync_timer.timeout.connect(self.journal.sync)
+            self.sync_timer.start(JOURNAL_SYNC_INTERVAL)
+
+        if self.journal is None or self.journal.state is None:
+            self.game.start()
+
+    def showHint(self, direction, depth: int):
+        if direction is None:
+            self.statusBar().showMessage('No move left')
+        else:
+            self.statusBar().showMessage(
+                f'Hint: {direction.name} (searched {depth} moves ahead)')
+
+    def showGameOver(self):
+        self.statusBar().showMessage(f'Game over, score {self.game.score()}')
+
+    def updateStatus(self):
+        'Clears the last message, unless the turn undone or redone to ends it'
+        if self.game.isGameOver():
+            self.showGameOver()
+        else:
+            self.statusBar().clearMessage()
+
+    def saveReplay(self):
+        path, _ = QFileDialog.getSaveFileName(
+            self, 'Save replay', '', REPLAY_FILTER)
+        if not path:
+            return
+        try:
+            self.game.replay().save(path)
+        except OSError as error:
+            QMessageBox.warning(self, 'Save replay', str(error))
+
+    def openReplay(self):
+        path, _ = QFileDialog.getOpenFileName(
+            self, 'Open replay', '', REPLAY_FILTER)
+        if not path:
+            return
+        try:
+            self.game.playReplay(Replay.load(path))
+        except (OSError, ValueError) as error:
+            QMessageBox.warning(self, 'Open replay', str(error))
+
+    def closeEvent(self, event):
+        if self.journal is not None:
+            self.journal.close()
+        if self.table is not None:
+            self.game.hints().cancel()
+            self.game.hints().setTable(None)
+            QThreadPool.globalInstance().waitForDone()
+            self.table.close()
+        super().closeEvent(event)
+
+    def event(self, event: QEvent) -> bool:
+        if event.type() == QEvent.Type.DevicePixelRatioChange:
+            self.scene.invalidateTiles()
+        return super().event(event)
@@ -0,0 +1,105 @@
+import os
+import tempfile
+import unittest
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PySide6.QtWidgets import QApplication  # noqa: E402
+
+from core.game import journal  # noqa: E402
+from core.game.diff import TurnDiff, SPAWN  # noqa: E402
+from core.game.direction import Direction  # noqa: E402
+from core.game.journal import Journal, SessionState  # noqa: E402
+from core.widgets.main_window import MainWindow  # noqa: E402
+
+
+def _start() -> bytes:
+    return journal._record(journal.START, journal._START.pack(1, 4, 4))
+
+
+def _turn(ops, direction=journal.NO_DIRECTION) -> bytes:
+    return journal._record(journal.TURN,
+                           bytes([direction]) + TurnDiff(ops).toBytes())
+
+
+class BadRecordTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.folder.name, 'session.journal')
+        self.good = _start() + _turn([(SPAWN, 0, 1), (SPAWN, 5, 2)])
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def load(self, bad: bytes) -> Journal:
+        with open(self.path, 'wb') as file:
+            file.write(self.good + bad + _turn([(SPAWN, 1, 1)]))
+        session = Journal(self.path)
+        session.close()
+        return session
+
+    def assertDropped(self, session: Journal):
+        self.assertIsNone(session.state)
+        self.assertEqual(os.path.getsize(self.path), len(self.good))
+
+    def testSpawnOutsideTheBoard(self):
+        self.assertDropped(self.load(_turn([(SPAWN, 20, 1)])))
+
+    def testMergeOfEmptyCells(self):
+        self.assertDropped(self.load(_turn([(journal.MERGE, 2, 3)], 0)))
+
+    def testUnknownDirection(self):
+        self.assertDropped(self.load(_turn([(SPAWN, 1, 1)], 7)))
+
+    def testShortSnapshot(self):
+        self.assertDropped(self.load(
+            journal._record(journal.SNAPSHOT, b'\0' * 5)))
+
+    def testGoodRecordsStillLoad(self):
+        session = self.load(_turn([(SPAWN, 2, 1)], Direction.Left))
+        self.assertEqual(session.state.cells[:6], [1, 1, 1, 0, 0, 2])
+        self.assertEqual(session.state.index, 3)
+
+
+class LimitTest(unittest.TestCase):
+    def testByteLimitTrimsLikeTurnHistory(self):
+        diffs = [TurnDiff([(SPAWN, i, 1)]) for i in range(6)]
+        size = diffs[0].nbytes()
+        state = SessionState(max_turns=0, max_bytes=3 * size)
+        for diff in diffs:
+            state.push(diff, None)
+        self.assertEqual(len(state.turns), 3)
+        self.assertEqual((state.index, state.dropped), (3, 3))
+
+        copy = SessionState.fromBytes(state.toBytes(), 0, 2 * size)
+        copy.push(TurnDiff([(SPAWN, 6, 1)]), None)
+        self.assertEqual(len(copy.turns), 2)
+
+
+class WindowTest(unittest.TestCase):
+    def setUp(self):
+        self.app = QApplication.instance() or QApplication([])
+        self.folder = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def testBadJournalStartsANewGame(self):
+        path = os.path.join(self.folder.name, 'session.journal')
+        with open(path, 'wb') as file:
+            file.write(_start() + _turn([(SPAWN, 20, 1)]))
+        window = MainWindow(path)
+        self.assertFalse(window.game.isGameOver())
+        self.assertTrue(any(window.game.grid().exponents()))
+        window.close()
+
+    def testUnreadableJournalStartsANewGame(self):
+        # A folder where the file should be cannot be opened
+        window = MainWindow(self.folder.name)
+        self.assertIsNone(window.journal)
+        self.assertTrue(any(window.game.grid().exponents()))
+        window.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
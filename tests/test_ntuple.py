@@ -0,0 +1,50 @@
+import os
+import random
+import tempfile
+import unittest
+
+import numpy as np
+
+from core.ai import ntuple
+from core.ai.ntuple import NTupleNetwork, mergeDeltas
+
+
+class MergeDeltasTest(unittest.TestCase):
+    def testSharedIndicesTakeTheMean(self):
+        index, delta = mergeDeltas([
+            (np.array([1, 5]), np.array([1., 2.], np.float32)),
+            (np.array([5, 9]), np.array([4., -1.], np.float32)),
+        ])
+        self.assertEqual(index.tolist(), [1, 5, 9])
+        self.assertEqual(delta.tolist(), [1., 3., -1.])
+
+    def testStepDoesNotGrowWithWorkers(self):
+        # Workers that all learn the same thing move the weights as one
+        chunk = (np.array([3, 7]), np.array([.5, -.25], np.float32))
+        single = mergeDeltas([chunk])
+        for workers in (2, 8):
+            index, delta = mergeDeltas([chunk] * workers)
+            self.assertEqual(index.tolist(), single[0].tolist())
+            self.assertEqual(delta.tolist(), single[1].tolist())
+
+
+class TrainChunkTest(unittest.TestCase):
+    def testDeltasMatchWholeTableDifference(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'weights.ntuple')
+            NTupleNetwork.create(path).flush()
+            index, delta, scores, _ = ntuple._trainChunk(
+                path, 0, range(2), ntuple.LEARNING_RATE)
+
+            network = NTupleNetwork(np.zeros(
+                len(ntuple.PATTERNS) << 16, np.float32))
+            for game in range(2):
+                ntuple.trainGame(network, random.Random(game))
+            expected = np.flatnonzero(network.weights)
+            self.assertEqual(len(scores), 2)
+            self.assertEqual(index.tolist(), expected.tolist())
+            np.testing.assert_array_equal(delta, network.weights[expected])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+import os
+import tempfile
+import unittest
+
+from core.ai import ttable
+from core.ai.ttable import TranspositionTable
+
+
+class ReplacementTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.folder.name, 'table.ttable')
+        self.table = TranspositionTable(self.path, slots=8)
+        # Keys starting on the same slot, one more than the probes take
+        first = self.table._first(1, ttable.CHANCE)
+        self.keys = [key for key in range(1, 1 << 16)
+                     if self.table._first(key, ttable.CHANCE) == first
+                     ][:ttable.PROBES + 1]
+
+    def tearDown(self):
+        self.table.close()
+        self.folder.cleanup()
+
+    def fill(self, depth: int):
+        for key in self.keys[:ttable.PROBES]:
+            self.table.store(key, depth, float(key))
+
+    def testDeeperEntriesStayInTheirGeneration(self):
+        self.fill(5)
+        self.table.store(self.keys[-1], 4, 0.)
+        self.assertIsNone(self.table.probe(self.keys[-1]))
+
+    def testOldEntriesMakeRoom(self):
+        self.fill(5)
+        self.table.newGeneration()
+        self.table.store(self.keys[-1], 1, 0.)
+        self.assertEqual(self.table.probe(self.keys[-1]), (1, 0., 0xFF))
+
+    def testReopeningStartsAGeneration(self):
+        self.fill(5)
+        self.table.close()
+        self.table = TranspositionTable(self.path, slots=8)
+        self.assertEqual(self.table.probe(self.keys[0]),
+                         (5, float(self.keys[0]), 0xFF))
+        self.table.store(self.keys[-1], 1, 0.)
+        self.assertIsNotNone(self.table.probe(self.keys[-1]))
+
+    def testProbeNeverWrites(self):
+        self.fill(5)
+        self.table.newGeneration()
+        before = bytes(self.table._mmap)
+        for key in self.keys:
+            self.table.probe(key)
+        self.assertEqual(bytes(self.table._mmap), before)
+
+    def testRacingStoreReadsAsMiss(self):
+        # A store of another key into the slot of `key`, replayed word by
+        # word in the order store writes them, with probes in between
+        key, other = self.keys[:2]
+        self.table.store(key, 1, 1.)
+        words = self.table._words
+        slot = next(slot for slot in range(0, len(words), 3)
+                    if words[slot + 1] & ttable._VALID)
+        info = ttable._info(ttable.CHANCE, 2, ttable.NO_MOVE,
+                            self.table.generation)
+        bits, = ttable._WORD.unpack(ttable._FLOAT.pack(2.))
+
+        words[slot + 2] = bits
+        self.assertIsNone(self.table.probe(key))
+        words[slot + 1] = info
+        self.assertIsNone(self.table.probe(key))
+        words[slot] = other ^ info ^ bits
+        self.assertIsNone(self.table.probe(key))
+        self.assertEqual(self.table.probe(other), (2, 2., ttable.NO_MOVE))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import os
+import unittest
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+from PySide6.QtCore import QPoint  # noqa: E402
+from PySide6.QtWidgets import QApplication, QWidget  # noqa: E402
+
+from core.commands.turn_commands import TurnCommand  # noqa: E402
+from core.game.diff import TurnDiff, MOVE, MERGE  # noqa: E402
+from core.game.game_controller import GameController  # noqa: E402
+from core.widgets.game_widget import GameScene  # noqa: E402
+
+
+class TurnCommandTest(unittest.TestCase):
+    def setUp(self):
+        self.app = QApplication.instance() or QApplication([])
+        self.widget = QWidget()
+        self.controller = GameController(1, 4, self.widget)
+        self.scene = GameScene(self.widget)
+        self.controller.setScene(self.scene)
+        self.grid = self.controller.grid()
+        # [0, 2, 2, 0] moved left
+        for col in (1, 2):
+            self.grid.addTile(0, col, 2)
+            self.scene.addTile(2, QPoint(col, 0))
+        self.diff = TurnDiff([(MOVE, 1, 0), (MERGE, 2, 0)], 4)
+
+    def tearDown(self):
+        self.widget.deleteLater()
+
+    def movedValues(self, command: TurnCommand) -> list[int]:
+        group = command.move_anim
+        return [group.animationAt(i).tile.value()
+                for i in range(group.animationCount())]
+
+    def testSlideKeepsValueBeforeMerge(self):
+        command = TurnCommand(self.diff, self.scene, self.grid)
+        command.redo()
+        self.assertEqual(self.grid.exponents(), [2, 0, 0, 0])
+        self.assertEqual(self.movedValues(command), [2, 2])
+        command.finish()
+
+    def testUndoSlidesOriginalValues(self):
+        TurnCommand(self.diff, self.scene, self.grid).redo()
+        command = TurnCommand(self.diff, self.scene, self.grid)
+        command.undo()
+        self.assertEqual(self.grid.exponents(), [0, 1, 1, 0])
+        self.assertEqual(self.movedValues(command), [2, 2])
+        command.finish()
+
+    def testTileShownAfterLastAnimationIntoIt(self):
+        # Both the slide and the merge end in cell 0
+        command = TurnCommand(self.diff, self.scene, self.grid)
+        command.redo()
+        tile2d = self.scene.findTiles2D(QPoint(0, 0))[0]
+        self.assertEqual(tile2d.opacity(), 0.)
+        command.move_anim.animationAt(0).stop()
+        self.assertEqual(tile2d.opacity(), 0.)
+        command.finish()
+        self.assertEqual(tile2d.opacity(), 1.)
+
+
+if __name__ == '__main__':
+    unittest.main()